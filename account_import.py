@@ -0,0 +1,155 @@
+"""
+Bulk creation of student login accounts and profiles from a CSV or Excel sheet.
+
+The sheet needs a username column ('Username', 'Student Name' or 'Name'); any of the
+profile columns below may also be present, plus 'Password' to set passwords instead
+of generating them. Rows are checked against the existing accounts with a set of
+name keys (search_index.name_key, so "Adams" and "adams " clash), ids come from a
+counter started once at the current maximum,
+and the result is a plan - accounts, profiles and a credentials sheet - that the
+portal saves with one write per data file.
+
+This module must not import streamlit.
+"""
+import io
+import secrets
+
+import pandas as pd
+
+from auth import default_password_hash, hash_password
+from excel_import import read_workbook_sheets
+from search_index import name_key
+from storage import record_stamp
+
+# Normalised header (lowercase, no spaces/underscores) -> record field
+ACCOUNT_COLUMNS = {
+    "username": "username",
+    "studentname": "username",
+    "name": "username",
+    "password": "password",
+    "age": "age",
+    "regnumber": "reg_number",
+    "registrationnumber": "reg_number",
+    "registrationno.": "reg_number",
+    "regno": "reg_number",
+    "class": "class_name",
+    "classname": "class_name",
+    "parentname": "parent_name",
+    "parent/guardianname": "parent_name",
+    "parentphone": "parent_phone",
+    "parentphonenumber": "parent_phone",
+    "parentaddress": "parent_address",
+    "session": "session",
+    "academicsession": "session",
+    "term": "term",
+    "academicterm": "term",
+}
+PROFILE_FIELDS = ["age", "reg_number", "class_name", "parent_name", "parent_phone", "parent_address", "session", "term"]
+
+# Generated passwords avoid look-alike characters (0/O, 1/l/I) since they are handed out on paper
+PASSWORD_ALPHABET = "abcdefghjkmnpqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+GENERATED_PASSWORD_LENGTH = 8
+
+
+def generate_password(length=GENERATED_PASSWORD_LENGTH):
+    return "".join(secrets.choice(PASSWORD_ALPHABET) for _ in range(length))
+
+
+def _normalize_header(value):
+    return str(value).strip().lower().replace(' ', '').replace('_', '').replace('-', '')
+
+
+def read_account_sheet(source_name, source):
+    """
+    Reads the first sheet of an .xlsx upload, or a .csv upload, into a DataFrame of
+    strings with columns renamed to record fields. Unknown columns are dropped.
+    """
+    if source_name.lower().endswith(".csv"):
+        data = source.getvalue() if hasattr(source, 'getvalue') else source.read()
+        frame = pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False)
+    else:
+        raw = next(iter(read_workbook_sheets(source).values()))
+        frame = raw.iloc[1:].reset_index(drop=True)
+        frame.columns = ["" if pd.isna(c) else str(c) for c in raw.iloc[0]]
+        frame = frame.astype(object).where(frame.notna(), "").astype(str)
+
+    columns = {c: ACCOUNT_COLUMNS[_normalize_header(c)] for c in frame.columns if _normalize_header(c) in ACCOUNT_COLUMNS}
+    if "username" not in columns.values():
+        raise ValueError("No username column found. Add a 'Username' (or 'Student Name') column.")
+    frame = frame[list(columns)].rename(columns=columns)
+    # Two headers mapping to one field (e.g. 'Name' and 'Username'): keep the first
+    frame = frame.loc[:, ~frame.columns.duplicated()]
+    return frame.apply(lambda column: column.str.strip())
+
+
+def plan_account_import(frame, existing_usernames, next_id, existing_profiles=None, generate_passwords=True, default_password="123456"):
+    """
+    Works out what to create for each row of a read_account_sheet frame.
+    existing_usernames: name keys (search_index.name_key) of students that already exist.
+    existing_profiles: anything with .get(student_name) returning a profile to update.
+    Rows without a password get a generated one (or default_password when
+    generate_passwords is False). Returns a dict with 'accounts', 'profiles',
+    'credentials' (username, plain password and profile columns, for handing out),
+    'profile_stamps' (record_stamp of each existing profile the plan updates, None for
+    new ones, to save with as expected stamps) and 'errors'.
+    """
+    if existing_profiles is None:
+        existing_profiles = {}
+    seen = set(existing_usernames)
+    accounts, profiles, credentials, errors = [], [], [], []
+    profile_stamps = {}
+
+    for row_number, row in enumerate(frame.to_dict(orient='records'), start=2):
+        username = row.get("username", "")
+        if not username:
+            errors.append({"row": row_number, "username": "", "error": "Missing username; row skipped."})
+            continue
+        key = name_key(username)
+        if key in seen:
+            problem = "Username already exists" if key in existing_usernames else "Username appears earlier in this file"
+            errors.append({"row": row_number, "username": username, "error": f"{problem}; row skipped."})
+            continue
+        seen.add(key)
+
+        password = row.get("password") or (generate_password() if generate_passwords else default_password)
+        accounts.append({"id": next_id, "username": username, "password": password})
+        next_id += 1
+
+        supplied = {field: row[field] for field in PROFILE_FIELDS if row.get(field)}
+        if "age" in supplied:
+            try:
+                supplied["age"] = int(float(supplied["age"]))
+            except ValueError:
+                errors.append({"row": row_number, "username": username, "error": f"Age '{supplied['age']}' is not a number; left blank."})
+                supplied["age"] = ""
+        existing = existing_profiles.get(username)
+        profile_stamps[username] = record_stamp(existing)
+        base = existing or {field: "" for field in PROFILE_FIELDS}
+        profiles.append(dict(base, student_name=username, **supplied))
+        credentials.append(dict({"username": username, "password": password}, **{f: supplied.get(f, "") for f in ("reg_number", "class_name")}))
+
+    return {"accounts": accounts, "profiles": profiles, "credentials": credentials, "profile_stamps": profile_stamps,
+            "errors": errors}
+
+
+def hash_account_passwords(accounts, default_password=None, progress=None):
+    """
+    Replaces each account's plain password with a hash. Accounts using default_password
+    share one hash (see auth.default_password_hash); the rest are hashed individually.
+    progress(done, total) is called as it goes. Returns new account dicts.
+    """
+    hashed = []
+    for done, account in enumerate(accounts, start=1):
+        password = account["password"]
+        stored = default_password_hash(password) if password == default_password else hash_password(password)
+        hashed.append(dict(account, password=stored))
+        if progress:
+            progress(done, len(accounts))
+    return hashed
+
+
+def credentials_csv(credentials):
+    """The credentials sheet to hand out, as CSV bytes."""
+    return pd.DataFrame(credentials, columns=["username", "password", "reg_number", "class_name"]).rename(columns={
+        "username": "Username", "password": "Password", "reg_number": "Registration No.", "class_name": "Class",
+    }).to_csv(index=False).encode('utf-8')
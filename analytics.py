@@ -0,0 +1,137 @@
+"""
+Class-wide results analytics.
+
+Every partition of results (one session and term, see results_history.py) is flattened
+into a long DataFrame - one row per student and subject - and reduced with groupby to
+a few small additive tables: per-subject counts, sums and pass counts, grade counts,
+and per-student totals, all keyed by class. Those summaries are cached per partition
+and only rebuilt for a partition whose results (or its students' class on their
+profiles) changed, so the dashboard combines already-reduced tables instead of
+re-reading every result.
+Averages and pass rates are derived from the combined sums and counts at the end,
+which is what makes summaries from different terms and classes safe to add up.
+"""
+import threading
+
+import pandas as pd
+
+from grading import DEFAULT_GRADING_SCALE, validate_grading_scale
+from metrics import metrics
+from ranking import record_scope
+
+LONG_COLUMNS = ["student_name", "class_name", "session", "term", "Subject", "Final", "Grade"]
+
+
+def pass_mark(scale=None):
+    """
+    The lowest Final score that is not a fail: the lowest band counts as failing and
+    everything above it passes (50 on the default scale, 40 on the WAEC scale).
+    """
+    bands = validate_grading_scale(scale or DEFAULT_GRADING_SCALE)
+    return bands[-2]["min_score"] if len(bands) > 1 else bands[-1]["min_score"]
+
+
+def results_long_frame(results_records, profiles_by_name=None):
+    """
+    Flattens result records into one row per (student, subject) with the student's
+    class, session and term. profiles_by_name is anything with .get(student_name).
+    """
+    if profiles_by_name is None:
+        profiles_by_name = {}
+    rows = []
+    for record in results_records:
+        name = record['student_name']
+        class_name, session, term = record_scope(record, profiles_by_name.get(name))
+        for subject_row in record.get('results', []):
+            rows.append((name, class_name, session, term, subject_row.get('Subject'), subject_row.get('Final'), subject_row.get('Grade')))
+    long_df = pd.DataFrame(rows, columns=LONG_COLUMNS)
+    long_df['Final'] = pd.to_numeric(long_df['Final'], errors='coerce')
+    return long_df.dropna(subset=['Final'])
+
+
+class PartitionSummary:
+    """Additive aggregates for one partition's long frame."""
+
+    def __init__(self, subject_stats, grade_counts, student_totals):
+        self.subject_stats = subject_stats    # class_name, Subject, entries, score_sum, passes, lowest, highest
+        self.grade_counts = grade_counts      # class_name, Subject, Grade, count
+        self.student_totals = student_totals  # student_name, class_name, session, term, subjects, total_score
+
+
+def summarize_partition(long_df, passing_score):
+    """Reduces a long frame to a PartitionSummary."""
+    long_df = long_df.assign(passed=long_df['Final'] >= passing_score)
+    subject_stats = long_df.groupby(['class_name', 'Subject']).agg(
+        entries=('Final', 'size'),
+        score_sum=('Final', 'sum'),
+        passes=('passed', 'sum'),
+        lowest=('Final', 'min'),
+        highest=('Final', 'max'),
+    ).reset_index()
+    grade_counts = long_df.groupby(['class_name', 'Subject', 'Grade']).size().rename('count').reset_index()
+    student_totals = long_df.groupby(['student_name', 'class_name', 'session', 'term']).agg(
+        subjects=('Final', 'size'),
+        total_score=('Final', 'sum'),
+    ).reset_index()
+    return PartitionSummary(subject_stats, grade_counts, student_totals)
+
+
+def combine_summaries(summaries, class_name=None):
+    """
+    Adds up partition summaries (optionally for one class only) and derives the figures
+    the dashboard shows. Returns a dict of DataFrames: 'subjects', 'grades' and 'students'.
+    """
+    summaries = list(summaries)
+    if not summaries:
+        return {"subjects": pd.DataFrame(), "grades": pd.DataFrame(), "students": pd.DataFrame()}
+    subject_stats = pd.concat([s.subject_stats for s in summaries], ignore_index=True)
+    grade_counts = pd.concat([s.grade_counts for s in summaries], ignore_index=True)
+    students = pd.concat([s.student_totals for s in summaries], ignore_index=True)
+    if class_name is not None:
+        subject_stats = subject_stats[subject_stats['class_name'] == class_name]
+        grade_counts = grade_counts[grade_counts['class_name'] == class_name]
+        students = students[students['class_name'] == class_name]
+
+    subjects = subject_stats.groupby('Subject').agg(
+        entries=('entries', 'sum'), score_sum=('score_sum', 'sum'), passes=('passes', 'sum'),
+        lowest=('lowest', 'min'), highest=('highest', 'max'),
+    )
+    subjects['average'] = (subjects['score_sum'] / subjects['entries']).round(1)
+    subjects['pass_rate'] = (subjects['passes'] / subjects['entries'] * 100).round(1)
+    subjects = subjects.sort_values('average', ascending=False)
+
+    grades = grade_counts.pivot_table(index='Subject', columns='Grade', values='count', aggfunc='sum', fill_value=0)
+
+    students = students.assign(average=(students['total_score'] / students['subjects']).round(1))
+    students = students.sort_values('total_score', ascending=False, ignore_index=True)
+    return {"subjects": subjects, "grades": grades, "students": students}
+
+
+class AnalyticsCache:
+    """
+    PartitionSummary per partition, rebuilt only when the stamp passed in for that
+    partition changes (callers use the partition store's version and its ranking.ScopeStampCache stamp).
+    """
+
+    def __init__(self):
+        self._entries = {} # partition -> (stamp, PartitionSummary)
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, partition, stamp, results_records, profiles_by_name=None, passing_score=50):
+        """results_records may be a function returning them, called only when a rebuild is needed."""
+        with self._lock:
+            cached = self._entries.get(partition)
+            if cached is not None and cached[0] == (stamp, passing_score):
+                return cached[1]
+        if callable(results_records):
+            results_records = results_records()
+        summary = summarize_partition(results_long_frame(results_records, profiles_by_name), passing_score)
+        with self._lock:
+            self._entries[partition] = ((stamp, passing_score), summary)
+            self.builds += 1
+        return summary
+
+
+analytics_cache = AnalyticsCache()
+metrics.register_collector("analytics_cache", lambda: {"builds": analytics_cache.builds})
@@ -0,0 +1,226 @@
+"""
+Registry of the images used on report cards: the school crest, the three signatures
+and each student's photo.
+
+Every image is loaded once, checked, converted to something fpdf embeds cheaply
+(alpha flattened onto white, palette images made RGB, downsized to what a printed
+card needs) and parsed into fpdf's image structure a single time. Documents then
+share that parsed image instead of re-reading and re-decoding the PNG, so rendering
+a whole class decodes each signature once per process rather than once per card.
+Files are re-checked by mtime (at most every RELOAD_CHECK_SECONDS), so replacing a
+signature takes effect without restarting the app.
+
+The pre-parsing uses fpdf 1.7's private image parsers, so it is only done with an fpdf
+version known to have them (see parse_for_pdf); with any other version the prepared
+file is handed to fpdf's public image() instead, which parses it once per document.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+import fpdf
+from fpdf import FPDF
+from PIL import Image
+
+ASSETS_DIR = os.path.join(os.path.dirname(__file__), "assets")
+# Prepared (converted, downsized) copies are written here; the originals are never modified
+PREPARED_DIR = os.path.join(tempfile.gettempdir(), "report_card_assets")
+
+LOGO_FILE = "ICY.png"
+SIGNATURE_FILES = {
+    "class_teacher": "class_teacher_signature.png",
+    "hod": "hod_signature.png",
+    "principal": "principal_signature.png",
+}
+
+# Longest side in pixels after downsizing; about 300 dpi at the 25-30 mm the card prints them
+MAX_IMAGE_PX = 400
+PHOTO_JPEG_QUALITY = 85
+RELOAD_CHECK_SECONDS = 2.0
+
+# fpdf releases whose private _parsepng/_parsejpg return the image dict fpdf.image() keeps
+PARSER_FPDF_VERSIONS = ("1.7",)
+
+
+def student_photo_file(student_name):
+    return f"{student_name} Image.png"
+
+
+class ImageAsset:
+    """A validated, prepared image and fpdf's parsed form of it."""
+
+    def __init__(self, name, source_path, prepared_path, stamp, width, height, pdf_info):
+        self.name = name
+        self.source_path = source_path
+        self.prepared_path = prepared_path
+        self.stamp = stamp          # (size, mtime_ns) of the source file
+        self.width = width
+        self.height = height
+        self.pdf_info = pdf_info    # fpdf's image dict (including the encoded data), or None (see parse_for_pdf)
+
+    @property
+    def version(self):
+        return f"{self.stamp[0]}-{self.stamp[1]}"
+
+
+def _private_parsers_usable():
+    version = str(getattr(fpdf, "FPDF_VERSION", ""))
+    return (version.startswith(PARSER_FPDF_VERSIONS)
+            and hasattr(FPDF, "_parsepng") and hasattr(FPDF, "_parsejpg"))
+
+
+PRIVATE_PARSERS = _private_parsers_usable()
+
+
+def parse_for_pdf(prepared_path, kind):
+    """
+    fpdf's parsed image dict for a prepared file, or None when this fpdf version isn't
+    one whose private parsers are known (PARSER_FPDF_VERSIONS); callers then place the
+    file with fpdf's public image() instead.
+    """
+    if not PRIVATE_PARSERS:
+        return None
+    parser = FPDF()
+    return parser._parsejpg(prepared_path) if kind == "photo" else parser._parsepng(prepared_path)
+
+
+def _prepare_image(source_path, prepared_base, kind):
+    """
+    Opens and validates an image, flattens transparency, downsizes it and saves it as
+    JPEG (photos) or PNG (crest, signatures). Returns (prepared path, width, height).
+    The file is written under a temporary name and renamed into place, so a render
+    worker preparing the same image never reads another one's half-written copy.
+    """
+    with Image.open(source_path) as original:
+        original.load() # Forces a full decode, so truncated/corrupt files fail here
+        image = original
+        if image.mode in ("P", "LA", "RGBA") or "transparency" in image.info:
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[-1])
+            image = background
+        elif image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.thumbnail((MAX_IMAGE_PX, MAX_IMAGE_PX))
+
+        extension, save_options = (".jpg", {"format": "JPEG", "quality": PHOTO_JPEG_QUALITY}) if kind == "photo" \
+            else (".png", {"format": "PNG", "optimize": True})
+        prepared_path = prepared_base + extension
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(prepared_base), suffix=extension)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, **save_options)
+            os.replace(temp_path, prepared_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return prepared_path, image.width, image.height
+
+
+class AssetRegistry:
+    """
+    Process-wide cache of ImageAssets, keyed by file name within the assets folder.
+    Images are decoded without holding the registry lock, under a lock of their own,
+    so a slow photo doesn't hold up cards that only need the (cached) crest.
+    """
+
+    def __init__(self, assets_dir=ASSETS_DIR, prepared_dir=PREPARED_DIR):
+        self.assets_dir = assets_dir
+        self.prepared_dir = prepared_dir
+        self._assets = {}        # name -> ImageAsset, or None if missing/invalid
+        self._stamps = {}        # name -> source stamp the entry was built from (none after a failed load, so it is retried)
+        self._checked_at = {}    # name -> time.monotonic() of the last stat()
+        self._loading = {}       # name -> lock held while that file is checked and loaded
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.errors = {}         # name -> last error message
+
+    def _stat(self, path):
+        try:
+            info = os.stat(path)
+            return (info.st_size, info.st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+    def get(self, name, kind="graphic"):
+        """
+        Returns the ImageAsset for a file in the assets folder, or None if it is missing
+        or not a usable image. kind is "photo" (saved as JPEG) or "graphic" (PNG).
+        """
+        with self._lock:
+            if name in self._assets and time.monotonic() - self._checked_at.get(name, 0) < RELOAD_CHECK_SECONDS:
+                return self._assets[name]
+            loading = self._loading.setdefault(name, threading.Lock())
+
+        with loading:
+            now = time.monotonic()
+            with self._lock:
+                # Another thread may have checked it while we waited
+                if name in self._assets and now - self._checked_at.get(name, 0) < RELOAD_CHECK_SECONDS:
+                    return self._assets[name]
+            source_path = os.path.join(self.assets_dir, name)
+            stamp = self._stat(source_path)
+            if name in self._assets and self._stamps.get(name) == stamp:
+                with self._lock:
+                    self._checked_at[name] = now
+                    return self._assets[name]
+
+            asset, error = None, None
+            if stamp:
+                try:
+                    asset = self._load(name, source_path, stamp, kind)
+                except Exception as e:
+                    error = str(e)
+                    print(f"Warning: Could not load image asset {source_path}: {e}") # For debugging in console
+            with self._lock:
+                replaced = self._assets.get(name)
+                if error:
+                    # Possibly transient (e.g. the file is still being copied in): tried
+                    # again after RELOAD_CHECK_SECONDS even if the file doesn't change
+                    self.errors[name] = error
+                    self._stamps.pop(name, None)
+                else:
+                    self.errors.pop(name, None)
+                    self._stamps[name] = stamp
+                if asset:
+                    self.loads += 1
+                self._assets[name] = asset
+                self._checked_at[name] = now
+            # The prepared copy of the version being replaced is no longer needed
+            if replaced is not None and (asset is None or asset.prepared_path != replaced.prepared_path):
+                try:
+                    os.remove(replaced.prepared_path)
+                except FileNotFoundError:
+                    pass
+            return asset
+
+    def _load(self, name, source_path, stamp, kind):
+        """Prepares and parses one image; raises if it is not usable."""
+        os.makedirs(self.prepared_dir, exist_ok=True)
+        digest = hashlib.sha1(f"{source_path}:{stamp}".encode('utf-8')).hexdigest()[:16]
+        prepared_base = os.path.join(self.prepared_dir, digest)
+        prepared_path, width, height = _prepare_image(source_path, prepared_base, kind)
+        return ImageAsset(name, source_path, prepared_path, stamp, width, height, parse_for_pdf(prepared_path, kind))
+
+    def logo(self):
+        return self.get(LOGO_FILE)
+
+    def signature(self, role):
+        return self.get(SIGNATURE_FILES[role])
+
+    def student_photo(self, student_name):
+        return self.get(student_photo_file(student_name), kind="photo")
+
+    def version(self, name, kind="graphic"):
+        """A string that changes whenever the file behind `name` changes ('missing' if absent)."""
+        asset = self.get(name, kind)
+        return asset.version if asset else "missing"
+
+    def stats(self):
+        with self._lock:
+            return {"assets": sum(1 for a in self._assets.values() if a), "loads": self.loads, "errors": dict(self.errors)}
+
+
+asset_registry = AssetRegistry()
@@ -0,0 +1,132 @@
+"""
+Password hashing and login sessions.
+
+Passwords are stored as salted scrypt hashes ("scrypt$n$r$p$salt$hash", standard
+library only). Accounts created before hashing still hold the plain password;
+verify_password accepts those, reports that they need upgrading, and the portal
+replaces them with a hash on the next successful login.
+
+Hashing is deliberately slow, so it happens once per login: a successful login gets
+a random session token, and every later rerun only looks that token up in
+SessionRegistry (a dict access) instead of checking the password again.
+
+This module must not import streamlit.
+"""
+import base64
+import functools
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+
+# scrypt cost parameters: ~16 MB of memory and a few tens of milliseconds per hash
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+
+SESSION_TTL_SECONDS = 12 * 60 * 60
+
+# Checked instead when there is no stored credential (e.g. no such account), so that a
+# failed login takes as long whether or not the username exists. Its password is unknown.
+DUMMY_PASSWORD_HASH = "scrypt$16384$8$1$YYG8jUEDQ4kDBkzX7Kq5kQ==$F+GzGK0RYVAczhQfXX2H+iHI0hZsO5dDTcZjTX3Rqz4="
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p, maxmem=128 * r * n * 2, dklen=32)
+
+
+def hash_password(password):
+    """Returns a salted scrypt hash of password in the 'scrypt$n$r$p$salt$hash' format."""
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+
+
+@functools.lru_cache(maxsize=8)
+def default_password_hash(password):
+    """
+    One hash shared by every account created with the same default password, so adding
+    a class of accounts costs one hash rather than one per student. The default is
+    public anyway; a student's own password always gets its own salt.
+    """
+    return hash_password(password)
+
+
+def is_password_hash(stored):
+    return isinstance(stored, str) and stored.startswith("scrypt$")
+
+
+def verify_password(password, stored):
+    """
+    Checks password against a stored credential in constant time. Returns
+    (matches, needs_upgrade): needs_upgrade is True when the stored value is a plain
+    password or a hash made with older cost parameters. A missing stored credential
+    (None, e.g. for an unknown username) costs the same scrypt hash and never matches.
+    """
+    if not isinstance(stored, str) or not stored:
+        verify_password(password, DUMMY_PASSWORD_HASH)
+        return False, False
+    if not is_password_hash(stored):
+        # Legacy plain-text password
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8')), True
+    try:
+        _, n, r, p, salt, digest = stored.split("$")
+        n, r, p = int(n), int(r), int(p)
+        expected = base64.b64decode(digest)
+        actual = _scrypt(password, base64.b64decode(salt), n, r, p)
+    except (ValueError, TypeError) as e:
+        print(f"Warning: Unreadable password hash: {e}") # For debugging in console
+        return False, False
+    matches = hmac.compare_digest(actual, expected)
+    return matches, matches and (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+class SessionRegistry:
+    """Logged-in sessions by random token, so a password is verified once per login."""
+
+    def __init__(self, ttl_seconds=SESSION_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._sessions = {} # token -> {"username", "role", "expires"}
+        self._lock = threading.Lock()
+
+    def issue(self, username, role):
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._sessions[token] = {"username": username, "role": role, "expires": time.monotonic() + self.ttl_seconds}
+        return token
+
+    def validate(self, token):
+        """Returns (username, role) for a live session token, else None."""
+        if not token:
+            return None
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+            if session["expires"] < time.monotonic():
+                del self._sessions[token]
+                return None
+            return session["username"], session["role"]
+
+    def revoke(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def revoke_user(self, username):
+        """Ends every session of a user, e.g. after their password changes or the account is removed."""
+        with self._lock:
+            for token in [t for t, s in self._sessions.items() if s["username"] == username]:
+                del self._sessions[token]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+auth_sessions = SessionRegistry()
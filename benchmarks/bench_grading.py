@@ -0,0 +1,85 @@
+"""
+Micro-benchmark: the original row-by-row calculate_grades against grading.grade_scores.
+
+Usage (from the repository root):
+    python benchmarks/bench_grading.py [--rows 1000 10000 100000] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from grading import grade_scores  # noqa: E402
+
+
+def legacy_calculate_grades(df_scores):
+    """The implementation grade_scores replaced, kept here for comparison."""
+    if df_scores.empty:
+        return df_scores
+
+    df_scores['CA1'] = pd.to_numeric(df_scores['CA1'], errors='coerce').fillna(0)
+    df_scores['CA2'] = pd.to_numeric(df_scores['CA2'], errors='coerce').fillna(0)
+    df_scores['Exam'] = pd.to_numeric(df_scores['Exam'], errors='coerce').fillna(0)
+
+    df_scores['Final'] = df_scores['CA1'] + df_scores['CA2'] + df_scores['Exam']
+
+    def get_grade_remark(score):
+        if score >= 75:
+            return "A", "Excellent"
+        elif score >= 60:
+            return "B", "Very Good"
+        elif score >= 50:
+            return "C", "Credit"
+        else:
+            return "F", "Failed"
+
+    df_scores[['Grade', 'Remark']] = df_scores['Final'].apply(lambda x: pd.Series(get_grade_remark(x)))
+    return df_scores
+
+
+def make_scores(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "Subject": rng.choice(["English", "Math", "Biology", "Chemistry", "Physics"], rows),
+        "CA1": rng.integers(0, 21, rows),
+        "CA2": rng.integers(0, 21, rows),
+        "Exam": rng.integers(0, 61, rows),
+    })
+
+
+def best_time(func, df, repeat):
+    timings = []
+    for _ in range(repeat):
+        frame = df.copy()
+        start = time.perf_counter()
+        func(frame)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'legacy (s)':>12} {'vectorised (s)':>15} {'speed-up':>10}")
+    for rows in args.rows:
+        df = make_scores(rows)
+        # Both implementations must agree before their timings mean anything
+        expected = legacy_calculate_grades(df.copy())
+        actual = grade_scores(df.copy())
+        assert (expected[['Final', 'Grade', 'Remark']].astype(str).values == actual[['Final', 'Grade', 'Remark']].astype(str).values).all()
+
+        legacy = best_time(legacy_calculate_grades, df, args.repeat)
+        vectorised = best_time(grade_scores, df, args.repeat)
+        print(f"{rows:>10} {legacy:>12.4f} {vectorised:>15.4f} {legacy / vectorised:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
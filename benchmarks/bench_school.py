@@ -0,0 +1,253 @@
+"""
+School-scale benchmark suite: builds synthetic schools (see synthetic_school.py) and
+times the portal's core operations on each, writing a JSON report.
+
+Usage (from the repository root):
+    python benchmarks/bench_school.py [--students 100 1000 10000 50000] [--subjects 15] [--terms 3]
+                                      [--backend json|sqlite] [--repeat 3] [--output report.json]
+                                      [--compare baseline.json [--threshold 1.25]]
+
+Operations timed for each school size:
+  save_bulk       write every account, profile and one term's results (one batch per store)
+  save_single     upsert one student's results into the full store (mean per save)
+  load            cold load of one term's results from disk
+  grading         grade_scores over one term's subject rows
+  excel_parse     read and grade every class workbook (import_result_workbooks)
+  rank            build_rank_index for one term
+  login_lookup    account lookup by username (mean per login; the scrypt check is timed once, separately)
+  pdf_single      render one report card
+  pdf_batch       render --pdf-cards report cards into a ZIP with the process pool
+
+Each result records the best and median of --repeat runs. With --compare, operations
+more than --threshold times slower than in the baseline report are listed and the exit
+status is 1, so the suite can guard against regressions between versions.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd  # noqa: E402
+
+import synthetic_school as school  # noqa: E402
+from auth import hash_password, verify_password  # noqa: E402
+from excel_import import import_result_workbooks, workbook_cache  # noqa: E402
+from grading import grade_scores  # noqa: E402
+from ranking import build_rank_index  # noqa: E402
+from report_pdf import generate_report_card_pdf, pdf_bytes, render_report_cards_zip  # noqa: E402
+from results_history import ResultsHistory  # noqa: E402
+from storage import RecordStore, SQLiteRecordStore  # noqa: E402
+
+DEFAULT_SIZES = [100, 1000, 10000]
+SINGLE_SAVES = 50
+LOGIN_LOOKUPS = 1000
+
+
+def time_runs(function, repeat, setup=None):
+    """Runs function (after an untimed setup() each time) repeat times; returns the timings in seconds."""
+    timings = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        start = time.perf_counter()
+        function(argument) if setup else function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def open_store(directory, name, key_field, backend):
+    if backend == "sqlite":
+        return SQLiteRecordStore(os.path.join(directory, "portal.db"), name, key_field, [key_field])
+    return RecordStore(os.path.join(directory, f"{name}.json"), key_field, [key_field])
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_school(students, args, workdir):
+    """Times every operation for one school size; returns a list of result dicts."""
+    results = []
+
+    def record(operation, timings, items=1, **extra):
+        entry = {"students": students, "operation": operation, "best_seconds": min(timings),
+                 "median_seconds": statistics.median(timings), "runs": len(timings), "items": items}
+        entry["best_seconds_per_item"] = entry["best_seconds"] / items
+        entry.update(extra)
+        results.append(entry)
+        per_item = f"   ({entry['best_seconds_per_item'] * 1e6:.1f} us each)" if items > 1 else ""
+        print(f"{students:>8} {operation:<14} {entry['best_seconds']:>10.4f} s{per_item}", flush=True)
+
+    names = school.student_names(students)
+    classes = school.class_names(students)
+    session, term = school.partitions(1)[0]
+    password_hash = hash_password("123456")
+    accounts = school.make_accounts(names, password_hash)
+    profiles = school.make_profiles(names, classes, session, term, seed=args.seed)
+    scores = school.make_scores(names, args.subjects, seed=args.seed)
+    records = school.result_records(scores, session, term)
+
+    # --- Storage ---
+    def fresh_directory():
+        return tempfile.mkdtemp(dir=workdir)
+
+    def save_all(directory):
+        open_store(directory, "students", "username", args.backend).upsert_many(accounts)
+        open_store(directory, "student_profiles", "student_name", args.backend).upsert_many(profiles)
+        history = ResultsHistory(os.path.join(directory, "results"), args.backend, os.path.join(directory, "portal.db"))
+        history.store(session, term).upsert_many(records)
+    record("save_bulk", time_runs(save_all, args.repeat, setup=fresh_directory), items=students)
+
+    # A full school on disk, every term, for the rest of the operations
+    data_dir = fresh_directory()
+    save_all(data_dir)
+    history = ResultsHistory(os.path.join(data_dir, "results"), args.backend, os.path.join(data_dir, "portal.db"))
+    for n, (later_session, later_term) in enumerate(school.partitions(args.terms)[1:], start=1):
+        later_scores = school.make_scores(names, args.subjects, seed=args.seed + n)
+        history.save(school.result_records(later_scores, later_session, later_term), later_session, later_term)
+    results_store = history.store(session, term)
+
+    def save_single():
+        for i in range(SINGLE_SAVES):
+            results_store.upsert(dict(records[(i * 7919) % students], total_score=float(i)))
+    record("save_single", time_runs(save_single, args.repeat), items=SINGLE_SAVES)
+
+    def cold_load():
+        if args.backend == "json":
+            return RecordStore(results_store.file_path, "student_name", ["student_name"]).load()
+        return SQLiteRecordStore(results_store.db_path, results_store.table, "student_name", ["student_name"]).all()
+    record("load", time_runs(cold_load, args.repeat), items=students)
+
+    # --- Grading, workbooks, ranks ---
+    record("grading", time_runs(lambda: grade_scores(scores.copy()), args.repeat), items=len(scores))
+
+    if students <= args.excel_max_students:
+        paths = school.write_class_workbooks(os.path.join(workdir, f"uploads_{students}"), scores, dict(zip(names, classes)))
+        uploads = [(os.path.basename(p), p) for p in paths]
+        # The workbook cache would turn repeats into hash lookups; parse from scratch each time
+        def parse():
+            workbook_cache.clear()
+            batch = import_result_workbooks(uploads)
+            assert len(batch['entries']) == students, batch['errors'][:3]
+        record("excel_parse", time_runs(parse, args.repeat), items=students, files=len(paths))
+    else:
+        print(f"{students:>8} {'excel_parse':<14} skipped (more than --excel-max-students)")
+
+    profiles_by_name = {p['student_name']: p for p in profiles}
+    record("rank", time_runs(lambda: build_rank_index(records, profiles_by_name), args.repeat), items=students)
+
+    # --- Logins ---
+    accounts_store = open_store(data_dir, "students", "username", args.backend)
+    accounts_store.load()
+    lookups = [names[(i * 104729) % students] for i in range(LOGIN_LOOKUPS)]
+    def login_lookup():
+        for username in lookups:
+            assert accounts_store.get(username) is not None
+    record("login_lookup", time_runs(login_lookup, args.repeat), items=LOGIN_LOOKUPS)
+    record("password_check", time_runs(lambda: verify_password("123456", password_hash), args.repeat))
+
+    # --- Report cards ---
+    rank_index = build_rank_index(records, profiles_by_name)
+    sample = records[:max(1, min(args.pdf_cards, students))]
+    def render_one():
+        r = sample[0]
+        pdf_bytes(generate_report_card_pdf(r['student_name'], pd.DataFrame(r['results']), r['total_score'],
+                                           rank_index.position_label(r['student_name']), profiles_by_name[r['student_name']]))
+    record("pdf_single", time_runs(render_one, args.repeat))
+    jobs = [{"student_name": r['student_name'], "results": r['results'], "total_score": r['total_score'],
+             "rank": rank_index.position_label(r['student_name']), "profile": profiles_by_name[r['student_name']],
+             "session": session, "term": term} for r in sample]
+    record("pdf_batch", time_runs(lambda: render_report_cards_zip(jobs, io.BytesIO(), workers=args.workers), args.repeat),
+           items=len(jobs))
+    return results
+
+
+def compare(report, baseline, threshold):
+    """Lists operations slower than threshold x the baseline; returns the regressions."""
+    before = {(r["students"], r["operation"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\n{'students':>8} {'operation':<14} {'baseline':>10} {'now':>10} {'ratio':>7}")
+    for result in report["results"]:
+        old = before.get((result["students"], result["operation"]))
+        if old is None:
+            continue
+        ratio = result["best_seconds"] / old["best_seconds"] if old["best_seconds"] else float("inf")
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print(f"{result['students']:>8} {result['operation']:<14} {old['best_seconds']:>10.4f} {result['best_seconds']:>10.4f} {ratio:>6.2f}x{flag}")
+        if flag:
+            regressions.append(dict(result, baseline_seconds=old["best_seconds"], ratio=ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--subjects", type=int, default=15, choices=range(1, len(school.SUBJECTS) + 1), metavar="N")
+    parser.add_argument("--terms", type=int, default=3, help="Terms of results stored per school")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pdf-cards", type=int, default=100, help="Report cards in the batch rendering test")
+    parser.add_argument("--workers", type=int, help="Processes for batch rendering (default: one per CPU)")
+    parser.add_argument("--excel-max-students", type=int, default=10000,
+                        help="Skip the workbook test above this school size (writing the files takes a while)")
+    parser.add_argument("--output", help="Write the JSON report here (default: print it)")
+    parser.add_argument("--compare", help="Baseline JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slow-down ratio counted as a regression")
+    args = parser.parse_args()
+
+    # Report cards load the logo, signatures and photos relative to the app folder
+    os.chdir(REPO_ROOT)
+    workdir = tempfile.mkdtemp(prefix="report_card_bench_")
+    started = time.perf_counter()
+    try:
+        print(f"{'students':>8} {'operation':<14} {'best':>12}")
+        results = []
+        for students in args.students:
+            results.extend(bench_school(students, args, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "created": datetime.now().isoformat(timespec='seconds'),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "parameters": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "threshold")},
+        "duration_seconds": time.perf_counter() - started,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} operation(s) slower than {args.threshold}x the baseline.")
+            return 1
+    elif not args.output:
+        print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
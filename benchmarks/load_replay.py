@@ -0,0 +1,384 @@
+"""
+Load replay for result-release day: replays a traffic log of student logins, result
+page views and report card downloads, plus teacher workbook uploads, concurrently
+against a synthetic school, and reports latency percentiles and peak memory per
+operation, to size the server before results go out.
+
+Usage (from the repository root):
+    python benchmarks/load_replay.py [--students 2000] [--log traffic.jsonl | --write-log traffic.jsonl]
+                                     [--concurrency 64] [--speed 10] [--backend json|sqlite] [--output report.json]
+
+The traffic log is JSON Lines, one request per line, ordered by time:
+    {"at": 12.5, "user": "Adaeze Abubakar 00001", "op": "login"}
+    {"at": 17.1, "user": "Adaeze Abubakar 00001", "op": "view"}
+    {"at": 19.0, "user": "Adaeze Abubakar 00001", "op": "download"}
+    {"at": 30.0, "user": "teacher", "op": "upload", "file": "JSS1-001.xlsx"}
+"at" is seconds from the start. Without --log, a result-day log is generated for the
+synthetic school (most students arrive within --window seconds; see generate_traffic).
+
+Each user's requests run in order on one thread, as each browser session does in the
+Streamlit server, through the same functions the portal calls (portal_data, auth,
+ranking and report_pdf's caches) - no browser or Streamlit is needed. The replay
+takes about the log's duration divided by --speed: by default (--speed 10, a 600 s
+window) about a minute, plus the memory runs. --speed 1 replays in real time (ten
+minutes or more); --speed 0 sends every request as soon as the previous one by that
+user has finished. Latency is measured from the start of each operation; "lag" is
+how late operations started against the schedule (a sign that --concurrency is too low).
+
+Memory: the process's peak resident size is reported for the whole replay; afterwards
+each operation is run alone under tracemalloc to report the peak Python memory it
+allocates (--no-memory skips this).
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic_school as school  # noqa: E402
+
+OPERATIONS = ["login", "view", "download", "upload"]
+PASSWORD = "123456"
+TEACHER = "teacher"
+
+
+# --- Traffic ---
+def generate_traffic(names, classes, window, seed=0, uploads=3):
+    """
+    A result-release-day log: 90% of students log in at random within `window` seconds,
+    each viewing their results a few seconds later and usually downloading the report
+    card; some look again or download twice. Meanwhile the teacher re-uploads a few class
+    workbooks (corrections). Returns the requests ordered by time.
+    """
+    rng = random.Random(seed)
+    requests = []
+    for name in names:
+        if rng.random() > 0.9:
+            continue
+        at = rng.uniform(0, window)
+        requests.append({"at": at, "user": name, "op": "login"})
+        at += rng.uniform(2, 10)
+        requests.append({"at": at, "user": name, "op": "view"})
+        if rng.random() < 0.85:
+            at += rng.uniform(1, 5)
+            requests.append({"at": at, "user": name, "op": "download"})
+            if rng.random() < 0.2:
+                at += rng.uniform(5, 30)
+                requests.append({"at": at, "user": name, "op": "download"})
+        if rng.random() < 0.3:
+            at += rng.uniform(10, 60)
+            requests.append({"at": at, "user": name, "op": "view"})
+    class_list = list(dict.fromkeys(classes))
+    for n, class_name in enumerate(rng.sample(class_list, min(uploads, len(class_list)))):
+        requests.append({"at": window * (n + 1) / (uploads + 1), "user": TEACHER, "op": "upload", "file": f"{class_name}.xlsx"})
+    return sorted(requests, key=lambda r: r["at"])
+
+
+def read_traffic(path):
+    with open(path) as f:
+        requests = [json.loads(line) for line in f if line.strip()]
+    unknown = {r.get("op") for r in requests} - set(OPERATIONS)
+    if unknown:
+        raise ValueError(f"Unknown operation(s) in {path}: {', '.join(map(str, sorted(unknown, key=str)))}")
+    return sorted(requests, key=lambda r: r["at"])
+
+
+def write_traffic(path, requests):
+    with open(path, 'w') as f:
+        for request in requests:
+            f.write(json.dumps(request) + "\n")
+
+
+# --- Synthetic school ---
+def build_school(args, data_dir):
+    """Fills data_dir with the accounts, profiles and every term's results of a synthetic school; writes the upload workbooks."""
+    # portal_data reads these when it is first imported
+    os.environ["REPORT_CARD_DATA_DIR"] = data_dir
+    os.environ["REPORT_CARD_STORAGE"] = args.backend
+    from auth import hash_password
+    from portal_data import STUDENT_PROFILES_FILE, STUDENTS_FILE, get_data_store, get_results
+
+    names = school.student_names(args.students)
+    classes = school.class_names(args.students)
+    partitions = school.partitions(args.terms)
+    session, term = partitions[-1]
+    get_data_store(STUDENTS_FILE).upsert_many(school.make_accounts(names, hash_password(PASSWORD)))
+    get_data_store(STUDENT_PROFILES_FILE).upsert_many(school.make_profiles(names, classes, session, term, seed=args.seed))
+    for n, (partition_session, partition_term) in enumerate(partitions):
+        scores = school.make_scores(names, args.subjects, seed=args.seed + n)
+        get_results().save(school.result_records(scores, partition_session, partition_term), partition_session, partition_term)
+    # Uploads re-send the latest term with slightly different scores, as corrections would
+    corrected = school.make_scores(names, args.subjects, seed=args.seed + len(partitions))
+    school.write_class_workbooks(os.path.join(data_dir, "uploads"), corrected, dict(zip(names, classes)))
+    return names, classes, (session, term)
+
+
+class Portal:
+    """What one Streamlit session does for each operation, minus the widgets."""
+
+    def __init__(self, data_dir, latest_partition):
+        from auth import auth_sessions, verify_password
+        from portal_data import STUDENT_PROFILES_FILE, STUDENTS_FILE, get_data_store, get_results
+        from ranking import rank_index_cache
+        from report_pdf import report_card_cache
+
+        self.uploads_dir = os.path.join(data_dir, "uploads")
+        self.latest_partition = latest_partition
+        self.auth_sessions = auth_sessions
+        self.verify_password = verify_password
+        self.accounts = get_data_store(STUDENTS_FILE)
+        self.profiles = get_data_store(STUDENT_PROFILES_FILE)
+        self.get_results = get_results
+        self.rank_index_cache = rank_index_cache
+        self.report_card_cache = report_card_cache
+
+    def login(self, user, state):
+        account = self.accounts.get(user)
+        if account is None or not self.verify_password(PASSWORD, account.get('password'))[0]:
+            raise ValueError(f"Login failed for {user}")
+        state["token"] = self.auth_sessions.issue(user, 'student')
+
+    def _rank_index(self, session, term):
+        # As student_portal.get_rank_index: rebuilt only after a save
+        stamp = (self.get_results().store(session, term).refresh(), self.profiles.refresh())
+        return self.rank_index_cache.get((session, term), stamp, lambda: self.get_results().load(session, term), self.profiles)
+
+    def _latest_card(self, user, state):
+        if self.auth_sessions.validate(state.get("token")) is None:
+            raise ValueError(f"{user} is not logged in")
+        history = self.get_results().history(user)
+        if not history:
+            raise ValueError(f"No results for {user}")
+        session, term, record = history[-1]
+        return session, term, record, self.profiles.get(user)
+
+    def view(self, user, state):
+        import pandas as pd
+
+        session, term, record, _ = self._latest_card(user, state)
+        results_df = pd.DataFrame(record['results'])
+        rank_index = self._rank_index(session, term)
+        rank_index.position_label(user)
+        subject_positions = rank_index.subject_positions(user)
+        if subject_positions:
+            results_df['Position'] = results_df['Subject'].map(lambda subject: subject_positions.get(subject))
+
+    def download(self, user, state):
+        import pandas as pd
+        from portal_data import report_card_profile
+
+        session, term, record, profile = self._latest_card(user, state)
+        total_score = pd.DataFrame(record['results'])['Final'].sum()
+        rank = self._rank_index(session, term).position_label(user)
+        self.report_card_cache.get_or_render(user, record['results'], total_score, rank, report_card_profile(profile, session, term))
+
+    def upload(self, request, state):
+        from excel_import import import_result_workbooks
+        from portal_data import match_existing_students, save_result_entries
+        from search_index import StudentSearchIndex
+
+        path = os.path.join(self.uploads_dir, request["file"])
+        batch = import_result_workbooks([(request["file"], path)])
+        if not batch['entries']:
+            raise ValueError(f"Nothing imported from {request['file']}: {batch['errors'][:1]}")
+        index = StudentSearchIndex(self.profiles.all(), self.accounts.all())
+        batch, _ = match_existing_students(batch, index.find_existing)
+        session, term = self.latest_partition
+        save_result_entries(batch['entries'], session, term)
+        self.report_card_cache.invalidate_many(entry['student_name'] for entry in batch['entries'])
+
+    def run(self, request, state):
+        if request["op"] == "upload":
+            return self.upload(request, state)
+        return getattr(self, request["op"])(request["user"], state)
+
+
+# --- Replay ---
+def replay(portal, requests, concurrency, speed):
+    """Runs the requests (each user's in order) on up to `concurrency` threads; returns (samples, errors, lag)."""
+    by_user = defaultdict(list)
+    for request in requests:
+        by_user[request["user"]].append(request)
+    samples = defaultdict(list) # op -> [seconds]
+    errors = defaultdict(list)  # op -> [message]
+    lags = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def run_user(user_requests):
+        state = {}
+        for request in user_requests:
+            if speed:
+                delay = started + request["at"] / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                lag = max(0.0, -delay)
+            else:
+                lag = 0.0
+            start = time.perf_counter()
+            try:
+                portal.run(request, state)
+                error = None
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            elapsed = time.perf_counter() - start
+            with lock:
+                lags.append(lag)
+                if error:
+                    errors[request["op"]].append(error)
+                else:
+                    samples[request["op"]].append(elapsed)
+
+    # Users start in order of their first request
+    sessions = sorted(by_user.values(), key=lambda r: r[0]["at"])
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="replay") as pool:
+        list(pool.map(run_user, sessions))
+    return samples, errors, lags, time.perf_counter() - started
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def measure_memory(portal, requests):
+    """Peak Python allocation (bytes) of one run of each operation, alone, with cold caches."""
+    peaks = {}
+    examples = {}
+    for request in requests:
+        examples.setdefault(request["op"], request)
+    user = next((r["user"] for r in requests if r["op"] == "login"), None)
+    state = {}
+    tracemalloc.start()
+    try:
+        for op in OPERATIONS:
+            request = examples.get(op)
+            if request is None:
+                continue
+            if op in ("view", "download"):
+                request = dict(request, user=user)
+                portal.login(user, state)
+                portal.report_card_cache.invalidate(user)
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            try:
+                portal.run(request, state)
+            except Exception as e:
+                print(f"Warning: Memory run of {op} failed: {e}")
+                continue
+            peaks[op] = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 # kilobytes on Linux
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--subjects", type=int, default=15, choices=range(1, len(school.SUBJECTS) + 1), metavar="N")
+    parser.add_argument("--terms", type=int, default=3, help="Terms of results already stored")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log", help="Traffic log to replay (default: generate one)")
+    parser.add_argument("--write-log", help="Save the generated traffic log here")
+    parser.add_argument("--window", type=float, default=600, help="Seconds over which students arrive in a generated log")
+    parser.add_argument("--uploads", type=int, default=3, help="Class workbooks the teacher uploads in a generated log")
+    parser.add_argument("--concurrency", type=int, default=64, help="Sessions served at once (threads)")
+    parser.add_argument("--speed", type=float, default=10.0,
+                        help="Replay speed-up (default 10: a 600 s log takes about a minute; 1 = real time); 0 = no waiting between requests")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the per-operation memory runs")
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    # Report cards load the logo, signatures and photos relative to the app folder
+    os.chdir(REPO_ROOT)
+    workdir = tempfile.mkdtemp(prefix="report_card_replay_")
+    try:
+        print(f"Building a school of {args.students} students ...", flush=True)
+        names, classes, latest_partition = build_school(args, os.path.join(workdir, "data"))
+        requests = read_traffic(args.log) if args.log else generate_traffic(names, classes, args.window, args.seed, args.uploads)
+        if args.write_log:
+            write_traffic(args.write_log, requests)
+        portal = Portal(os.path.join(workdir, "data"), latest_partition)
+        from metrics import metrics
+        metrics.reset()
+
+        print(f"Replaying {len(requests)} requests from {len({r['user'] for r in requests})} users "
+              f"(concurrency {args.concurrency}, speed {args.speed or 'unlimited'}) ...", flush=True)
+        samples, errors, lags, duration = replay(portal, requests, args.concurrency, args.speed)
+        peak_rss = peak_rss_bytes()
+        caches = metrics.snapshot()["gauges"]
+        memory = {} if args.no_memory else measure_memory(portal, requests)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    operations = {}
+    print(f"\n{'operation':<10} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'peak MiB':>9}")
+    for op in OPERATIONS:
+        timings = sorted(samples.get(op, []))
+        if not timings and not errors.get(op):
+            continue
+        stats = {
+            "count": len(timings), "errors": len(errors.get(op, [])),
+            "p50_seconds": percentile(timings, 0.50), "p95_seconds": percentile(timings, 0.95),
+            "p99_seconds": percentile(timings, 0.99), "max_seconds": timings[-1] if timings else None,
+            "mean_seconds": statistics.fmean(timings) if timings else None,
+            "peak_memory_bytes": memory.get(op), "first_errors": errors.get(op, [])[:5],
+        }
+        operations[op] = stats
+        def ms(value):
+            return f"{value * 1000:>9.1f}" if value is not None else f"{'-':>9}"
+        peak = f"{stats['peak_memory_bytes'] / 2 ** 20:>9.1f}" if stats['peak_memory_bytes'] is not None else f"{'-':>9}"
+        print(f"{op:<10} {stats['count']:>6} {stats['errors']:>6} {ms(stats['p50_seconds'])} {ms(stats['p95_seconds'])} "
+              f"{ms(stats['p99_seconds'])} {ms(stats['max_seconds'])} {peak}")
+    lags.sort()
+    print(f"\nReplay took {duration:.1f} s; peak resident memory {peak_rss / 2 ** 20:.0f} MiB; "
+          f"start lag p95 {percentile(lags, 0.95) or 0:.3f} s, max {lags[-1] if lags else 0:.3f} s")
+    for op, messages in errors.items():
+        print(f"{op}: {len(messages)} error(s), e.g. {messages[0]}")
+
+    report = {
+        "created": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "parameters": {k: v for k, v in vars(args).items() if k not in ("output", "write_log")},
+        "requests": len(requests),
+        "duration_seconds": duration,
+        "peak_rss_bytes": peak_rss,
+        "start_lag_seconds": {"p95": percentile(lags, 0.95), "max": lags[-1] if lags else None},
+        "operations": operations,
+        "caches": caches,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
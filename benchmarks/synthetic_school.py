@@ -0,0 +1,129 @@
+"""
+Synthetic schools for benchmarks: students, login accounts, profiles and graded
+results in the portal's own record formats, plus class result workbooks in the
+upload format excel_import reads. Everything is derived from a seed, so the same
+arguments always produce the same school.
+
+Results are generated one (session, term) at a time, so even a 50,000-student school
+never has more than one term's records in memory.
+"""
+import os
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from grading import grade_scores
+
+SUBJECTS = [
+    "English Language", "Mathematics", "Basic Science", "Basic Technology", "Social Studies",
+    "Civic Education", "Christian Religious Studies", "Islamic Studies", "Agricultural Science",
+    "Home Economics", "Business Studies", "Computer Studies", "French", "Yoruba", "Hausa",
+    "Igbo", "Physical and Health Education", "Cultural and Creative Arts", "Music", "Security Education",
+]
+FIRST_NAMES = ["Adaeze", "Bala", "Chinedu", "Deji", "Emeka", "Fatima", "Gbenga", "Halima", "Ifeoma", "Jide",
+               "Kemi", "Lami", "Musa", "Ngozi", "Olu", "Patience", "Rukayat", "Segun", "Tunde", "Uche"]
+LAST_NAMES = ["Abubakar", "Adeyemi", "Bello", "Chukwu", "Danjuma", "Eze", "Falana", "Garba", "Ibrahim", "Johnson",
+              "Kalu", "Lawal", "Mohammed", "Nwosu", "Okafor", "Okonkwo", "Salami", "Usman", "Yakubu", "Zubair"]
+TERMS = ["First Term", "Second Term", "Third Term"]
+STUDENTS_PER_CLASS = 40
+
+
+def student_names(count):
+    """count distinct, deterministic names such as 'Adaeze Abubakar 00001'."""
+    return [f"{FIRST_NAMES[i % len(FIRST_NAMES)]} {LAST_NAMES[(i // len(FIRST_NAMES)) % len(LAST_NAMES)]} {i + 1:05d}"
+            for i in range(count)]
+
+
+def class_names(count):
+    """The class of each of count students, STUDENTS_PER_CLASS to a class ('JSS1-001', 'JSS2-001', ...)."""
+    return [f"JSS{(i // STUDENTS_PER_CLASS) % 3 + 1}-{(i // STUDENTS_PER_CLASS) // 3 + 1:03d}" for i in range(count)]
+
+
+def partitions(terms):
+    """The first `terms` (session, term) pairs from 2023/2024 onwards."""
+    return [(f"{2023 + n // len(TERMS)}/{2024 + n // len(TERMS)}", TERMS[n % len(TERMS)]) for n in range(terms)]
+
+
+def make_accounts(names, password_hash):
+    return [{"id": i + 1, "username": name, "password": password_hash} for i, name in enumerate(names)]
+
+
+def make_profiles(names, classes, session, term, seed=0):
+    rng = np.random.default_rng(seed)
+    ages = rng.integers(10, 17, len(names))
+    phones = rng.integers(10 ** 9, 10 ** 10 - 1, len(names))
+    return [{
+        "student_name": name,
+        "age": int(age),
+        "reg_number": f"REG/{i + 1:06d}",
+        "class_name": class_name,
+        "parent_name": f"Parent of {name}",
+        "parent_phone": f"0{phone}",
+        "parent_address": f"{i % 300 + 1} Example Street, Lagos",
+        "session": session,
+        "term": term,
+    } for i, (name, class_name, age, phone) in enumerate(zip(names, classes, ages, phones))]
+
+
+def make_scores(names, subject_count, seed=0):
+    """Raw scores, one row per student and subject: student_name, Subject, CA1, CA2, Exam."""
+    rng = np.random.default_rng(seed)
+    subjects = SUBJECTS[:subject_count]
+    rows = len(names) * len(subjects)
+    # Per-student ability plus noise, so totals (and therefore ranks) are spread out
+    ability = np.repeat(rng.normal(0.6, 0.15, len(names)), len(subjects))
+    def component(maximum):
+        return np.clip(np.rint((ability + rng.normal(0, 0.12, rows)) * maximum), 0, maximum).astype(int)
+    return pd.DataFrame({
+        "student_name": np.repeat(names, len(subjects)),
+        "Subject": np.tile(subjects, len(names)),
+        "CA1": component(20),
+        "CA2": component(20),
+        "Exam": component(60),
+    })
+
+
+def result_records(scores, session, term):
+    """Grades a make_scores frame and groups it into results records (the portal's schema)."""
+    graded = grade_scores(scores.copy())
+    columns = ["Subject", "CA1", "CA2", "Exam", "Final", "Grade", "Remark"]
+    records = []
+    for student_name, group in graded.groupby("student_name", sort=False):
+        results = [dict(zip(columns, row)) for row in group[columns].itertuples(index=False, name=None)]
+        records.append({
+            "student_name": student_name,
+            "total_score": float(group["Final"].sum()),
+            "results": results,
+            "session": session,
+            "term": term,
+        })
+    return records
+
+
+def write_class_workbooks(directory, scores, classes_by_name):
+    """
+    Writes one class sheet per class ('Student Name' plus '<Subject> CA1/CA2/Exam'
+    columns, the format bulk upload accepts). Returns the file paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    wide = scores.pivot(index="student_name", columns="Subject", values=["CA1", "CA2", "Exam"])
+    subjects = list(dict.fromkeys(scores["Subject"]))
+    order = list(dict.fromkeys(scores["student_name"]))
+    wide = wide.reindex(order)
+    header = ["Student Name"] + [f"{subject} {component}" for subject in subjects for component in ("CA1", "CA2", "Exam")]
+    columns = [(component, subject) for subject in subjects for component in ("CA1", "CA2", "Exam")]
+    values = wide[columns]
+    class_of = pd.Series(classes_by_name).reindex(order)
+
+    paths = []
+    for class_name, members in class_of.groupby(class_of, sort=False):
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet(class_name)
+        sheet.append(header)
+        for name, row in zip(members.index, values.loc[members.index].itertuples(index=False, name=None)):
+            sheet.append([name] + [int(v) for v in row])
+        path = os.path.join(directory, f"{class_name}.xlsx")
+        workbook.save(path)
+        paths.append(path)
+    return paths
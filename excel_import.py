@@ -0,0 +1,401 @@
+"""
+Parsing of result workbooks uploaded by teachers.
+
+Two sheet layouts are understood:
+  * Student sheet - the original single-student format: student name in cell B2 and a
+    subject table whose header ('Subject', 'CA 1', 'CA 2', 'Exam') is on row 9.
+  * Class sheet - one row per student, with a name column and a column group per
+    subject, either as single headers ("Math CA1", "Math CA2", "Math Exam") or as a
+    two-row header (subject names on row 1, CA1/CA2/Exam beneath them on row 2).
+
+A workbook may contain any mix of these sheets, and several workbooks can be imported
+together. Everything parsed is graded in one vectorised pass, and problems are reported
+per sheet/student instead of aborting the whole batch.
+
+Workbooks are opened once, in openpyxl's streaming read-only mode, and every sheet is
+pulled out in that single pass. A .csv file is read as one class sheet, and an old .xls
+workbook through pandas when xlrd is installed. The raw sheets are cached by a hash of
+the file's content, so re-running the page (e.g. pressing "Save Results") never parses
+the same upload twice.
+"""
+import hashlib
+import io
+import re
+import threading
+from collections import OrderedDict
+
+import openpyxl
+import pandas as pd
+
+from grading import grade_scores
+from metrics import metrics
+from search_index import name_key
+
+# Standardised result columns, keyed by their normalised header (lowercase, no spaces)
+REQUIRED_COLUMNS = {
+    'subject': 'Subject',
+    'ca1': 'CA1',
+    'ca2': 'CA2',
+    'exam': 'Exam'
+}
+SCORE_COLUMNS = ['CA1', 'CA2', 'Exam']
+RESULT_COLUMNS = ['Subject', 'CA1', 'CA2', 'Exam', 'Final', 'Grade', 'Remark']
+
+# Header cells that identify the student name column of a class sheet
+NAME_HEADERS = {'studentname', 'name', 'student', 'fullname', 'studentsname'}
+
+# "Math CA1", "Math - CA 2", "Further_Math_Exam" -> (subject, component)
+SUBJECT_COMPONENT_PATTERN = re.compile(r'^(.*?)[\s_\-:/]*(CA\s*1|CA\s*2|Exam)$', re.IGNORECASE)
+
+STUDENT_SHEET_NAME_CELL = (1, 1)  # B2
+STUDENT_SHEET_HEADER_ROW = 8      # Row 9
+
+# How many parsed workbooks to keep, most recently used first
+WORKBOOK_CACHE_SIZE = 32
+
+# Upload types import_result_workbooks reads (.xls needs xlrd, which is optional)
+WORKBOOK_TYPES = ["xlsx", "xls", "csv"]
+
+
+def _normalize_header(value):
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return ""
+    return str(value).strip().lower().replace(' ', '').replace('_', '').replace('-', '')
+
+
+def _is_blank(value):
+    return value is None or (not isinstance(value, str) and pd.isna(value)) or str(value).strip() == ""
+
+
+def normalize_result_columns(df):
+    """
+    Renames a subject table's columns to 'Subject', 'CA1', 'CA2', 'Exam' (accepting
+    variants like 'CA 1' or 'exam') and returns just those columns, in that order.
+    Raises ValueError naming any that are missing.
+    """
+    df = df.copy()
+    df.columns = [str(col).strip() for col in df.columns]
+    normalized_cols = {col.lower().replace(' ', ''): col for col in df.columns}
+
+    found_columns = {}
+    missing_expected_columns = []
+    for normalized_expected, final_name in REQUIRED_COLUMNS.items():
+        if normalized_expected in normalized_cols:
+            found_columns[normalized_cols[normalized_expected]] = final_name
+        else:
+            missing_expected_columns.append(final_name)
+
+    if missing_expected_columns:
+        raise ValueError(f"Missing required columns: {missing_expected_columns}. Expected 'Subject', 'CA 1' (or 'CA1'), 'CA 2' (or 'CA2') and 'Exam'.")
+
+    df.rename(columns=found_columns, inplace=True)
+    return df[list(REQUIRED_COLUMNS.values())]
+
+
+def _clean_subject_rows(df):
+    """Drops rows without a subject name and fills missing scores with 0."""
+    df = df[~df['Subject'].map(_is_blank)].copy()
+    df['Subject'] = df['Subject'].map(lambda s: str(s).strip())
+    df[SCORE_COLUMNS] = df[SCORE_COLUMNS].fillna(0)
+    return df
+
+
+# --- Sheet Layouts ---
+def is_student_sheet(raw):
+    """True if a raw (header=None) sheet uses the single-student layout."""
+    if raw.shape[0] <= STUDENT_SHEET_HEADER_ROW:
+        return False
+    return 'subject' in {_normalize_header(v) for v in raw.iloc[STUDENT_SHEET_HEADER_ROW]}
+
+
+def parse_student_sheet(raw):
+    """
+    Parses a raw (header=None) sheet in the single-student layout.
+    Returns (student_name, DataFrame of Subject/CA1/CA2/Exam). Raises ValueError.
+    """
+    row, col = STUDENT_SHEET_NAME_CELL
+    student_name = raw.iat[row, col] if raw.shape[0] > row and raw.shape[1] > col else None
+    if _is_blank(student_name):
+        raise ValueError("Could not find student name in cell B2.")
+
+    header = [str(v).strip() if not _is_blank(v) else f"Unnamed: {i}" for i, v in enumerate(raw.iloc[STUDENT_SHEET_HEADER_ROW])]
+    table = raw.iloc[STUDENT_SHEET_HEADER_ROW + 1:].copy()
+    table.columns = header
+    table = _clean_subject_rows(normalize_result_columns(table))
+    if table.empty:
+        raise ValueError("No subject rows found below the header on row 9.")
+    return str(student_name).strip(), table
+
+
+def _class_sheet_columns(raw):
+    """
+    Works out the header of a class sheet. Returns (name column index,
+    {column index: (subject, component)}, index of the first data row).
+    """
+    first = [_normalize_header(v) for v in raw.iloc[0]]
+    name_indexes = [i for i, v in enumerate(first) if v in NAME_HEADERS]
+    if not name_indexes:
+        raise ValueError("No student name column found (expected a header such as 'Student Name' or 'Name').")
+    name_index = name_indexes[0]
+
+    # Two-row header: subject names (often merged cells) above CA1/CA2/Exam
+    if raw.shape[0] > 1:
+        second = [_normalize_header(v) for v in raw.iloc[1]]
+        if any(v in ('ca1', 'ca2', 'exam') for v in second):
+            columns = {}
+            current_subject = None
+            for i, component in enumerate(second):
+                if i == name_index:
+                    continue
+                if not _is_blank(raw.iat[0, i]):
+                    current_subject = str(raw.iat[0, i]).strip()
+                if component in ('ca1', 'ca2', 'exam') and current_subject:
+                    columns[i] = (current_subject, REQUIRED_COLUMNS[component])
+            return name_index, columns, 2
+
+    # Single-row header: "<Subject> <Component>"
+    columns = {}
+    for i, value in enumerate(raw.iloc[0]):
+        if i == name_index or _is_blank(value):
+            continue
+        match = SUBJECT_COMPONENT_PATTERN.match(str(value).strip())
+        if match and match.group(1).strip():
+            component = REQUIRED_COLUMNS[match.group(2).lower().replace(' ', '')]
+            columns[i] = (match.group(1).strip(), component)
+    return name_index, columns, 1
+
+
+def parse_class_sheet(raw):
+    """
+    Parses a raw (header=None) class sheet into a long DataFrame with one row per
+    student and subject: student_name, Subject, CA1, CA2, Exam. A student on several
+    rows keeps the last one. Returns (DataFrame, errors) with an error dict
+    ({'student_name', 'error'}) per such student. Raises ValueError if the header
+    cannot be understood.
+    """
+    name_index, columns, first_data_row = _class_sheet_columns(raw)
+    if not columns:
+        raise ValueError("No subject score columns found (expected headers like 'Math CA1', 'Math CA2', 'Math Exam').")
+    repeated = pd.Series(list(columns.values())).duplicated()
+    if repeated.any():
+        subject, component = list(columns.values())[repeated.idxmax()]
+        raise ValueError(f"More than one {subject} {component} column; each subject's scores must appear once.")
+
+    data = raw.iloc[first_data_row:]
+    data = data[~data.iloc[:, name_index].map(_is_blank)]
+    names = data.iloc[:, name_index].map(lambda s: str(s).strip())
+
+    # One row per student (by name_key, named as first seen, as across sheets): otherwise
+    # pivoting would silently keep only one of the rows' scores
+    errors = []
+    keys = names.map(name_key)
+    clashing = keys.duplicated(keep=False)
+    if clashing.any():
+        names = names.groupby(keys.values, sort=False).transform('first')
+        rows = pd.Series(data.index[clashing.values] + 1, index=names[clashing].values) # Sheet row numbers
+        for _, student_rows in rows.groupby(keys[clashing].values, sort=False):
+            errors.append({'student_name': student_rows.index[0],
+                           'error': f"Found on rows {', '.join(map(str, student_rows))} of this sheet; using row {student_rows.iloc[-1]}."})
+        last = ~keys.duplicated(keep='last').values
+        data, names = data[last], names[last]
+
+    parts = []
+    for i, (subject, component) in columns.items():
+        parts.append(pd.DataFrame({
+            'student_name': names.values,
+            'Subject': subject,
+            'Component': component,
+            'Score': data.iloc[:, i].values,
+        }))
+    long_df = pd.concat(parts, ignore_index=True)
+    wide = long_df.pivot_table(index=['student_name', 'Subject'], columns='Component', values='Score',
+                               aggfunc='first', sort=False, dropna=False)
+    wide = wide.reindex(columns=SCORE_COLUMNS)
+    # A subject with no scores at all for a student is one they don't take
+    wide = wide.dropna(how='all').reset_index()
+    wide.columns.name = None
+    wide[SCORE_COLUMNS] = wide[SCORE_COLUMNS].fillna(0)
+    return wide, errors
+
+
+# --- Workbook Reading ---
+def _read_source_bytes(source):
+    """Returns the raw bytes of an upload (Streamlit UploadedFile / file-like) or a file path."""
+    if hasattr(source, 'getvalue'):
+        return source.getvalue()
+    if hasattr(source, 'read'):
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return source.read()
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+def parse_workbook_bytes(data, file_name=None):
+    """
+    Reads every sheet of an .xlsx file in one streaming pass and returns raw
+    (header=None) DataFrames keyed by sheet name. Cells hold formula results, as with
+    pd.read_excel. A file_name ending in .csv or .xls is read as that format instead.
+    """
+    metrics.incr("excel.bytes_read", len(data))
+    extension = str(file_name or "").lower().rsplit(".", 1)[-1]
+    if extension == "csv":
+        with metrics.span("excel.parse_csv"):
+            return {"CSV": pd.read_csv(io.BytesIO(data), header=None, dtype=object, skip_blank_lines=False)}
+    if extension == "xls":
+        try:
+            with metrics.span("excel.parse_xls"):
+                return pd.read_excel(io.BytesIO(data), sheet_name=None, header=None, engine='xlrd')
+        except ImportError:
+            raise ValueError("Reading .xls workbooks needs xlrd (pip install xlrd); or save the file as .xlsx.")
+    with metrics.span("excel.parse_workbook"):
+        workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+        try:
+            return {sheet.title: pd.DataFrame(list(sheet.iter_rows(values_only=True))) for sheet in workbook.worksheets}
+        finally:
+            workbook.close()
+
+
+class WorkbookCache:
+    """A small LRU of parsed workbooks keyed by the SHA-256 of their content."""
+
+    def __init__(self, max_entries=WORKBOOK_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_sheets(self, data, file_name=None):
+        extension = str(file_name or "").lower().rsplit(".", 1)[-1]
+        digest = (hashlib.sha256(data).hexdigest(), extension if extension in ("csv", "xls") else "xlsx")
+        with self._lock:
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return self._entries[digest]
+        sheets = parse_workbook_bytes(data, file_name)
+        with self._lock:
+            self.misses += 1
+            self._entries[digest] = sheets
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return sheets
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+workbook_cache = WorkbookCache()
+metrics.register_collector("workbook_cache", lambda: {"hits": workbook_cache.hits, "misses": workbook_cache.misses})
+
+
+def read_workbook_sheets(source, file_name=None):
+    """
+    Returns every sheet of a workbook as raw (header=None) DataFrames, keyed by sheet
+    name, parsing the file only if this exact content hasn't been seen recently. The
+    format follows file_name (default: the upload's name or path; .xlsx if neither).
+    The frames are shared with the cache and must not be modified in place.
+    """
+    if file_name is None:
+        file_name = getattr(source, 'name', source if isinstance(source, str) else None)
+    return workbook_cache.get_sheets(_read_source_bytes(source), file_name)
+
+
+# --- Batch Import ---
+
+def parse_workbook(sheets, source_name):
+    """
+    Parses all sheets of one workbook. Returns (long DataFrame, errors) where errors
+    is a list of {'source', 'student_name', 'error'} dicts for sheets that failed.
+    """
+    frames = []
+    errors = []
+    for sheet_name, raw in sheets.items():
+        source = f"{source_name} / {sheet_name}"
+        if raw.dropna(how='all').empty:
+            continue # Ignore blank sheets
+        try:
+            if is_student_sheet(raw):
+                student_name, table = parse_student_sheet(raw)
+                table.insert(0, 'student_name', student_name)
+            else:
+                table, row_errors = parse_class_sheet(raw)
+                errors.extend(dict(error, source=source) for error in row_errors)
+            table['source'] = source
+            frames.append(table)
+        except Exception as e:
+            errors.append({'source': source, 'student_name': None, 'error': str(e)})
+    if frames:
+        return pd.concat(frames, ignore_index=True), errors
+    return pd.DataFrame(columns=['student_name'] + list(REQUIRED_COLUMNS.values()) + ['source']), errors
+
+
+def build_result_entries(graded):
+    """Turns a graded long DataFrame into one results.json entry per student."""
+    entries = []
+    for student_name, rows in graded.groupby('student_name', sort=False):
+        results = rows[RESULT_COLUMNS]
+        entries.append({
+            "student_name": student_name,
+            "total_score": results['Final'].sum(),
+            "results": results.to_dict(orient='records'),
+        })
+    return entries
+
+
+def import_result_workbooks(uploads, grading_options=None):
+    """
+    Parses and grades any number of workbooks in one batch.
+    `uploads` is a list of (display name, path or file-like object) pairs.
+    Returns a dict with:
+      'entries': results.json entries ready to be saved in a single write,
+      'graded': the long graded DataFrame (for previewing),
+      'errors': per-sheet/per-student problems; the rest of the batch is still imported.
+    """
+    frames = []
+    errors = []
+    for source_name, source in uploads:
+        try:
+            sheets = read_workbook_sheets(source, source_name)
+        except Exception as e:
+            errors.append({'source': source_name, 'student_name': None, 'error': f"Could not read workbook: {e}"})
+            continue
+        frame, sheet_errors = parse_workbook(sheets, source_name)
+        errors.extend(sheet_errors)
+        if not frame.empty:
+            frames.append(frame)
+
+    if not frames:
+        return {'entries': [], 'graded': pd.DataFrame(), 'errors': errors}
+
+    combined = pd.concat(frames, ignore_index=True)
+
+    # Spellings that normalise the same ("Adams", "adams ", "ADAMS.") are one student,
+    # named as first seen
+    combined['student_key'] = combined['student_name'].map(name_key)
+    combined['student_name'] = combined.groupby('student_key', sort=False)['student_name'].transform('first')
+
+    # Per-student validation: the same student in two sheets is ambiguous, so the later
+    # sheet wins and the clash is reported.
+    sources_per_student = combined.groupby('student_name', sort=False)['source'].unique()
+    clashes = sources_per_student[sources_per_student.map(len) > 1]
+    for student_name, sources in clashes.items():
+        errors.append({'source': ", ".join(sources), 'student_name': student_name,
+                       'error': f"Found in {len(sources)} sheets; using {sources[-1]}."})
+    if not clashes.empty:
+        kept_source = combined['student_name'].map(clashes.map(lambda sources: sources[-1]))
+        combined = combined[kept_source.isna() | (combined['source'] == kept_source)]
+    combined = combined.drop(columns=['student_key'])
+
+    # Non-numeric scores are treated as 0, as in single uploads, but flagged
+    for column in SCORE_COLUMNS:
+        numeric = pd.to_numeric(combined[column], errors='coerce')
+        bad = numeric.isna() & ~combined[column].map(_is_blank)
+        for _, row in combined[bad].iterrows():
+            errors.append({'source': row['source'], 'student_name': row['student_name'],
+                           'error': f"Non-numeric {column} '{row[column]}' for {row['Subject']} was treated as 0."})
+
+    graded = grade_scores(combined.reset_index(drop=True), **(grading_options or {}))
+    return {'entries': build_result_entries(graded), 'graded': graded, 'errors': errors}
@@ -0,0 +1,172 @@
+"""
+Term-wide results export.
+
+Rows (one per student and subject, with the student's profile details, total and
+positions) are produced a chunk at a time and written straight to the output, so
+memory use is bounded by the chunk size rather than by the size of the school:
+  - CSV: each chunk is appended as text,
+  - Parquet: each chunk becomes a row group (needs pyarrow, which is optional),
+  - XLSX: openpyxl's write-only mode, which streams rows to disk as they are added.
+
+This module must not import streamlit.
+"""
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill
+
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from ranking import record_scope
+
+EXPORT_CHUNK_ROWS = 5000
+
+# Column name -> kind; the kind fixes the dtype so every chunk (and Parquet row group) agrees
+EXPORT_COLUMNS = {
+    "Student Name": "text",
+    "Registration No.": "text",
+    "Class": "text",
+    "Session": "text",
+    "Term": "text",
+    "Subject": "text",
+    "CA1": "number",
+    "CA2": "number",
+    "Exam": "number",
+    "Final": "number",
+    "Grade": "text",
+    "Remark": "text",
+    "Subject Position": "number",
+    "Total Score": "number",
+    "Position": "number",
+    "Class Size": "number",
+}
+
+EXPORT_FORMATS = {
+    "csv": {"label": "CSV", "extension": "csv", "mime": "text/csv"},
+    "parquet": {"label": "Parquet", "extension": "parquet", "mime": "application/octet-stream"},
+    "xlsx": {"label": "Excel (XLSX)", "extension": "xlsx", "mime": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"},
+}
+
+
+def available_formats():
+    """Export formats usable in this environment (Parquet only when pyarrow is installed)."""
+    return [name for name in EXPORT_FORMATS if name != "parquet" or pyarrow is not None]
+
+
+def _typed_frame(rows):
+    frame = pd.DataFrame(rows, columns=list(EXPORT_COLUMNS))
+    for column, kind in EXPORT_COLUMNS.items():
+        if kind == "number":
+            frame[column] = pd.to_numeric(frame[column], errors='coerce').astype('float64')
+        else:
+            frame[column] = frame[column].fillna("").astype(str)
+    return frame
+
+
+def iter_export_frames(partitions, profiles_by_name=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Yields DataFrames of at most about chunk_rows rows with EXPORT_COLUMNS.
+    partitions is an iterable of (result records, RankIndex) pairs - typically one per
+    session and term - and is consumed lazily. profiles_by_name is anything with
+    .get(student_name).
+    """
+    if profiles_by_name is None:
+        profiles_by_name = {}
+    rows = []
+    for records, rank_index in partitions:
+        for record in records:
+            name = record['student_name']
+            profile = profiles_by_name.get(name) or {}
+            class_name, session, term = record_scope(record, profile)
+            subject_positions = rank_index.subject_positions(name)
+            student_columns = (rank_index.position(name), rank_index.class_size(name) or None)
+            for subject_row in record.get('results', []):
+                subject = subject_row.get('Subject')
+                rows.append((
+                    name, profile.get('reg_number', ""), class_name, session, term, subject,
+                    subject_row.get('CA1'), subject_row.get('CA2'), subject_row.get('Exam'), subject_row.get('Final'),
+                    subject_row.get('Grade'), subject_row.get('Remark'), subject_positions.get(subject),
+                    record.get('total_score'),
+                ) + student_columns)
+            if len(rows) >= chunk_rows:
+                yield _typed_frame(rows)
+                rows = []
+    if rows:
+        yield _typed_frame(rows)
+
+
+# --- Writers ---
+def write_csv(frames, output):
+    """Writes frames to a binary file object as one UTF-8 CSV. Returns the number of rows."""
+    written = 0
+    for frame in frames:
+        output.write(frame.to_csv(index=False, header=written == 0, float_format="%.10g").encode('utf-8'))
+        written += len(frame)
+    if written == 0:
+        output.write(",".join(EXPORT_COLUMNS).encode('utf-8') + b"\n")
+    return written
+
+
+def _arrow_schema():
+    return pyarrow.schema([(column, pyarrow.float64() if kind == "number" else pyarrow.string())
+                           for column, kind in EXPORT_COLUMNS.items()])
+
+
+def write_parquet(frames, output):
+    """Writes frames to a binary file object as Parquet, one row group per frame. Returns the number of rows."""
+    if pyarrow is None:
+        raise RuntimeError("Parquet export needs the 'pyarrow' package (pip install pyarrow).")
+    schema = _arrow_schema()
+    written = 0
+    with pyarrow.parquet.ParquetWriter(output, schema) as writer:
+        for frame in frames:
+            writer.write_table(pyarrow.Table.from_pandas(frame, schema=schema, preserve_index=False))
+            written += len(frame)
+    return written
+
+
+def write_xlsx(frames, output, sheet_title="Results"):
+    """Writes frames to a binary file object as a formatted single-sheet workbook. Returns the number of rows."""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_title)
+    sheet.freeze_panes = "A2"
+    for index, column in enumerate(EXPORT_COLUMNS):
+        letter = chr(ord("A") + index)
+        sheet.column_dimensions[letter].width = max(10, len(column) + 2) if EXPORT_COLUMNS[column] == "number" else 20
+
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill("solid", fgColor="4F81BD")
+    header = []
+    for column in EXPORT_COLUMNS:
+        cell = WriteOnlyCell(sheet, value=column)
+        cell.font = header_font
+        cell.fill = header_fill
+        header.append(cell)
+    sheet.append(header)
+
+    written = 0
+    for frame in frames:
+        # NaN isn't a valid spreadsheet value; leave those cells empty
+        for row in frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None):
+            sheet.append(row)
+        written += len(frame)
+    workbook.save(output)
+    return written
+
+
+WRITERS = {"csv": write_csv, "parquet": write_parquet, "xlsx": write_xlsx}
+
+
+def export_results(partitions, output, fmt="csv", profiles_by_name=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Streams results for the given (records, RankIndex) partitions to output in one of
+    EXPORT_FORMATS. Returns the number of rows written.
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown export format '{fmt}'. Choose from {list(WRITERS)}.")
+    return WRITERS[fmt](iter_export_frames(partitions, profiles_by_name, chunk_rows), output)
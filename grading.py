@@ -0,0 +1,134 @@
+"""
+Vectorised grading engine.
+
+Grades are assigned to a whole DataFrame at once with np.select, so grading one
+student's sheet, a class, or every result in the school costs a handful of array
+operations instead of one Python call (and one new Series) per row.
+
+A grading scale is plain data: a list of bands, each with the lowest Final score
+that earns it. Score components (CA1, CA2, Exam) can be weighted, and individual
+subjects can be marked out of different maxima. Scales can be loaded from JSON so a
+school can change its boundaries without touching code.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+from metrics import metrics
+
+# Bands are checked from the highest min_score down; a score earns the first band it reaches.
+DEFAULT_GRADING_SCALE = [
+    {"min_score": 75, "grade": "A", "remark": "Excellent"},
+    {"min_score": 60, "grade": "B", "remark": "Very Good"},
+    {"min_score": 50, "grade": "C", "remark": "Credit"},
+    {"min_score": 0, "grade": "F", "remark": "Failed"},
+]
+
+WAEC_GRADING_SCALE = [
+    {"min_score": 75, "grade": "A1", "remark": "Excellent"},
+    {"min_score": 70, "grade": "B2", "remark": "Very Good"},
+    {"min_score": 65, "grade": "B3", "remark": "Good"},
+    {"min_score": 60, "grade": "C4", "remark": "Credit"},
+    {"min_score": 55, "grade": "C5", "remark": "Credit"},
+    {"min_score": 50, "grade": "C6", "remark": "Credit"},
+    {"min_score": 45, "grade": "D7", "remark": "Pass"},
+    {"min_score": 40, "grade": "E8", "remark": "Pass"},
+    {"min_score": 0, "grade": "F9", "remark": "Fail"},
+]
+
+GRADING_SCALES = {
+    "default": DEFAULT_GRADING_SCALE,
+    "waec": WAEC_GRADING_SCALE,
+}
+
+# Score components and what each is marked out of. With no weights the Final score is
+# the plain sum of the components, exactly as the score sheets have always worked.
+SCORE_COMPONENTS = ["CA1", "CA2", "Exam"]
+
+
+def validate_grading_scale(scale):
+    """Checks a scale's bands and returns them sorted from the highest min_score down."""
+    if not scale:
+        raise ValueError("A grading scale needs at least one band.")
+    for band in scale:
+        missing = [k for k in ("min_score", "grade", "remark") if k not in band]
+        if missing:
+            raise ValueError(f"Grading band {band} is missing {missing}.")
+        if not isinstance(band["min_score"], (int, float)):
+            raise ValueError(f"Grading band {band} has a non-numeric min_score.")
+    return sorted(scale, key=lambda band: band["min_score"], reverse=True)
+
+
+def load_grading_config(file_path):
+    """
+    Reads a grading configuration from JSON. Recognised keys (all optional):
+      "scale": a scale name from GRADING_SCALES or a list of bands,
+      "weights": {"CA1": 20, "CA2": 20, "Exam": 60} - what each component counts for in Final,
+      "max_scores": {"CA1": 20, "CA2": 20, "Exam": 60} - what each component is marked out of,
+      "subject_max_scores": {"Math": {"Exam": 70}, ...} - per-subject overrides of max_scores.
+    Returns a dict of keyword arguments for grade_scores.
+    """
+    with open(file_path, 'r') as f:
+        config = json.load(f)
+    scale = config.get("scale", DEFAULT_GRADING_SCALE)
+    if isinstance(scale, str):
+        if scale not in GRADING_SCALES:
+            raise ValueError(f"Unknown grading scale '{scale}'. Choose from {list(GRADING_SCALES)}.")
+        scale = GRADING_SCALES[scale]
+    return {
+        "scale": validate_grading_scale(scale),
+        "weights": config.get("weights"),
+        "max_scores": config.get("max_scores"),
+        "subject_max_scores": config.get("subject_max_scores"),
+    }
+
+
+def compute_final_scores(df_scores, weights=None, max_scores=None, subject_max_scores=None):
+    """
+    Returns the Final score for every row as a Series.
+    Without weights, Final = CA1 + CA2 + Exam. With weights, each component is scaled
+    to its weight: score / max * weight, where max comes from subject_max_scores for
+    that row's Subject, then max_scores, then the weight itself.
+    """
+    if not weights:
+        return df_scores[SCORE_COMPONENTS].sum(axis=1)
+
+    final = pd.Series(0.0, index=df_scores.index)
+    for component, weight in weights.items():
+        default_max = (max_scores or {}).get(component, weight)
+        if subject_max_scores and 'Subject' in df_scores.columns:
+            overrides = {subject: maxima[component] for subject, maxima in subject_max_scores.items() if component in maxima}
+            component_max = df_scores['Subject'].map(overrides).fillna(default_max).astype(float)
+        else:
+            component_max = default_max
+        final += df_scores[component] / component_max * weight
+    return final.round(1)
+
+
+@metrics.timed("grading.grade_scores")
+def grade_scores(df_scores, scale=None, weights=None, max_scores=None, subject_max_scores=None):
+    """
+    Adds 'Final', 'Grade' and 'Remark' columns to a DataFrame of subject scores and
+    returns it. The frame may hold one student's subjects or many students' (e.g. a
+    long frame with a student_name column for a whole class); every row is graded in
+    the same vectorised pass.
+    """
+    if df_scores.empty:
+        return df_scores
+
+    scale = validate_grading_scale(scale or DEFAULT_GRADING_SCALE)
+    components = set(SCORE_COMPONENTS) | set(weights or {})
+
+    # Ensure numeric types, coercing errors
+    for component in components:
+        df_scores[component] = pd.to_numeric(df_scores[component], errors='coerce').fillna(0)
+
+    df_scores['Final'] = compute_final_scores(df_scores, weights, max_scores, subject_max_scores)
+
+    final = df_scores['Final'].to_numpy()
+    conditions = [final >= band["min_score"] for band in scale]
+    # Anything below the lowest band (e.g. a negative typo) still gets the lowest grade
+    df_scores['Grade'] = np.select(conditions, [band["grade"] for band in scale], default=scale[-1]["grade"])
+    df_scores['Remark'] = np.select(conditions, [band["remark"] for band in scale], default=scale[-1]["remark"])
+    return df_scores
@@ -0,0 +1,196 @@
+"""
+In-process instrumentation: timing spans, counters and cache statistics.
+
+    with metrics.span("storage.load"):      # count, total and slowest time per name
+        ...
+    metrics.incr("storage.bytes_read", n)   # monotonically increasing counters
+
+Modules that keep a cache register a collector (a function returning a dict of
+numbers, e.g. the cache's hits and misses), read whenever a snapshot is taken.
+metrics.snapshot() gathers everything; metrics.write(directory) saves it as metrics.json
+and as Prometheus text (metrics.prom, for a node_exporter textfile collector).
+capture_profile() runs a block under cProfile for one-off investigations.
+
+Numbers are per process: work done in report_pdf's worker processes is not seen here.
+This module has no dependencies and must not import streamlit.
+"""
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import re
+import tempfile
+import threading
+import time
+
+PROMETHEUS_PREFIX = "report_card"
+PROFILE_TOP_FUNCTIONS = 40
+
+
+class Metrics:
+    """Thread-safe registry of spans, counters and collectors."""
+
+    def __init__(self):
+        self._spans = {}       # name -> [count, total seconds, max seconds]
+        self._counters = {}    # name -> number
+        self._collectors = {}  # name -> callable returning {key: number}
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self._last_written = 0.0
+
+    # --- Recording ---
+    @contextlib.contextmanager
+    def span(self, name):
+        """Times the block under `name`; exceptions (including Streamlit's rerun) still count."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """Decorator form of span()."""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe(self, name, seconds):
+        with self._lock:
+            entry = self._spans.get(name)
+            if entry is None:
+                self._spans[name] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def register_collector(self, name, function):
+        """function() -> {key: number}, e.g. a cache's stats method; non-numeric values are skipped."""
+        with self._lock:
+            self._collectors[name] = function
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+            self.started = time.time()
+
+    # --- Reporting ---
+    def snapshot(self):
+        with self._lock:
+            spans = {name: {"count": count, "total_seconds": total, "max_seconds": longest}
+                     for name, (count, total, longest) in sorted(self._spans.items())}
+            counters = dict(sorted(self._counters.items()))
+            collectors = sorted(self._collectors.items())
+        gauges = {}
+        for name, function in collectors:
+            try:
+                values = function()
+            except Exception as e:
+                print(f"Warning: Metrics collector {name} failed: {e}") # For debugging in console
+                continue
+            gauges[name] = {key: value for key, value in values.items()
+                            if isinstance(value, (int, float)) and not isinstance(value, bool)}
+        return {"started": self.started, "uptime_seconds": time.time() - self.started,
+                "spans": spans, "counters": counters, "gauges": gauges}
+
+    def write(self, directory, min_interval_seconds=0):
+        """
+        Writes metrics.json and metrics.prom into directory, at most once per
+        min_interval_seconds. Returns True if the files were written.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._last_written and now - self._last_written < min_interval_seconds:
+                return False
+            self._last_written = now
+        snapshot = self.snapshot()
+        _atomic_write_text(os.path.join(directory, "metrics.json"), json.dumps(snapshot, indent=2))
+        _atomic_write_text(os.path.join(directory, "metrics.prom"), to_prometheus(snapshot))
+        return True
+
+
+def _metric_name(*parts):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", "_".join((PROMETHEUS_PREFIX,) + parts))
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def to_prometheus(snapshot):
+    """A snapshot() in the Prometheus text exposition format."""
+    lines = []
+
+    def family(name, kind, samples):
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f"{name}{labels} {value:.10g}" for labels, value in samples)
+
+    spans = snapshot["spans"]
+    if spans:
+        family(_metric_name("span_calls_total"), "counter",
+               [(f'{{span="{_label(n)}"}}', s["count"]) for n, s in spans.items()])
+        family(_metric_name("span_seconds_total"), "counter",
+               [(f'{{span="{_label(n)}"}}', s["total_seconds"]) for n, s in spans.items()])
+        family(_metric_name("span_seconds_max"), "gauge",
+               [(f'{{span="{_label(n)}"}}', s["max_seconds"]) for n, s in spans.items()])
+    for name, value in snapshot["counters"].items():
+        family(_metric_name(name, "total"), "counter", [("", value)])
+    for collector, values in snapshot["gauges"].items():
+        for key, value in values.items():
+            family(_metric_name(collector, key), "gauge", [("", value)])
+    family(_metric_name("uptime_seconds"), "gauge", [("", snapshot["uptime_seconds"])])
+    return "\n".join(lines) + "\n"
+
+
+def _atomic_write_text(path, text):
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class ProfileCapture:
+    """Filled in by capture_profile(): `text` is the pstats report once the block has ended."""
+
+    def __init__(self):
+        self.text = ""
+
+
+@contextlib.contextmanager
+def capture_profile(sort_by="cumulative", limit=PROFILE_TOP_FUNCTIONS):
+    """
+    Runs the block under cProfile and puts the top `limit` functions (by sort_by) in
+    the yielded ProfileCapture's text, also when the block raises.
+    """
+    capture = ProfileCapture()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield capture
+    finally:
+        profiler.disable()
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).strip_dirs().sort_stats(sort_by).print_stats(limit)
+        capture.text = output.getvalue()
+
+
+metrics = Metrics()
@@ -0,0 +1,115 @@
+"""
+Searchable, filterable, paginated views over a store's records.
+
+A RecordIndex is built once per store version and answers queries without scanning
+the records:
+  - search: every word of the searchable fields (e.g. student name, reg number) is
+    kept in a sorted list, so each query word is a binary search for the words it
+    prefixes ("ada" finds "Adams", "jss1" finds "JSS1A");
+  - filters: exact values (e.g. session, term) map to the record positions holding them.
+Matches come back as positions, and only the requested page of records is looked up,
+so the portal sends one page - not the whole table - to the browser.
+
+This module must not import streamlit.
+"""
+import bisect
+import re
+import threading
+
+from metrics import metrics
+
+DEFAULT_PAGE_SIZE = 50
+PAGE_SIZES = [25, 50, 100, 250]
+
+
+def _words(value):
+    return re.findall(r"[a-z0-9]+", str(value).lower()) if value is not None else []
+
+
+class RecordIndex:
+    """Search and filter index over a sequence of records (kept by reference, not copied)."""
+
+    def __init__(self, records, search_fields=(), filter_fields=()):
+        self.records = records
+        entries = []
+        for position, record in enumerate(records):
+            for field in search_fields:
+                for word in set(_words(record.get(field))):
+                    entries.append((word, position))
+        entries.sort()
+        self._words = [word for word, _ in entries]
+        self._word_positions = [position for _, position in entries]
+
+        self._values = {field: {} for field in filter_fields}
+        for position, record in enumerate(records):
+            for field in filter_fields:
+                self._values[field].setdefault(record.get(field) or "", []).append(position)
+
+    def _prefix_matches(self, prefix):
+        start = bisect.bisect_left(self._words, prefix)
+        # Every word with this prefix sorts between prefix and prefix + the highest character
+        end = bisect.bisect_left(self._words, prefix + "\uffff", lo=start)
+        return set(self._word_positions[start:end])
+
+    def filter_options(self, field):
+        """The distinct non-empty values of a filter field, sorted."""
+        return sorted(value for value in self._values.get(field, {}) if value)
+
+    def select(self, query="", filters=None):
+        """
+        Positions of the records matching every query word (as a prefix of some word of a
+        searchable field) and every {field: value} filter, in record order.
+        """
+        matches = None
+        for word in _words(query):
+            found = self._prefix_matches(word)
+            matches = found if matches is None else matches & found
+        for field, value in (filters or {}).items():
+            found = set(self._values.get(field, {}).get(value, ()))
+            matches = found if matches is None else matches & found
+        if matches is None:
+            return range(len(self.records))
+        return sorted(matches)
+
+
+def paginate(index, positions, page, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Returns (records on the page, page actually shown, number of pages). page is
+    1-based and clamped to the available pages.
+    """
+    pages = max(1, -(-len(positions) // page_size))
+    page = min(max(1, page), pages)
+    start = (page - 1) * page_size
+    return [index.records[p] for p in positions[start:start + page_size]], page, pages
+
+
+class RecordIndexCache:
+    """One RecordIndex per table name, rebuilt only when the stamp passed in changes."""
+
+    def __init__(self):
+        self._entries = {} # name -> (stamp, RecordIndex)
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, name, stamp, records, search_fields=(), filter_fields=()):
+        """
+        records may be a function returning them, called only when a rebuild is needed.
+        Read the stamp before the records: records newer than their stamp only cost an
+        extra rebuild later, while older ones would be served as current.
+        """
+        key = (stamp, tuple(search_fields), tuple(filter_fields))
+        with self._lock:
+            cached = self._entries.get(name)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+        if callable(records):
+            records = records()
+        index = RecordIndex(records, search_fields, filter_fields)
+        with self._lock:
+            self._entries[name] = (key, index)
+            self.builds += 1
+        return index
+
+
+record_index_cache = RecordIndexCache()
+metrics.register_collector("record_index_cache", lambda: {"builds": record_index_cache.builds})
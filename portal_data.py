@@ -0,0 +1,248 @@
+"""
+Where the portal keeps its data, and the operations on it that need no browser.
+
+student_portal.py (the Streamlit app) and report_card_cli.py (batch jobs run from a
+shell or cron) both work through this module, so they read and write the same
+stores in the same way. Functions here raise on failure; the app turns errors into
+messages for the user and the command line prints them.
+
+This module must not import streamlit.
+"""
+import os
+import threading
+from datetime import datetime
+
+from auth import default_password_hash
+from metrics import metrics
+from ranking import ordinal
+from report_layout import LayoutRegistry
+from results_history import get_results_history
+from storage import UnitOfWork, get_store, record_stamp, recover_transactions
+
+# --- Configuration and Data Paths ---
+# REPORT_CARD_DATA_DIR lets batch jobs point at a data folder other than ./student_data
+DATA_DIR = os.environ.get("REPORT_CARD_DATA_DIR", "student_data")
+STUDENTS_FILE = os.path.join(DATA_DIR, "students.json")
+RESULTS_FILE = os.path.join(DATA_DIR, "results.json") # Pre-partitioning results; moved into RESULTS_DIR on first run
+RESULTS_DIR = os.path.join(DATA_DIR, "results") # One results store per academic session and term
+JOURNAL_DIR = os.path.join(DATA_DIR, "journal") # Changes spanning several data files, until they are fully saved
+STUDENT_PROFILES_FILE = os.path.join(DATA_DIR, "student_profiles.json") # New file for profiles
+
+# Storage backend: "json" (default, flat files + change log) or "sqlite" (indexed database).
+# Switching to "sqlite" imports the existing JSON files into the database on first use.
+STORAGE_BACKEND = os.environ.get("REPORT_CARD_STORAGE", "json")
+DATABASE_FILE = os.path.join(DATA_DIR, "portal.db")
+
+# Optional grading configuration (grade boundaries, CA/Exam weights, per-subject maxima).
+# See grading.load_grading_config for the format; without it the A/B/C/F scale is used.
+GRADING_CONFIG_FILE = os.path.join(DATA_DIR, "grading_config.json")
+
+# Report card layouts: default.json (or .yaml) for the school, <class>.json for one class.
+# See report_layout.py for the format; without any, the built-in card is used.
+LAYOUTS_DIR = os.path.join(DATA_DIR, "report_layouts")
+
+# Password given to accounts created automatically; it is stored hashed like any other
+DEFAULT_STUDENT_PASSWORD = "123456"
+
+# The sessions and terms results can be saved for (the portal's dropdowns, the CLI's --session/--term)
+SESSIONS = [f"{year}/{year+1}" for year in range(2023, datetime.now().year + 2)] # Generate current and future sessions
+TERMS = ["First Term", "Second Term", "Third Term"]
+
+# Ensure data directory exists
+os.makedirs(DATA_DIR, exist_ok=True)
+
+# For each data file: its SQLite table, the field that identifies a record, and the
+# fields that get a (case-insensitive) lookup index.
+STORE_SPECS = {
+    STUDENTS_FILE: {"table": "students", "key": "username", "indexes": ["username"]},
+    RESULTS_FILE: {"table": "results", "key": "student_name", "indexes": ["student_name", "session", "term"]},
+    STUDENT_PROFILES_FILE: {"table": "student_profiles", "key": "student_name", "indexes": ["student_name", "reg_number", "session", "term"]},
+}
+
+# Files whose records appear on a report card; saving them drops cached PDFs
+REPORT_CARD_FILES = (RESULTS_FILE, STUDENT_PROFILES_FILE)
+
+report_layouts = LayoutRegistry(LAYOUTS_DIR)
+metrics.register_collector("report_layouts", report_layouts.stats)
+
+
+def get_data_store(file_path):
+    """Returns the record store behind one of the portal's data files."""
+    spec = STORE_SPECS[file_path]
+    return get_store(file_path, spec["key"], index_fields=spec["indexes"],
+                     backend=STORAGE_BACKEND, db_path=DATABASE_FILE, table=spec["table"])
+
+
+def get_results():
+    """Returns the results history, stored per academic session and term (see results_history.py)."""
+    return get_results_history(RESULTS_DIR, backend=STORAGE_BACKEND, db_path=DATABASE_FILE)
+
+
+_prepared = False
+_prepare_lock = threading.Lock()
+
+
+def prepare_data():
+    """
+    Gets the data folder ready, once per process and before anything is written:
+    finishes interrupted multi-file saves (storage.recover_transactions), then moves
+    results saved before partitioning into per-session/term storage. Later calls do
+    nothing; after an error the next call tries again. Returns the number of
+    transactions recovered and of results moved.
+    """
+    global _prepared
+    with _prepare_lock:
+        if _prepared:
+            return {"recovered": 0, "moved": 0}
+        recovered = recover_transactions(JOURNAL_DIR)
+        moved = get_results().migrate_legacy(get_data_store(RESULTS_FILE), get_data_store(STUDENT_PROFILES_FILE))
+        _prepared = True
+        return {"recovered": recovered, "moved": moved}
+
+
+def basic_profile(student_name):
+    """The empty profile created for a student who has results or an account but no profile yet."""
+    return {
+        "student_name": student_name,
+        "age": "", "reg_number": "", "parent_name": "",
+        "parent_phone": "", "parent_address": "",
+        "session": "", "term": ""
+    }
+
+
+# --- Bulk Result Import ---
+def match_existing_students(batch, find_existing):
+    """
+    Renames an import_result_workbooks batch's students to the stored spelling of
+    students already on record ("adams " -> "Adams"). find_existing(name) returns that
+    spelling or None (see search_index.StudentSearchIndex.find_existing).
+    Returns (batch, {imported name: stored name}).
+    """
+    renamed = {}
+    for entry in batch['entries']:
+        existing_name = find_existing(entry['student_name'])
+        if existing_name and existing_name != entry['student_name']:
+            renamed[entry['student_name']] = existing_name
+    if renamed:
+        batch = dict(batch,
+                     entries=[dict(e, student_name=renamed.get(e['student_name'], e['student_name'])) for e in batch['entries']],
+                     graded=batch['graded'].assign(student_name=batch['graded']['student_name'].replace(renamed)))
+    return batch, renamed
+
+
+def save_result_entries(entries, session, term, expected=None):
+    """
+    Saves many students' results for one session and term as one transaction, creating
+    login accounts (with DEFAULT_STUDENT_PASSWORD) and basic profiles for students that
+    don't have them yet. expected maps student names to the stamps of the results the
+    caller showed (record_stamp); other students' results must not change while this
+    runs. Raises storage.ConflictError otherwise. Returns counts of results, accounts
+    and profiles written.
+    """
+    results_store = get_results().writable_store(session, term)
+    students_store = get_data_store(STUDENTS_FILE)
+    profiles_store = get_data_store(STUDENT_PROFILES_FILE)
+
+    # Merge into what is stored, and refuse the save if any of it changes before we write
+    stored = {e['student_name']: results_store.get(e['student_name']) for e in entries}
+    merged_entries = [dict(stored[e['student_name']] or {}, **e) for e in entries]
+
+    next_id = max([s.get('id', 0) for s in students_store.all()], default=0) + 1
+    new_accounts = []
+    new_profiles = []
+    for entry in entries:
+        student_name = entry['student_name']
+        if students_store.find_one('username', student_name) is None:
+            new_accounts.append({"id": next_id, "username": student_name, "password": default_password_hash(DEFAULT_STUDENT_PASSWORD)})
+            next_id += 1
+        if profiles_store.find_one('student_name', student_name) is None:
+            new_profiles.append(basic_profile(student_name))
+
+    # Results, new accounts and new profiles are saved together or not at all
+    with UnitOfWork(JOURNAL_DIR) as uow:
+        get_results().save(merged_entries, session, term, uow,
+                           expected=dict({name: record_stamp(record) for name, record in stored.items()}, **(expected or {})))
+        uow.upsert_many(students_store, new_accounts, expected={a['username']: None for a in new_accounts})
+        uow.upsert_many(profiles_store, new_profiles, expected={p['student_name']: None for p in new_profiles})
+    return {"results": len(merged_entries), "accounts": len(new_accounts), "profiles": len(new_profiles)}
+
+
+# --- Report Card Jobs ---
+CUMULATIVE_TERM = "Cumulative" # The term shown on a whole-session report card
+
+
+def report_card_profile(profile, session, term):
+    """The profile as printed on a card: session and term are those of the results shown."""
+    if not session and not term:
+        return dict(profile) if profile else None
+    return dict(profile or {}, session=session, term=term)
+
+
+def report_card_results(results, rank_index, student_name):
+    """A student's subject rows as printed on a card: with the class average and position in each subject."""
+    averages = rank_index.subject_averages(student_name)
+    positions = rank_index.subject_positions(student_name)
+    if not averages and not positions:
+        return list(results)
+    return [dict(row,
+                 **{"Class Avg": round(averages[row.get('Subject')], 1) if row.get('Subject') in averages else "N/A",
+                    "Position": ordinal(positions[row.get('Subject')]) if row.get('Subject') in positions else "N/A"})
+            for row in results]
+
+
+def cumulative_records(session, term_records):
+    """
+    Whole-session result records from [(term, records), ...] of one session, in term
+    order: per subject, each term's Final score and their average. total_score adds up
+    the averages, so cumulative positions compare like term positions do.
+    """
+    terms = [term for term, _ in term_records]
+    by_student = {}
+    for term, records in term_records:
+        for record in records:
+            subjects = by_student.setdefault(record['student_name'], {})
+            for row in record.get('results', []):
+                subjects.setdefault(row.get('Subject'), {})[term] = row.get('Final')
+
+    cumulative = []
+    for student_name, subjects in by_student.items():
+        results = []
+        for subject, finals in subjects.items():
+            scores = [finals[t] for t in terms if isinstance(finals.get(t), (int, float))]
+            row = {"Subject": subject}
+            row.update((term, finals.get(term, "-")) for term in terms)
+            row["Average"] = round(sum(scores) / len(scores), 1) if scores else "-"
+            results.append(row)
+        cumulative.append({
+            "student_name": student_name,
+            "total_score": round(sum(r["Average"] for r in results if r["Average"] != "-"), 1),
+            "results": results,
+            "session": session,
+            "term": CUMULATIVE_TERM,
+        })
+    return cumulative
+
+
+def load_cumulative_records(session):
+    """Whole-session records (see cumulative_records) from every term of `session` that has results."""
+    results = get_results()
+    return cumulative_records(session, [(term, results.load(session, term)) for s, term in results.partitions() if s == session])
+
+
+def report_card_layout(profile):
+    """The compiled layout for a student's card: their class's, else the school's (see report_layout.LayoutRegistry)."""
+    return report_layouts.layout((profile or {}).get('class_name'))
+
+
+def build_report_card_jobs(results_records, profiles_by_name, rank_index, session, term):
+    """Turns one session/term's result records into picklable render jobs for report_pdf's batch functions."""
+    return [{
+        "student_name": r['student_name'],
+        "results": report_card_results(r['results'], rank_index, r['student_name']),
+        "total_score": r.get('total_score', 0),
+        "rank": rank_index.position_label(r['student_name']),
+        "profile": report_card_profile(profiles_by_name.get(r['student_name']), session, term),
+        "layout": report_card_layout(profiles_by_name.get(r['student_name'])),
+        "session": session,
+        "term": term,
+    } for r in results_records]
@@ -0,0 +1,191 @@
+"""
+Class positions.
+
+A RankIndex is built once from all result records (vectorised with pandas) and then
+answers "what position is this student?" with a dict lookup. Positions use standard
+competition ranking - equal totals share a position and the next one is skipped
+(1st, 2nd, 2nd, 4th) - and are computed separately within each class, session and
+term. Subject positions are worked out the same way from each subject's Final score,
+along with each subject's class average.
+"""
+import hashlib
+import json
+import numbers
+import threading
+
+import pandas as pd
+
+from metrics import metrics
+
+# A student's ranking scope: students are only ranked against others in the same scope
+SCOPE_FIELDS = ("class_name", "session", "term")
+
+
+def ordinal(n):
+    """Converts a number to its ordinal string (e.g., 1st, 2nd, 3rd)."""
+    return "%d%s" % (n, "tsnrhtdd"[(n//10%10!=1)*(n%10<4)*n%10::4])
+
+
+def record_scope(result_record, profile=None):
+    """
+    The (class_name, session, term) a result belongs to. Fields on the result record
+    win; anything missing is taken from the student's profile, then left blank.
+    """
+    profile = profile or {}
+    return tuple(str(result_record.get(f) or profile.get(f) or "") for f in SCOPE_FIELDS)
+
+
+def profile_scope_stamp(results_records, profiles_by_name=None):
+    """
+    A fingerprint of only the profile fields record_scope falls back on for these
+    records, so a cached ranking or summary can outlive edits to other students' profiles.
+    """
+    if profiles_by_name is None:
+        profiles_by_name = {}
+    used = []
+    for record in results_records:
+        missing = [f for f in SCOPE_FIELDS if not record.get(f)]
+        if missing:
+            profile = profiles_by_name.get(record['student_name']) or {}
+            used.append([record['student_name']] + [str(profile.get(f) or "") for f in missing])
+    encoded = json.dumps(sorted(used), separators=(',', ':'))
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()[:16]
+
+
+class ScopeStampCache:
+    """
+    profile_scope_stamp per results partition, recomputed only when the versions passed in
+    (the partition's and the profiles store's) change. Callers stamp rank indexes and
+    analytics summaries with (partition version, scope stamp), so one profile edit only
+    rebuilds the partitions whose students' class scope it actually changed.
+    """
+
+    def __init__(self):
+        self._entries = {} # partition -> (versions, scope stamp)
+        self._lock = threading.Lock()
+
+    def get(self, partition, versions, results_records, profiles_by_name=None):
+        """results_records may be a function returning them, called only when the versions changed."""
+        with self._lock:
+            cached = self._entries.get(partition)
+            if cached is not None and cached[0] == versions:
+                return cached[1]
+        if callable(results_records):
+            results_records = results_records()
+        stamp = profile_scope_stamp(results_records, profiles_by_name)
+        with self._lock:
+            self._entries[partition] = (versions, stamp)
+        return stamp
+
+
+class RankIndex:
+    """Precomputed overall and per-subject positions for every student, by scope."""
+
+    def __init__(self, positions, class_sizes, subject_positions, subject_averages=None):
+        self._positions = positions                  # student_name -> (scope, position)
+        self._class_sizes = class_sizes              # scope -> number of ranked students
+        self._subject_positions = subject_positions  # student_name -> {subject: position}
+        self._subject_averages = subject_averages or {}  # scope -> {subject: mean Final}
+
+    def position(self, student_name):
+        entry = self._positions.get(student_name)
+        return entry[1] if entry else None
+
+    def position_label(self, student_name, default="N/A"):
+        position = self.position(student_name)
+        return ordinal(position) if position else default
+
+    def scope(self, student_name):
+        entry = self._positions.get(student_name)
+        return entry[0] if entry else None
+
+    def class_size(self, student_name):
+        scope = self.scope(student_name)
+        return self._class_sizes.get(scope, 0) if scope is not None else 0
+
+    def subject_positions(self, student_name):
+        return self._subject_positions.get(student_name, {})
+
+    def subject_averages(self, student_name):
+        """{subject: class average Final} for the student's class, session and term."""
+        scope = self.scope(student_name)
+        return self._subject_averages.get(scope, {}) if scope is not None else {}
+
+    def __len__(self):
+        return len(self._positions)
+
+
+@metrics.timed("ranking.build_rank_index")
+def build_rank_index(results_records, profiles_by_name=None):
+    """
+    Ranks every result record with a numeric total_score within its scope, and every
+    subject by Final score within the same scope. profiles_by_name is anything with
+    .get(student_name) - a dict or the profiles record store.
+    """
+    if profiles_by_name is None:
+        profiles_by_name = {}
+    rows = []
+    subject_rows = []
+    for record in results_records:
+        total = record.get('total_score')
+        # numpy scalars (e.g. a DataFrame column's sum) count too; bools do not
+        if not isinstance(total, numbers.Real) or isinstance(total, bool):
+            continue
+        name = record['student_name']
+        scope = record_scope(record, profiles_by_name.get(name))
+        rows.append((name, scope, total))
+        for subject_row in record.get('results', []):
+            subject_rows.append((name, scope, subject_row.get('Subject'), subject_row.get('Final')))
+
+    if not rows:
+        return RankIndex({}, {}, {})
+
+    totals = pd.DataFrame(rows, columns=['student_name', 'scope', 'total_score'])
+    totals['position'] = totals.groupby('scope')['total_score'].rank(method='min', ascending=False).astype(int)
+    positions = {name: (scope, position) for name, scope, position in totals[['student_name', 'scope', 'position']].itertuples(index=False)}
+    class_sizes = totals.groupby('scope').size().to_dict()
+
+    subject_positions = {}
+    subject_averages = {}
+    if subject_rows:
+        subjects = pd.DataFrame(subject_rows, columns=['student_name', 'scope', 'Subject', 'Final'])
+        subjects['Final'] = pd.to_numeric(subjects['Final'], errors='coerce')
+        subjects = subjects.dropna(subset=['Final'])
+        subjects['position'] = subjects.groupby(['scope', 'Subject'])['Final'].rank(method='min', ascending=False).astype(int)
+        for name, subject, position in subjects[['student_name', 'Subject', 'position']].itertuples(index=False):
+            subject_positions.setdefault(name, {})[subject] = position
+        for (scope, subject), average in subjects.groupby(['scope', 'Subject'])['Final'].mean().items():
+            subject_averages.setdefault(scope, {})[subject] = average
+
+    return RankIndex(positions, class_sizes, subject_positions, subject_averages)
+
+
+class RankIndexCache:
+    """
+    Holds a RankIndex per results partition (e.g. per session and term) and rebuilds one
+    only when the stamp passed in changes (callers use the results version and the
+    ScopeStampCache stamp), so it is computed once per save rather than once per page view.
+    """
+
+    def __init__(self):
+        self._entries = {} # partition -> (stamp, RankIndex)
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, partition, stamp, results_records, profiles_by_name=None):
+        """results_records may be a function returning them, called only when a rebuild is needed."""
+        with self._lock:
+            cached = self._entries.get(partition)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+            if callable(results_records):
+                results_records = results_records()
+            index = build_rank_index(results_records, profiles_by_name)
+            self._entries[partition] = (stamp, index)
+            self.builds += 1
+            return index
+
+
+rank_index_cache = RankIndexCache()
+scope_stamp_cache = ScopeStampCache()
+metrics.register_collector("rank_index_cache", lambda: {"builds": rank_index_cache.builds})
@@ -0,0 +1,244 @@
+"""
+Command-line tool for batch jobs that need no browser: importing result workbooks,
+printing class positions and rendering report cards, e.g. from cron.
+
+    python report_card_cli.py import uploads/ --session 2024/2025 --term "First Term" --render cards.zip
+    python report_card_cli.py ranks --session 2024/2025 --term "First Term"
+    python report_card_cli.py render --session 2024/2025 --output cards/ --workers 4
+    python report_card_cli.py render --session 2024/2025 --cumulative --output session_cards.zip
+
+It works on the same data as the portal (see portal_data.py) and never imports
+streamlit; the heavy modules (pandas, fpdf) are only imported by the command that
+needs them, so `--help` and argument errors return at once. Run it from the app
+folder so the logo, signatures and student photos are found.
+"""
+import argparse
+import os
+import sys
+
+
+# As excel_import.WORKBOOK_TYPES, without importing pandas before a command needs it
+WORKBOOK_EXTENSIONS = (".xlsx", ".xls", ".csv")
+
+
+def _warn(message):
+    print(message, file=sys.stderr)
+
+
+def _open_data():
+    """Finishes interrupted saves and moves pre-partitioning results, as the portal does on start."""
+    from portal_data import prepare_data
+
+    prepared = prepare_data()
+    if prepared["recovered"]:
+        _warn(f"Completed {prepared['recovered']} interrupted save(s).")
+    if prepared["moved"]:
+        _warn(f"Moved {prepared['moved']} saved result(s) into per-session/term storage.")
+
+
+def _grading_options():
+    from grading import load_grading_config
+    from portal_data import GRADING_CONFIG_FILE
+
+    if os.path.exists(GRADING_CONFIG_FILE):
+        try:
+            return load_grading_config(GRADING_CONFIG_FILE)
+        except Exception as e:
+            _warn(f"Warning: Could not read grading configuration from {GRADING_CONFIG_FILE}: {e}. Using the default grading scale.")
+    return {}
+
+
+def _workbook_paths(paths):
+    """The files named, plus the workbooks (.xlsx/.xls/.csv) directly inside any directories named (sorted)."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if name.lower().endswith(WORKBOOK_EXTENSIONS) and not name.startswith("~$")) # ~$ = Excel lock files
+        else:
+            found.append(path)
+    return found
+
+
+def _selected_partitions(session, term):
+    from portal_data import get_results
+
+    return [(s, t) for s, t in get_results().partitions()
+            if (session is None or s == session) and (term is None or t == term)]
+
+
+# --- Commands ---
+def import_command(args):
+    from excel_import import import_result_workbooks
+    from portal_data import STUDENT_PROFILES_FILE, STUDENTS_FILE, get_data_store, match_existing_students, save_result_entries
+    from search_index import StudentSearchIndex
+
+    _open_data()
+    paths = _workbook_paths(args.paths)
+    if not paths:
+        _warn("No workbooks (.xlsx, .xls or .csv) found.")
+        return 2
+    batch = import_result_workbooks([(os.path.basename(p), p) for p in paths], _grading_options())
+
+    index = StudentSearchIndex(get_data_store(STUDENT_PROFILES_FILE).all(), get_data_store(STUDENTS_FILE).all())
+    batch, renamed = match_existing_students(batch, index.find_existing)
+    for old, new in renamed.items():
+        print(f"Matched '{old}' to existing student '{new}'.")
+    for error in batch['errors']:
+        _warn(f"{error['source']}: {error.get('student_name') or '-'}: {error['error']}")
+    if not batch['entries']:
+        _warn("No student results could be read from the given files.")
+        return 2
+
+    if args.dry_run:
+        print(f"Would save results for {len(batch['entries'])} students from {len(paths)} file(s) (dry run).")
+        return 0
+    saved = save_result_entries(batch['entries'], args.session, args.term)
+    print(f"Saved results for {saved['results']} students for {args.session} - {args.term} "
+          f"({saved['accounts']} new accounts, {saved['profiles']} new profiles).")
+    code = 1 if batch['errors'] else 0
+    if args.render:
+        # Rows that could not be imported still fail the run, even if rendering succeeds
+        return max(_render([(args.session, args.term)], args.render, args.workers), code)
+    return code
+
+
+def ranks_command(args):
+    import pandas as pd
+    from portal_data import STUDENT_PROFILES_FILE, get_data_store, get_results
+    from ranking import build_rank_index
+
+    _open_data()
+    profiles = get_data_store(STUDENT_PROFILES_FILE)
+    rows = []
+    for session, term in _selected_partitions(args.session, args.term):
+        records = get_results().load(session, term)
+        rank_index = build_rank_index(records, profiles)
+        for record in records:
+            name = record['student_name']
+            scope = rank_index.scope(name) # (class, session, term)
+            rows.append({"Session": session, "Term": term, "Class": scope[0] if scope else "", "Student Name": name,
+                         "Total Score": record.get('total_score'), "Position": rank_index.position(name),
+                         "Class Size": rank_index.class_size(name)})
+    frame = pd.DataFrame(rows, columns=["Session", "Term", "Class", "Student Name", "Total Score", "Position", "Class Size"])
+    frame = frame.sort_values(["Session", "Term", "Class", "Position"], kind="stable", na_position="last")
+    frame.to_csv(args.output or sys.stdout, index=False)
+    return 0
+
+
+def render_command(args):
+    _open_data()
+    partitions = _selected_partitions(args.session, args.term)
+    if not partitions:
+        _warn("No saved results for that session/term.")
+        return 2
+    return _render(partitions, args.output, args.workers, args.cumulative)
+
+
+def _render(partitions, output, workers, cumulative=False):
+    """
+    Renders report cards for the given partitions to a .zip, a merged .pdf or a folder of
+    PDFs; with cumulative, one card per student and session with every term on it.
+    """
+    from portal_data import (CUMULATIVE_TERM, STUDENT_PROFILES_FILE, build_report_card_jobs, get_data_store,
+                             get_results, load_cumulative_records)
+    from ranking import build_rank_index
+    from report_pdf import iter_rendered_report_cards, render_report_cards_merged, render_report_cards_zip
+
+    profiles = get_data_store(STUDENT_PROFILES_FILE)
+    jobs = []
+    if cumulative:
+        for session in dict.fromkeys(session for session, _ in partitions):
+            records = load_cumulative_records(session)
+            jobs.extend(build_report_card_jobs(records, profiles, build_rank_index(records, profiles), session, CUMULATIVE_TERM))
+    else:
+        for session, term in partitions:
+            records = get_results().load(session, term)
+            jobs.extend(build_report_card_jobs(records, profiles, build_rank_index(records, profiles), session, term))
+    if not jobs:
+        _warn("No report cards to render.")
+        return 2
+
+    def progress(done, total):
+        if done == total or done % 100 == 0:
+            _warn(f"Rendered {done} of {total} report cards")
+
+    if output.lower().endswith(".zip"):
+        count = render_report_cards_zip(jobs, output, workers=workers, progress=progress)
+    elif output.lower().endswith(".pdf"):
+        count = render_report_cards_merged(jobs, output, progress=progress)
+    else:
+        os.makedirs(output, exist_ok=True)
+        count = 0
+        for filename, data in iter_rendered_report_cards(jobs, workers):
+            with open(os.path.join(output, filename), 'wb') as f:
+                f.write(data)
+            count += 1
+            progress(count, len(jobs))
+    print(f"Wrote {count} report card(s) to {output}.")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="report_card_cli.py", description="Batch jobs for the report card portal, without the web app.")
+    parser.add_argument("--data-dir", help="Data folder (default: student_data, or $REPORT_CARD_DATA_DIR).")
+    parser.add_argument("--storage", choices=["json", "sqlite"], help="Storage backend (default: $REPORT_CARD_STORAGE or json).")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    importer = commands.add_parser("import", help="Import and grade result workbooks, then save them for one session and term.")
+    importer.add_argument("paths", nargs="+", help=".xlsx/.xls/.csv files, or folders of them")
+    importer.add_argument("--session", required=True, help="Academic session, e.g. 2024/2025")
+    importer.add_argument("--term", required=True, help="Academic term, e.g. 'First Term'")
+    importer.add_argument("--dry-run", action="store_true", help="Read and grade only; save nothing.")
+    importer.add_argument("--render", metavar="OUTPUT", help="Afterwards render this term's report cards to OUTPUT (see render).")
+    importer.add_argument("--workers", type=int, help="Processes used for rendering (default: one per CPU).")
+    importer.set_defaults(handler=import_command)
+
+    ranks = commands.add_parser("ranks", help="Write class positions as CSV.")
+    ranks.add_argument("--session", help="Only this academic session")
+    ranks.add_argument("--term", help="Only this academic term")
+    ranks.add_argument("--output", help="CSV file to write (default: standard output)")
+    ranks.set_defaults(handler=ranks_command)
+
+    render = commands.add_parser("render", help="Render report cards.")
+    render.add_argument("--session", help="Only this academic session")
+    render.add_argument("--term", help="Only this academic term")
+    render.add_argument("--output", required=True, help="A .zip, a single merged .pdf, or a folder for one PDF per student")
+    render.add_argument("--workers", type=int, help="Processes used for rendering (default: one per CPU).")
+    render.add_argument("--cumulative", action="store_true", help="One card per student and session, with every term's scores and their average (not with --term).")
+    render.set_defaults(handler=render_command)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, "cumulative", False) and args.term:
+        parser.error("--cumulative covers every term of a session; use --session without --term.")
+    # Read by portal_data when it is first imported, i.e. inside the command
+    if args.data_dir:
+        os.environ["REPORT_CARD_DATA_DIR"] = args.data_dir
+    if args.storage:
+        os.environ["REPORT_CARD_STORAGE"] = args.storage
+    if args.command == "import":
+        # Saved results must land in a session and term the portal offers
+        from portal_data import SESSIONS, TERMS
+
+        if args.session not in SESSIONS:
+            parser.error(f"argument --session: invalid choice: '{args.session}' (choose from {', '.join(SESSIONS)})")
+        if args.term not in TERMS:
+            parser.error(f"argument --term: invalid choice: '{args.term}' (choose from {', '.join(TERMS)})")
+    try:
+        return args.handler(args)
+    except BrokenPipeError:
+        # Whatever read our output has stopped (e.g. `ranks | head`): stop quietly, and
+        # point stdout at devnull so the interpreter's final flush doesn't complain either
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    except Exception as e:
+        _warn(f"Error: {e}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
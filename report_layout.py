@@ -0,0 +1,285 @@
+"""
+Report card layouts.
+
+What a card shows around the results table - the header lines, crest, photo, profile
+fields, signatures and footer - comes from a layout template instead of code, so a
+school (or one class) can change it by dropping a file into the layouts folder:
+
+    report_layouts/default.json      the school's card
+    report_layouts/jss1_a.json       changes for class "JSS1 A" (see layout_slug)
+
+Templates are JSON, or YAML (.yaml/.yml) when PyYAML is installed. Every key is
+optional: a class's file only needs what differs from the school's, and anything the
+school's leaves out is taken from DEFAULT_LAYOUT, the portal's original card:
+
+    {
+      "header": [{"text": "IGBOBI COLLEGE YABA", "style": "B", "size": 14}, ...],
+      "logo": "ICY.png",                  # file in the assets folder, or null
+      "photo": true,                      # the student's photo, top right
+      "profile_fields": [{"label": "Age", "field": "age", "empty": "N/A"}, ...],
+      "signatures": [{"label": "Class Teacher", "image": "class_teacher_signature.png"}, ...],
+      "footer": "Page {page}/{pages}"
+    }
+
+"empty" says what a profile field shows when it is blank: "" (the blank value),
+"N/A", or "hide" to leave the line off. A template is compiled once into a LayoutPlan:
+validated, with texts, fonts and signature positions worked out, so rendering a card
+only fills in the student's own fields. Plans are plain data, so they travel to
+report_pdf's worker processes inside render jobs.
+
+Like report_pdf, this module must not import streamlit.
+"""
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+DEFAULT_LAYOUT = {
+    "header": [
+        {"text": "IGBOBI COLLEGE YABA", "style": "B", "size": 14},
+        {"text": "Igobobi College Road, Fadeyi, Lagos", "style": "", "size": 12},
+    ],
+    "logo": "ICY.png",
+    "photo": True,
+    "profile_fields": [
+        {"label": "Age", "field": "age", "empty": "N/A"},
+        {"label": "Registration No.", "field": "reg_number", "empty": ""},
+        {"label": "Class", "field": "class_name", "empty": "hide"},
+        {"label": "Academic Session", "field": "session", "empty": ""},
+        {"label": "Academic Term", "field": "term", "empty": ""},
+        {"label": "Parent/Guardian", "field": "parent_name", "empty": ""},
+        {"label": "Parent Phone", "field": "parent_phone", "empty": ""},
+        {"label": "Parent Address", "field": "parent_address", "empty": ""},
+    ],
+    "signatures": [
+        {"label": "Class Teacher", "image": "class_teacher_signature.png"},
+        {"label": "HOD", "image": "hod_signature.png"},
+        {"label": "Principal", "image": "principal_signature.png"},
+    ],
+    "footer": "Page {page}/{pages}",
+}
+LAYOUT_EXTENSIONS = (".json", ".yaml", ".yml")
+DEFAULT_LAYOUT_NAME = "default"
+EMPTY_CHOICES = ("", "N/A", "hide")
+FONT_STYLES = ("", "B", "I", "BI")
+
+# Card geometry (mm, A4 portrait as fpdf creates it)
+PAGE_WIDTH = 595.28 * 25.4 / 72 # fpdf's A4 width in points, as mm (about 210)
+SIGNATURE_WIDTH = 30
+SIGNATURE_HEIGHT = 15
+SIGNATURE_MARGIN = 20 # From the page edge to the outer signatures
+RELOAD_CHECK_SECONDS = 2.0
+
+
+def layout_slug(name):
+    """File name (without extension) of a class's layout, e.g. 'JSS1 A' -> 'jss1_a'."""
+    return re.sub(r"[^a-z0-9]+", "_", str(name).lower()).strip("_")
+
+
+def signature_positions(count, page_width=PAGE_WIDTH):
+    """x of each of `count` signatures: spread evenly from margin to margin, a single one centred."""
+    if count == 1:
+        return [page_width / 2 - SIGNATURE_WIDTH / 2]
+    left, right = SIGNATURE_MARGIN, page_width - SIGNATURE_WIDTH - SIGNATURE_MARGIN
+    return [left + (right - left) * i / (count - 1) for i in range(count)]
+
+
+class LayoutPlan:
+    """A compiled template: everything a card needs apart from the student's own data."""
+
+    def __init__(self, header_lines, logo, photo, profile_fields, signatures, footer, fingerprint):
+        self.header_lines = header_lines       # [(font style, size, text)]
+        self.logo = logo                       # asset file name or None
+        self.photo = photo
+        self.profile_fields = profile_fields   # [(label prefix, field, text when empty or None to hide)]
+        self.signatures = signatures           # [(x, caption, asset file name or None)]
+        self.footer = footer
+        self.fingerprint = fingerprint         # Changes whenever anything printed changes
+
+    @property
+    def asset_files(self):
+        """The images this layout puts on every card."""
+        return [name for name in [self.logo] + [image for _, _, image in self.signatures] if name]
+
+    def profile_lines(self, profile):
+        """The profile block's lines for one student's profile."""
+        lines = []
+        for prefix, field, empty in self.profile_fields:
+            value = profile.get(field)
+            if value == "" or value is None:
+                if empty is None:
+                    continue
+                value = empty if field in profile else "N/A"
+            lines.append(f"{prefix}{value}")
+        return lines
+
+    def footer_text(self, page):
+        # {nb} is fpdf's alias for the page count, filled in when the document is finished
+        return self.footer.format(page=page, pages="{nb}")
+
+
+def _check_keys(entry, allowed, where):
+    if not isinstance(entry, dict):
+        raise ValueError(f"{where} must be an object, not {type(entry).__name__}.")
+    unknown = set(entry) - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown key(s) in {where}: {', '.join(sorted(unknown))}. Expected some of: {', '.join(allowed)}.")
+
+
+def _check_type(value, types, where, expected):
+    if not isinstance(value, types):
+        raise ValueError(f"{where} must be {expected}, not {'empty' if value is None else type(value).__name__}.")
+
+
+def compile_layout(template=None):
+    """Validates a template (see the module docstring) and compiles it into a LayoutPlan; raises ValueError if it is invalid."""
+    template = template or {}
+    _check_keys(template, list(DEFAULT_LAYOUT), "layout")
+    layout = dict(copy.deepcopy(DEFAULT_LAYOUT), **template)
+    # e.g. a YAML layout's `signatures:` left empty reads as null; [] means none
+    for key in ("header", "profile_fields", "signatures"):
+        _check_type(layout[key], list, f"'{key}'", "a list")
+    _check_type(layout["logo"], (str, type(None)), "'logo'", "a file name or null")
+    _check_type(layout["photo"], bool, "'photo'", "true or false")
+    _check_type(layout["footer"], str, "'footer'", "text")
+
+    header_lines = []
+    for n, line in enumerate(layout["header"], 1):
+        _check_keys(line, ["text", "style", "size"], f"header line {n}")
+        style = line.get("style", "")
+        if style not in FONT_STYLES:
+            raise ValueError(f"Header line {n} has style '{style}'; use one of {FONT_STYLES}.")
+        size = line.get("size", 12)
+        _check_type(size, (int, float), f"Header line {n}'s size", "a number")
+        header_lines.append((style, float(size), str(line.get("text", ""))))
+
+    profile_fields = []
+    for n, entry in enumerate(layout["profile_fields"], 1):
+        _check_keys(entry, ["label", "field", "empty"], f"profile field {n}")
+        if "field" not in entry:
+            raise ValueError(f"Profile field {n} needs a 'field' (e.g. 'reg_number').")
+        _check_type(entry["field"], str, f"Profile field {n}'s 'field'", "a field name")
+        empty = entry.get("empty", "")
+        if empty not in EMPTY_CHOICES:
+            raise ValueError(f"Profile field {n} has empty '{empty}'; use one of {EMPTY_CHOICES}.")
+        profile_fields.append((f"{entry.get('label', entry['field'])}: ", entry["field"], None if empty == "hide" else empty))
+
+    for n, entry in enumerate(layout["signatures"], 1):
+        _check_keys(entry, ["label", "image"], f"signature {n}")
+        _check_type(entry.get("image"), (str, type(None)), f"Signature {n}'s image", "a file name or null")
+    signatures = [(x, str(entry.get("label", "")), entry.get("image"))
+                  for x, entry in zip(signature_positions(len(layout["signatures"])), layout["signatures"])]
+
+    try:
+        layout["footer"].format(page=1, pages=1)
+    except (KeyError, IndexError, ValueError, AttributeError) as e:
+        raise ValueError(f"Footer '{layout['footer']}' may only use {{page}} and {{pages}}: {e}")
+
+    fingerprint = hashlib.sha1(json.dumps(layout, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return LayoutPlan(header_lines, layout["logo"], bool(layout["photo"]), profile_fields, signatures,
+                      layout["footer"], fingerprint)
+
+
+def load_layout_file(file_path):
+    """Reads a template from a .json file, or a .yaml/.yml file when PyYAML is installed."""
+    with open(file_path, 'r') as f:
+        if file_path.lower().endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise ValueError("YAML layouts need PyYAML (pip install pyyaml); use a .json layout instead.")
+            return yaml.safe_load(f) or {}
+        return json.load(f)
+
+
+default_plan = compile_layout()
+
+
+class LayoutRegistry:
+    """
+    Compiled layouts from a layouts folder, by class. A class's layout file overrides
+    the school's default file key by key, and each combination is compiled once. Files
+    are re-checked by mtime at most every RELOAD_CHECK_SECONDS, so an edited layout
+    applies without a restart. A layout that fails to load or compile is reported once
+    and the next one down is used (the school's, then DEFAULT_LAYOUT).
+    """
+
+    def __init__(self, layouts_dir):
+        self.layouts_dir = layouts_dir
+        self._templates = {}   # name -> (stamp, template dict or None)
+        self._checked_at = {}  # name -> time.monotonic() of the last look at the folder
+        self._plans = {}       # canonical template JSON -> LayoutPlan, or None if it does not compile
+        self._lock = threading.Lock()
+        self.compiles = 0
+        self.errors = {}       # file or layout name -> last error message
+
+    def _template(self, name):
+        """The template in <name>.json/.yaml/.yml, or None if there is none (or it can't be read)."""
+        now = time.monotonic()
+        cached = self._templates.get(name)
+        if cached is not None and now - self._checked_at.get(name, 0) < RELOAD_CHECK_SECONDS:
+            return cached[1]
+        path = stamp = None
+        for extension in LAYOUT_EXTENSIONS:
+            candidate = os.path.join(self.layouts_dir, name + extension)
+            try:
+                info = os.stat(candidate)
+            except FileNotFoundError:
+                continue
+            path, stamp = candidate, (candidate, info.st_size, info.st_mtime_ns)
+            break
+        self._checked_at[name] = now
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        template = None
+        if path is not None:
+            try:
+                template = load_layout_file(path)
+                if not isinstance(template, dict):
+                    raise ValueError("a layout must be an object of settings")
+                self.errors.pop(path, None)
+            except Exception as e:
+                self.errors[path] = str(e)
+                print(f"Warning: Could not read report card layout {path}: {e}") # For debugging in console
+        self._templates[name] = (stamp, template)
+        return template
+
+    def _compile(self, template, name):
+        key = json.dumps(template, sort_keys=True, default=str)
+        if key not in self._plans:
+            try:
+                self._plans[key] = compile_layout(template)
+                self.compiles += 1
+                self.errors.pop(name, None)
+            except ValueError as e:
+                self._plans[key] = None
+                self.errors[name] = str(e)
+                print(f"Warning: Report card layout '{name}' is invalid: {e}") # For debugging in console
+        return self._plans[key]
+
+    def layout(self, class_name=None):
+        """The plan for a class: its layout over the school's default.json, else the default alone, else DEFAULT_LAYOUT."""
+        with self._lock:
+            school = self._template(DEFAULT_LAYOUT_NAME) or {}
+            slug = layout_slug(class_name) if class_name else ""
+            own = self._template(slug) if slug and slug != DEFAULT_LAYOUT_NAME else None
+            if own:
+                plan = self._compile(dict(school, **own), slug)
+                if plan is not None:
+                    return plan
+            if school:
+                plan = self._compile(school, DEFAULT_LAYOUT_NAME)
+                if plan is not None:
+                    return plan
+            return default_plan
+
+    def stats(self):
+        with self._lock:
+            return {"layouts": sum(1 for plan in self._plans.values() if plan), "compiles": self.compiles,
+                    "errors": len(self.errors)}
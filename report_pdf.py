@@ -0,0 +1,423 @@
+"""
+Report card PDF rendering.
+
+Kept free of streamlit so that it can run in worker processes: a whole class (or
+session) of report cards is rendered across a process pool and streamed into a ZIP
+file, or laid out one after another in a single merged PDF.
+
+Everything around the results table follows a compiled layout (see report_layout.py),
+so a school or class can change its card without code changes.
+
+Finished cards are also kept in a process-wide LRU (report_card_cache) keyed by a hash
+of everything that appears on them, so repeat views and downloads skip rendering.
+"""
+import hashlib
+import json
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import multiprocessing
+
+import pandas as pd
+from fpdf import FPDF
+
+from asset_registry import asset_registry, student_photo_file
+from metrics import metrics
+from report_layout import SIGNATURE_HEIGHT, SIGNATURE_WIDTH, default_plan
+
+# Cards rendered per worker task; large enough to amortise inter-process overhead
+BATCH_CHUNK_SIZE = 25
+# Below this many cards a process pool costs more to start than it saves
+MIN_CARDS_FOR_POOL = 50
+# Memory budget for cached, already-rendered report cards
+PDF_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Results table layout (mm): row height, narrowest column, padding around the widest text
+TABLE_ROW_HEIGHT = 10
+TABLE_MIN_COLUMN_WIDTH = 15
+TABLE_CELL_PADDING = 6
+# Signature images plus their captions
+SIGNATURE_CAPTION_HEIGHT = 5
+SIGNATURE_BLOCK_HEIGHT = SIGNATURE_HEIGHT + 2 + SIGNATURE_CAPTION_HEIGHT
+# Text widths remembered per (font, size, text); cleared when it grows past this
+TEXT_WIDTH_CACHE_SIZE = 20000
+
+
+# --- PDF Generation (Adapted from SR0-4.18.py) ---
+class PDF(FPDF):
+    """An A4 report card document; header and footer follow the current layout (see report_layout)."""
+
+    def __init__(self, layout=None):
+        super().__init__()
+        self.layout = layout or default_plan
+        self._next_layout = None # Taken up by the next page's header (see start_page)
+
+    def start_page(self, layout=None):
+        """
+        Starts a new page laid out by `layout` (default: the current one). fpdf draws the
+        previous page's footer inside add_page, so the switch happens in header(), after it.
+        """
+        self._next_layout = layout
+        self.add_page()
+
+    def asset_image(self, asset, x, y, w=0, h=0):
+        """Places a registry image, reusing its already-parsed data instead of reading the file."""
+        key = asset.prepared_path
+        if key not in self.images and asset.pdf_info is not None: # None: fpdf's image() parses the file itself
+            # fpdf drops the image data from its dict once the document is written, so each
+            # document gets its own shallow copy of the shared one
+            info = dict(asset.pdf_info)
+            info['i'] = len(self.images) + 1
+            self.images[key] = info
+        self.image(key, x=x, y=y, w=w, h=h)
+
+    def header(self):
+        if self._next_layout is not None:
+            self.layout, self._next_layout = self._next_layout, None
+        layout = self.layout
+        logo = asset_registry.get(layout.logo) if layout.logo else None
+        if logo:
+            self.asset_image(logo, x=10, y=8, w=25)
+        
+        for style, size, text in layout.header_lines:
+            self.set_font("Arial", style, size)
+            self.cell(0, 10, text, ln=True, align="C")
+        self.ln(5)
+
+    def footer(self):
+        self.set_y(-15)
+        self.set_font("Arial", "I", 8)
+        self.cell(0, 10, self.layout.footer_text(self.page_no()), align="C")
+
+# --- Results Table ---
+_text_widths = {}
+
+
+def text_width(pdf, text):
+    """pdf.get_string_width for the current font, remembered: cards repeat the same subjects, grades and scores."""
+    key = (pdf.font_family, pdf.font_style, pdf.font_size_pt, text)
+    width = _text_widths.get(key)
+    if width is None:
+        if len(_text_widths) >= TEXT_WIDTH_CACHE_SIZE:
+            _text_widths.clear()
+        width = _text_widths[key] = pdf.get_string_width(text)
+    return width
+
+
+def table_column_widths(pdf, headers, columns):
+    """
+    Widths fitting each column's header and longest cell (at least TABLE_MIN_COLUMN_WIDTH),
+    scaled down together if the table would be wider than the page. `columns` holds each
+    column's cell texts.
+    """
+    pdf.set_font("Arial", "B", 10)
+    widths = [text_width(pdf, header) for header in headers]
+    pdf.set_font("Arial", "", 10)
+    for i, cells in enumerate(columns):
+        for text in set(cells):
+            widths[i] = max(widths[i], text_width(pdf, text))
+    widths = [max(TABLE_MIN_COLUMN_WIDTH, w + TABLE_CELL_PADDING) for w in widths]
+
+    page_usable_width = pdf.w - pdf.l_margin - pdf.r_margin # Page width minus left/right margins
+    if sum(widths) > page_usable_width:
+        scale_factor = page_usable_width / sum(widths)
+        widths = [w * scale_factor for w in widths]
+    return widths
+
+
+def draw_table(pdf, table):
+    """
+    Draws a DataFrame as a bordered table. Cell texts are converted a column at a time
+    and column widths measured once for the whole table; a row that would not fit on the
+    page starts a new one, with the header row repeated.
+    """
+    headers = [str(header) for header in table.columns]
+    rows = list(table.astype(str).itertuples(index=False, name=None))
+    col_widths = table_column_widths(pdf, headers, zip(*rows) if rows else [[] for _ in headers])
+
+    def header_row():
+        pdf.set_font("Arial", "B", 10)
+        for width, header in zip(col_widths, headers):
+            pdf.cell(width, TABLE_ROW_HEIGHT, header, border=1, align="C")
+        pdf.ln()
+        pdf.set_font("Arial", "", 10)
+
+    header_row()
+    for row in rows:
+        if pdf.get_y() + TABLE_ROW_HEIGHT > pdf.page_break_trigger:
+            pdf.add_page()
+            header_row()
+        for width, text in zip(col_widths, row):
+            pdf.cell(width, TABLE_ROW_HEIGHT, text, border=1, align="C")
+        pdf.ln()
+
+
+def render_report_card(pdf, student_name, results_df, total_score, rank, student_profile=None, layout=None):
+    """
+    Lays out one student's report card starting on a new page of `pdf`, using `layout`
+    (a report_layout.LayoutPlan; the document's own if not given).
+    """
+    pdf.start_page(layout)
+    layout = pdf.layout
+
+    # Student Photo (missing or unreadable photos are simply left off)
+    photo = asset_registry.student_photo(student_name) if layout.photo else None
+    if photo:
+        pdf.asset_image(photo, x=170, y=8, w=25)
+
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(40, 10, f"Student Name: {student_name}", ln=True)
+    
+    # Add profile details to PDF
+    pdf.set_font("Arial", "", 11)
+    if student_profile:
+        for line in layout.profile_lines(student_profile):
+            pdf.cell(0, 7, line, ln=True)
+    else:
+        pdf.cell(0, 7, "Profile Details: Not available", ln=True)
+        
+    pdf.ln(3) # Small line break
+
+    pdf.set_font("Arial", "B", 11)
+    pdf.cell(40, 10, f"Total Score: {total_score}", ln=True)
+    pdf.cell(40, 10, f"Rank: {rank} Position", ln=True)
+    pdf.ln(5)
+
+    draw_table(pdf, results_df)
+    
+    # --- Digital Signatures ---
+    if not layout.signatures:
+        return
+    pdf.ln(15) # Add some space after the table
+    # Keep the signatures and their captions together on one page
+    if pdf.get_y() + SIGNATURE_BLOCK_HEIGHT > pdf.page_break_trigger:
+        pdf.add_page()
+
+    signature_y_pos = pdf.get_y() # Get current Y position
+    pdf.set_font("Arial", "B", 9)
+    # Positions were worked out when the layout was compiled; images are decoded once per process by the asset registry
+    for n, (x, caption, image) in enumerate(layout.signatures, 1):
+        signature = asset_registry.get(image) if image else None
+        if signature:
+            pdf.asset_image(signature, x=x, y=signature_y_pos, w=SIGNATURE_WIDTH, h=SIGNATURE_HEIGHT)
+        pdf.set_y(signature_y_pos + SIGNATURE_HEIGHT + 2) # Move y down for text
+        pdf.set_x(x)
+        # Text below signature; after the last one, move to the next line
+        pdf.cell(SIGNATURE_WIDTH, SIGNATURE_CAPTION_HEIGHT, caption, 0, 1 if n == len(layout.signatures) else 0, 'C')
+
+
+@metrics.timed("report_pdf.generate_report_card_pdf")
+def generate_report_card_pdf(student_name, results_df, total_score, rank, student_profile=None, layout=None):
+    pdf = PDF(layout)
+    pdf.alias_nb_pages()
+    render_report_card(pdf, student_name, results_df, total_score, rank, student_profile)
+    return pdf
+
+
+# --- Rendered Card Cache ---
+def report_card_asset_versions(student_name, layout=None):
+    """Versions of the images that appear on a student's report card."""
+    versions = [[name, asset_registry.version(name)] for name in (layout or default_plan).asset_files]
+    photo_name = student_photo_file(student_name)
+    versions.append([photo_name, asset_registry.version(photo_name, kind="photo")])
+    return versions
+
+
+def report_card_cache_key(student_name, results, total_score, rank, student_profile=None, layout=None):
+    """Hash of everything a report card shows, including its layout and the version of each image on it."""
+    layout = layout or default_plan
+    asset_versions = report_card_asset_versions(student_name, layout)
+    content = {
+        "student_name": student_name,
+        "results": [dict(row) for row in results],
+        "total_score": total_score,
+        "rank": rank,
+        "profile": dict(student_profile) if student_profile else None,
+        "assets": asset_versions,
+        "layout": layout.fingerprint,
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class ReportCardCache:
+    """
+    LRU of rendered report cards (PDF bytes), bounded by total size. Entries are keyed
+    by report_card_cache_key, so new results, a changed profile or rank, or a replaced
+    signature image all produce a new key; invalidate() drops a student's stale entries
+    straight away when their data is saved.
+    """
+
+    def __init__(self, max_bytes=PDF_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (student_name, pdf bytes)
+        self._keys_by_student = {}     # student_name -> set of their keys in _entries
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, student_name, results, total_score, rank, student_profile=None, layout=None):
+        """Returns the report card PDF as bytes, rendering it only on a cache miss."""
+        key = report_card_cache_key(student_name, results, total_score, rank, student_profile, layout)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][1]
+            self.misses += 1
+        data = pdf_bytes(generate_report_card_pdf(student_name, pd.DataFrame(list(results)), total_score, rank, student_profile, layout))
+        self._store(key, student_name, data)
+        return data
+
+    def _store(self, key, student_name, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (student_name, data)
+            self._keys_by_student.setdefault(student_name, set()).add(key)
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        student_name, data = self._entries.pop(key)
+        self._size -= len(data)
+        keys = self._keys_by_student[student_name]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_student[student_name]
+
+    def invalidate(self, student_name=None):
+        """Drops cached cards for one student, or for everyone if no name is given."""
+        if student_name is None:
+            with self._lock:
+                self._entries.clear()
+                self._keys_by_student.clear()
+                self._size = 0
+            return
+        self.invalidate_many([student_name])
+
+    def invalidate_many(self, student_names):
+        """Drops cached cards for each of the given students, e.g. after a bulk save."""
+        with self._lock:
+            for student_name in set(student_names):
+                for key in list(self._keys_by_student.get(student_name, ())):
+                    self._drop(key)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._size}
+
+
+report_card_cache = ReportCardCache()
+metrics.register_collector("report_card_cache", report_card_cache.stats)
+
+
+# --- Batch Rendering ---
+def report_card_filename(student_name, session=None, term=None):
+    """e.g. 'Adams_2024-2025_First_Term_Report_Card.pdf'; session and term are left out when unknown."""
+    parts = [student_name] + [part.replace("/", "-").replace(" ", "_") for part in (session, term) if part]
+    return "_".join(parts) + "_Report_Card.pdf"
+
+
+def pdf_bytes(pdf):
+    """Returns a finished FPDF document as bytes (fpdf 1.x builds it as a latin-1 string)."""
+    output = pdf.output(dest='S')
+    return output.encode('latin-1') if isinstance(output, str) else bytes(output)
+
+
+def _render_job(job):
+    pdf = generate_report_card_pdf(job['student_name'], pd.DataFrame(job['results']), job['total_score'], job['rank'],
+                                   job.get('profile'), job.get('layout'))
+    return report_card_filename(job['student_name'], job.get('session'), job.get('term')), pdf_bytes(pdf)
+
+
+def _render_chunk(jobs):
+    return [_render_job(job) for job in jobs]
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def iter_rendered_report_cards(jobs, workers=None, chunk_size=BATCH_CHUNK_SIZE):
+    """
+    Yields (filename, pdf bytes) for every job. Large batches are spread over a process
+    pool; at most two chunks per worker are in flight at once, so memory stays bounded
+    no matter how many cards are requested. Cards are yielded as soon as they are ready,
+    which may not be the order of `jobs`.
+
+    Each job is a dict with 'student_name', 'results' (list of subject rows),
+    'total_score', 'rank' and optionally 'profile', 'layout' (a report_layout.LayoutPlan),
+    'session' and 'term' (used in file names).
+    """
+    jobs = list(jobs)
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(jobs) < MIN_CARDS_FOR_POOL:
+        for job in jobs:
+            metrics.incr("report_pdf.batch_cards")
+            yield _render_job(job)
+        return
+
+    # "spawn" gives workers a clean interpreter instead of a fork of a threaded web server
+    context = multiprocessing.get_context("spawn")
+    pending_chunks = _chunks(jobs, chunk_size)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        in_flight = set()
+        for chunk in pending_chunks:
+            in_flight.add(executor.submit(_render_chunk, chunk))
+            if len(in_flight) >= workers * 2:
+                break
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                for rendered in future.result():
+                    metrics.incr("report_pdf.batch_cards")
+                    yield rendered
+                next_chunk = next(pending_chunks, None)
+                if next_chunk is not None:
+                    in_flight.add(executor.submit(_render_chunk, next_chunk))
+
+
+def render_report_cards_zip(jobs, output, workers=None, progress=None):
+    """
+    Renders every job's report card into a ZIP archive written to `output` (a path or
+    a binary file object), one PDF per student, writing each card as soon as it is
+    rendered. progress(done, total) is called after each card. Returns the card count.
+    """
+    jobs = list(jobs)
+    count = 0
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for filename, data in iter_rendered_report_cards(jobs, workers):
+            archive.writestr(filename, data)
+            count += 1
+            if progress:
+                progress(count, len(jobs))
+    return count
+
+
+def render_report_cards_merged(jobs, output, progress=None):
+    """
+    Lays out every job's report card, one after another, in a single PDF written to
+    `output` (a path or a binary file object). fpdf cannot join finished documents, so
+    this runs in one process. Returns the card count.
+    """
+    jobs = list(jobs)
+    pdf = PDF()
+    pdf.alias_nb_pages()
+    for count, job in enumerate(jobs, 1):
+        render_report_card(pdf, job['student_name'], pd.DataFrame(job['results']), job['total_score'], job['rank'],
+                           job.get('profile'), job.get('layout') or default_plan)
+        if progress:
+            progress(count, len(jobs))
+    data = pdf_bytes(pdf)
+    if hasattr(output, 'write'):
+        output.write(data)
+    else:
+        with open(output, 'wb') as f:
+            f.write(data)
+    return len(jobs)
@@ -0,0 +1,188 @@
+"""
+Results history, partitioned by academic session and term.
+
+Each (session, term) gets its own record store keyed by student name - a file under
+the results folder with the JSON backend, or a table of its own with SQLite - so one
+term can be loaded, ranked or exported without reading any other. A small manifest
+(partitions.json) lists the partitions that exist. A student's history is one keyed
+lookup per partition rather than a scan of every result ever saved.
+
+Results saved before partitioning (a single results.json with one record per
+student) are moved into partitions once, using the session and term on the record
+or, failing that, on the student's profile.
+
+Like storage.py, this module must not import streamlit.
+"""
+import json
+import os
+import re
+import threading
+
+from ranking import record_scope
+from storage import LOCK_SUFFIX, atomic_write_json, file_lock, get_store, record_stamp, shared_cache
+
+MANIFEST_FILE = "partitions.json"
+# Partition for results whose session/term were never recorded
+UNASSIGNED = ("", "")
+
+
+def partition_slug(session, term):
+    """A file- and table-safe name for a partition, e.g. ('2024/2025', 'First Term') -> '2024_2025_first_term'."""
+    slug = re.sub(r"[^a-z0-9]+", "_", f"{session} {term}".lower()).strip("_")
+    return slug or "unassigned"
+
+
+class ResultsHistory:
+    """Per-(session, term) result stores plus the manifest that lists them."""
+
+    def __init__(self, results_dir, backend="json", db_path=None):
+        self.results_dir = results_dir
+        self.backend = backend
+        self.db_path = db_path
+        self.manifest_path = os.path.join(results_dir, MANIFEST_FILE)
+        # Held while changing the manifest, which other processes may be changing too
+        self.manifest_lock = file_lock(self.manifest_path + LOCK_SUFFIX)
+        self._manifest = None
+        self._manifest_stamp = None
+        self._lock = threading.RLock()
+
+    # --- Manifest ---
+    def _read_manifest(self):
+        """Returns the manifest, re-reading it only when the file has changed."""
+        try:
+            info = os.stat(self.manifest_path)
+            stamp = (info.st_ino, info.st_size, info.st_mtime_ns)
+        except FileNotFoundError:
+            stamp = None
+        if self._manifest is None or stamp != self._manifest_stamp:
+            if stamp is None:
+                self._manifest = {"partitions": [], "legacy_migrated": False}
+            else:
+                with open(self.manifest_path, 'r') as f:
+                    self._manifest = json.load(f)
+            self._manifest_stamp = stamp
+        return self._manifest
+
+    def _write_manifest(self, manifest):
+        atomic_write_json(self.manifest_path, manifest)
+        self._manifest = None # Re-read (and re-stamp) on next access
+
+    def partitions(self):
+        """All (session, term) pairs that have a partition, oldest session first."""
+        with self._lock:
+            entries = self._read_manifest()["partitions"]
+            return sorted((p["session"], p["term"]) for p in entries)
+
+    def _register(self, session, term):
+        if (session, term) in self.partitions():
+            return
+        with self.manifest_lock, self._lock:
+            manifest = self._read_manifest()
+            if any(p["session"] == session and p["term"] == term for p in manifest["partitions"]):
+                return
+            manifest = dict(manifest, partitions=manifest["partitions"] + [
+                {"session": session, "term": term, "slug": partition_slug(session, term)}
+            ])
+            self._write_manifest(manifest)
+
+    # --- Partitions ---
+    def store(self, session, term):
+        """The record store (keyed by student_name) for one session and term."""
+        slug = partition_slug(session, term)
+        return get_store(os.path.join(self.results_dir, f"{slug}.json"), "student_name",
+                         index_fields=["student_name"], backend=self.backend,
+                         db_path=self.db_path, table=f"results_{slug}")
+
+    def load(self, session, term):
+        """Read-only view of one partition's records (shared and cached, see storage.SharedDataCache)."""
+        if (session, term) not in self.partitions():
+            return ()
+        return shared_cache.view(self.store(session, term))
+
+    def get(self, student_name, session, term):
+        if (session, term) not in self.partitions():
+            return None
+        return self.store(session, term).get(student_name)
+
+    def history(self, student_name):
+        """A student's results across every partition: a list of (session, term, record), oldest first."""
+        history = []
+        for session, term in self.partitions():
+            record = self.store(session, term).get(student_name)
+            if record is not None:
+                history.append((session, term, record))
+        return history
+
+    # --- Writing ---
+    # Each method writes straight away, or stages its changes in `uow` (a storage.UnitOfWork)
+    # when one is given, so they commit together with changes to other data files.
+    def writable_store(self, session, term):
+        """The store for one session and term, listed in the manifest first if it is new."""
+        self._register(session, term)
+        return self.store(session, term)
+
+    def save(self, records, session, term, uow=None, expected=None):
+        """
+        Inserts or replaces students' results in one partition; records are stamped with
+        session and term. expected: {student_name: record_stamp} as read, see storage.ConflictError.
+        """
+        store = self.writable_store(session, term)
+        records = [dict(r, session=session, term=term) for r in records]
+        if uow is None:
+            store.upsert_many(records, expected)
+        else:
+            uow.upsert_many(store, records, expected)
+
+    def delete_student(self, student_name, uow=None):
+        """Removes a student's results from every partition."""
+        for session, term in self.partitions():
+            store = self.store(session, term)
+            if store.get(student_name) is not None:
+                if uow is None:
+                    store.delete(student_name)
+                else:
+                    uow.delete(store, student_name)
+
+    def rename_student(self, old_name, new_name, uow):
+        """Stages moving a student's results in every partition to a new name."""
+        for session, term in self.partitions():
+            store = self.store(session, term)
+            record = store.get(old_name)
+            if record is not None:
+                uow.delete(store, old_name, expected={old_name: record_stamp(record), new_name: None})
+                uow.upsert(store, dict(record, student_name=new_name))
+
+    def migrate_legacy(self, legacy_store, profiles_by_name):
+        """
+        Moves records from the old single results store into partitions, once. The old
+        file is left where it is. profiles_by_name is anything with .get(student_name)
+        (a dict or the profiles store). Returns the number of records moved.
+        """
+        with self.manifest_lock, self._lock:
+            if self._read_manifest().get("legacy_migrated"):
+                return 0
+            moved = 0
+            if legacy_store.exists():
+                groups = {}
+                for record in legacy_store.all():
+                    _, session, term = record_scope(record, profiles_by_name.get(record['student_name']))
+                    groups.setdefault((session, term), []).append(dict(record))
+                for (session, term), records in groups.items():
+                    self.save(records, session, term)
+                    moved += len(records)
+            self._write_manifest(dict(self._read_manifest(), legacy_migrated=True))
+            return moved
+
+
+_histories = {}
+_histories_lock = threading.Lock()
+
+
+def get_results_history(results_dir, backend="json", db_path=None):
+    """Returns the process-wide ResultsHistory for results_dir, creating it on first use."""
+    with _histories_lock:
+        history = _histories.get((backend, results_dir))
+        if history is None:
+            history = ResultsHistory(results_dir, backend=backend, db_path=db_path)
+            _histories[(backend, results_dir)] = history
+        return history
@@ -0,0 +1,177 @@
+"""
+Fuzzy student search and name normalisation.
+
+normalize_name / name_key define when two spellings are the same student: accents,
+case, punctuation and extra spaces are ignored, so "Adams ", "adams" and "ADAMS." all
+have the key "adams", while "Adam S." ("adam s") is someone else. Letters of any
+script count, and a name with none (e.g. only symbols) keys as itself, casefolded.
+The portal uses name_key to match uploads and new accounts to existing students
+instead of comparing .lower() strings.
+
+StudentSearchIndex is built once per data version over every student's name,
+registration number and parent phone number. Each word is broken into trigrams
+(padded, so short prefixes match too) with a trigram -> students posting list. A
+query counts shared trigrams over the posting lists only, keeps the best candidates
+and ranks those by how much of the query they cover, how little else they contain,
+and whether query words match whole words or word prefixes.
+
+This module must not import streamlit.
+"""
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+from metrics import metrics
+
+MAX_RESULTS = 20
+MIN_SCORE = 0.3
+# Candidates (by shared trigram count) that get fully scored, per result asked for
+CANDIDATES_PER_RESULT = 5
+
+
+def normalize_name(value):
+    """Casefolded, accents and punctuation removed, single spaces: ' Adébáyọ  O.' -> 'adebayo o'."""
+    if value is None:
+        return ""
+    text = unicodedata.normalize("NFKD", str(value))
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    return " ".join(re.findall(r"[^\W_]+", text)) # Letters and digits of any script
+
+
+def name_key(value):
+    """
+    The identity of a name for de-duplication: normalize_name, keeping the word breaks
+    ('Adam S.' -> 'adam s', not 'adams'). A name with no letters or digits keys as
+    itself, NFKC-normalised and casefolded, rather than as '' like every other such name.
+    """
+    key = normalize_name(value)
+    if key or value is None:
+        return key
+    return " ".join(unicodedata.normalize("NFKC", str(value)).casefold().split())
+
+
+def _joined(value):
+    """normalize_name run together, so a search for 'Adam S.' still finds 'Adams'."""
+    return normalize_name(value).replace(" ", "")
+
+
+def normalize_phone(value):
+    """Digits only, with a leading +234/234 country code written as a local 0 ('+234 803...' -> '0803...')."""
+    digits = re.sub(r"\D", "", str(value or ""))
+    if digits.startswith("234") and len(digits) > 10:
+        digits = "0" + digits[3:]
+    return digits
+
+
+def _trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class StudentSearchIndex:
+    """Trigram index over student names, registration numbers and parent phone numbers."""
+
+    def __init__(self, profiles=(), accounts=()):
+        self.names = []        # position -> student name as stored
+        self._keys = []        # position -> set of searchable words
+        self._sizes = []       # position -> number of distinct trigrams
+        self.by_key = {}       # name_key -> student name (first one seen wins)
+        self._postings = {}    # trigram -> set of positions
+
+        documents = {}
+        for account in accounts:
+            documents.setdefault(account['username'], {})
+        for profile in profiles:
+            documents.setdefault(profile['student_name'], {}).update(profile)
+
+        for name, profile in documents.items():
+            position = len(self.names)
+            self.names.append(name)
+            self.by_key.setdefault(name_key(name), name)
+            words = set(normalize_name(name).split())
+            words.add(_joined(name))
+            words.update(normalize_name(profile.get('reg_number')).split())
+            words.add(_joined(profile.get('reg_number')))
+            phone = normalize_phone(profile.get('parent_phone'))
+            if phone:
+                words.add(phone)
+            words.discard("")
+            self._keys.append(words)
+            trigrams = set()
+            for word in words:
+                trigrams |= _trigrams(word)
+            self._sizes.append(len(trigrams) or 1)
+            for trigram in trigrams:
+                self._postings.setdefault(trigram, set()).add(position)
+
+    def find_existing(self, name):
+        """The stored spelling of a student whose name has the same name_key, or None."""
+        return self.by_key.get(name_key(name))
+
+    def search(self, query, limit=MAX_RESULTS, min_score=MIN_SCORE):
+        """
+        Ranked matches for a free-text query: a list of (student name, score) with the
+        best first. Scores are in [0, 1].
+        """
+        query_words = normalize_name(query).split()
+        digits = normalize_phone(query)
+        if len(digits) >= 4:
+            query_words.append(digits)
+        if not query_words:
+            return []
+        # The query run together as well, so "Adam S." finds "Adams"
+        joined = _joined(query)
+        if joined and joined not in query_words:
+            query_words.append(joined)
+
+        query_trigrams = set()
+        for word in query_words:
+            query_trigrams |= _trigrams(word)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self._postings.get(trigram, ()))
+
+        scored = []
+        for position, count in shared.most_common(limit * CANDIDATES_PER_RESULT):
+            words = self._keys[position]
+            word_match = 0.0
+            for word in query_words:
+                if word in words:
+                    word_match += 1.0
+                elif any(k.startswith(word) for k in words):
+                    word_match += 0.5
+            score = (0.5 * count / len(query_trigrams)
+                     + 0.2 * count / self._sizes[position]
+                     + 0.3 * word_match / len(query_words))
+            if score >= min_score:
+                scored.append((score, self.names[position]))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [(name, round(score, 3)) for score, name in scored[:limit]]
+
+
+class SearchIndexCache:
+    """Holds the current StudentSearchIndex and rebuilds it only when the stamp passed in changes."""
+
+    def __init__(self):
+        self._stamp = None
+        self._index = None
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, stamp, profiles, accounts):
+        """
+        profiles and accounts may be functions returning them, called only when a rebuild
+        is needed; read the stamp before them, so an index is never older than its stamp.
+        """
+        with self._lock:
+            if self._index is None or stamp != self._stamp:
+                self._index = StudentSearchIndex(profiles() if callable(profiles) else profiles,
+                                                 accounts() if callable(accounts) else accounts)
+                self._stamp = stamp
+                self.builds += 1
+            return self._index
+
+
+search_index_cache = SearchIndexCache()
+metrics.register_collector("search_index_cache", lambda: {"builds": search_index_cache.builds})
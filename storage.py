@@ -0,0 +1,954 @@
+"""
+Record storage for the student portal.
+
+Every data file (students.json, results.json, student_profiles.json) is kept as a
+JSON snapshot plus an append-only change log next to it ("<file>.log"). Saving one
+record appends a single line to the log instead of rewriting the whole list, and the
+log is folded back into the snapshot (compaction) once it grows past a threshold.
+Snapshots are always written to a temp file and renamed into place, so a crash can
+never leave a half-written data file behind.
+
+Alternatively the same records can live in a SQLite database (one table per data
+file) with indexed lookup columns; see SQLiteRecordStore. Both stores expose the
+same methods, so the portal does not care which one it is talking to.
+
+Changes that span several stores (e.g. removing a student's account, profile and
+results) go through a UnitOfWork, which journals them before applying them so a
+crash part-way through is finished on the next start instead of leaving the files
+disagreeing.
+
+Several processes (e.g. multiple Streamlit workers) may share the same files. Every
+write holds an OS lock on the store's lock file for the length of one append, after
+first catching up on whatever other processes appended, so no save overwrites
+another. Records also carry a version stamp (record_stamp, a fingerprint of their
+content): a save can name the stamps it started from and fails with ConflictError,
+instead of silently winning, if someone else changed those records meanwhile.
+
+This module must not import streamlit; the portal reports errors to the user.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import types
+import uuid
+from datetime import datetime, date
+
+import numpy as np
+import pandas as pd
+
+from metrics import metrics
+
+try:
+    import fcntl
+except ImportError: # Windows: locks then only coordinate the threads of one process
+    fcntl = None
+
+# Compact once the log holds more entries than this, or more entries than there are
+# records, whichever is larger. That keeps the amortised cost of a save O(1).
+COMPACT_MIN_ENTRIES = 200
+
+LOG_SUFFIX = ".log"
+LOCK_SUFFIX = ".lock"
+# How long a SQLite write waits for another connection's write to finish
+SQLITE_BUSY_TIMEOUT_SECONDS = 30
+
+JOURNAL_PREFIX = "txn-"
+JOURNAL_SUFFIX = ".journal"
+# Without OS file locks, journals younger than this may belong to a commit still in
+# progress in another process (see recover_transactions)
+RECOVERY_MIN_AGE_SECONDS = 30
+
+
+class CustomJSONEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, (datetime, date)):
+            return obj.strftime('%Y-%m-%d')
+        if isinstance(obj, pd.Timestamp):
+            return obj.strftime('%Y-%m-%d')
+        if isinstance(obj, np.integer):
+            return int(obj)
+        elif isinstance(obj, np.floating):
+            return float(obj)
+        elif isinstance(obj, np.bool_):
+            return bool(obj)
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        return json.JSONEncoder.default(self, obj)
+
+
+def atomic_write_json(file_path, data):
+    """Writes data to file_path via a temp file in the same directory and an atomic rename."""
+    directory = os.path.dirname(file_path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(file_path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=4, cls=CustomJSONEncoder)
+            f.flush()
+            os.fsync(f.fileno())
+            metrics.incr("storage.bytes_written", f.tell())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _encode(entry):
+    return json.dumps(entry, cls=CustomJSONEncoder, separators=(',', ':'))
+
+
+def record_stamp(record):
+    """
+    The version stamp of a record: a short fingerprint of its content, or None for a
+    record that does not exist. Pass {key: stamp} as `expected` when saving to have the
+    save refused if the stored record is no longer the one that was read.
+    """
+    if record is None:
+        return None
+    encoded = json.dumps(record, cls=CustomJSONEncoder, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()[:16]
+
+
+class ConflictError(Exception):
+    """A save named record versions that are no longer the stored ones; nothing was written."""
+
+    def __init__(self, keys):
+        self.keys = list(keys)
+        super().__init__(f"Changed by someone else since it was loaded: {', '.join(str(k) for k in self.keys)}")
+
+
+# --- File Locks ---
+class FileLock:
+    """
+    An exclusive lock on a lock file, shared with other processes (fcntl.flock) and
+    with the other threads of this one. Re-entrant within a thread, so a UnitOfWork can
+    hold the locks of all its stores while each store takes its own lock again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        try:
+            if self._depth == 0 and fcntl is not None:
+                if self._file is None:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    self._file = open(self.path, 'a')
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+_file_locks = {}
+_file_locks_lock = threading.Lock()
+
+
+def file_lock(path):
+    """The process-wide FileLock for a lock file path (one per path, so re-entry works)."""
+    path = os.path.abspath(path)
+    with _file_locks_lock:
+        lock = _file_locks.get(path)
+        if lock is None:
+            lock = _file_locks[path] = FileLock(path)
+        return lock
+
+
+def _fold(value):
+    """Normalises a lookup value the way the portal compares names: trimmed and lowercased."""
+    if value is None:
+        return ""
+    return str(value).strip().lower()
+
+
+class RecordStore:
+    """
+    A keyed list of records backed by a JSON snapshot and an append-only log.
+    Records are plain dicts; key_field names the field that identifies a record
+    (e.g. 'username' for accounts, 'student_name' for results and profiles).
+    """
+
+    def __init__(self, file_path, key_field, index_fields=(), compact_min_entries=COMPACT_MIN_ENTRIES):
+        self.file_path = file_path
+        self.log_path = file_path + LOG_SUFFIX
+        self.write_lock = file_lock(file_path + LOCK_SUFFIX) # Held (before _lock) by every write
+        self.key_field = key_field
+        self.index_fields = tuple(index_fields)
+        self.compact_min_entries = compact_min_entries
+        self._records = None     # key -> record, in insertion order
+        self._indexes = {}       # field -> {lowercased value: [keys]}, rebuilt lazily after writes
+        self._log_entries = 0    # number of valid entries currently in the log
+        self._log_size = 0       # byte offset just past the last valid log entry
+        self._disk_stamp = None  # stat of the files as of our last load or write
+        self.version = 0         # bumped on every load and write; used by SharedDataCache
+        self._lock = threading.RLock()
+
+    # --- Reading ---
+    def _stat_files(self):
+        stamp = []
+        for path in (self.file_path, self.log_path):
+            try:
+                info = os.stat(path)
+                stamp.append((info.st_ino, info.st_size, info.st_mtime_ns))
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def refresh(self):
+        """
+        Brings the records up to date if the files were changed by someone else since
+        we last read or wrote them. Costs two stat() calls when nothing changed. Returns
+        the store version.
+        """
+        with self._lock:
+            self._catch_up()
+            return self.version
+
+    def _catch_up(self):
+        """
+        Applies changes made by other processes. When they only appended to the log,
+        just the new entries are read; after a compaction everything is reloaded.
+        """
+        if self._records is None:
+            self.load()
+            return
+        disk_stamp = self._stat_files()
+        if disk_stamp == self._disk_stamp:
+            return
+        snapshot, log = disk_stamp
+        old_snapshot, old_log = self._disk_stamp
+        if snapshot != old_snapshot or log is None or (old_log is not None and log[0] != old_log[0]) or log[1] < self._log_size:
+            self.load()
+            return
+        try:
+            with open(self.log_path, 'rb') as f:
+                f.seek(self._log_size)
+                entries, size = self._read_log(f)
+        except FileNotFoundError:
+            self.load() # Compacted away meanwhile
+            return
+        metrics.incr("storage.bytes_read", size)
+        for entry in entries:
+            self._apply(self._records, entry)
+        self._log_entries += len(entries)
+        self._log_size += size
+        self._disk_stamp = disk_stamp
+        if entries:
+            self._indexes = {}
+            self.version += 1
+
+    def _read_log(self, f):
+        """Reads complete log entries from f's position; returns (entries, bytes read)."""
+        entries = []
+        size = 0
+        for raw_line in f:
+            if not raw_line.endswith(b"\n"):
+                break # Torn (or still being written) line at the end of the log
+            try:
+                entries.append(json.loads(raw_line))
+            except json.JSONDecodeError:
+                break
+            size += len(raw_line)
+        return entries, size
+
+    def exists(self):
+        """True if there is any persisted data (snapshot or log) for this store."""
+        for path in (self.file_path, self.log_path):
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                return True
+        return False
+
+    def load(self):
+        """
+        (Re)reads the snapshot and replays the log on top of it.
+        A corrupt snapshot raises json.JSONDecodeError; a torn final log line left by a
+        crash mid-append is ignored and trimmed on the next write.
+        """
+        with self._lock, metrics.span("storage.load"):
+            while True:
+                disk_stamp = self._stat_files()
+                records = {}
+                if os.path.exists(self.file_path) and os.path.getsize(self.file_path) > 0:
+                    with open(self.file_path, 'r') as f:
+                        for record in json.load(f):
+                            records[record.get(self.key_field)] = record
+                        metrics.incr("storage.bytes_read", f.tell())
+
+                entries, log_size = [], 0
+                try:
+                    with open(self.log_path, 'rb') as f:
+                        entries, log_size = self._read_log(f)
+                except FileNotFoundError:
+                    pass
+                # Another process may have compacted (new snapshot, log removed) while we
+                # were reading; the log we read could then belong to the new snapshot.
+                if self._stat_files()[0] == disk_stamp[0]:
+                    break
+            metrics.incr("storage.bytes_read", log_size)
+            for entry in entries:
+                self._apply(records, entry)
+            log_entries = len(entries)
+
+            self._records = records
+            self._indexes = {}
+            self._log_entries = log_entries
+            self._log_size = log_size
+            self._disk_stamp = disk_stamp
+            self.version += 1
+            return self.all()
+
+    def _ensure_loaded(self):
+        if self._records is None:
+            self.load()
+
+    def all(self):
+        """Returns all records as a list, in insertion order."""
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._records.values())
+
+    def get(self, key, default=None):
+        with self._lock:
+            self._ensure_loaded()
+            return self._records.get(key, default)
+
+    def __len__(self):
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._records)
+
+    def find(self, field, value):
+        """Returns the records whose `field` equals `value`, ignoring case and surrounding spaces."""
+        with self._lock:
+            self._ensure_loaded()
+            index = self._indexes.get(field)
+            if index is None:
+                index = {}
+                for key, record in self._records.items():
+                    index.setdefault(_fold(record.get(field)), []).append(key)
+                self._indexes[field] = index
+            return [self._records[key] for key in index.get(_fold(value), [])]
+
+    def find_one(self, field, value):
+        matches = self.find(field, value)
+        return matches[0] if matches else None
+
+    # --- Writing ---
+    def _apply(self, records, entry):
+        if entry.get('op') == 'put':
+            record = entry['record']
+            records[record.get(self.key_field)] = record
+        elif entry.get('op') == 'del':
+            records.pop(entry.get('key'), None)
+
+    @contextlib.contextmanager
+    def _writing(self, expected=None):
+        """
+        Holds the write lock with the records brought up to date, after checking that
+        each {key: stamp} in expected still matches (else ConflictError).
+        """
+        with self.write_lock, self._lock:
+            self.check_expected(expected) # Also catches up on other processes' changes
+            yield
+
+    def check_expected(self, expected):
+        """Raises ConflictError naming the keys whose stored record_stamp differs from expected."""
+        with self._lock:
+            self._catch_up()
+            conflicts = [key for key, stamp in (expected or {}).items() if record_stamp(self._records.get(key)) != stamp]
+        if conflicts:
+            raise ConflictError(conflicts)
+
+    def _append(self, entries):
+        """
+        Appends entries to the log with a single write and fsync, then applies them.
+        Callers hold the write lock (see _writing), so the log ends where we think it does.
+        """
+        if not entries:
+            return
+        lines = [_encode(entry) for entry in entries]
+        payload = "".join(line + "\n" for line in lines).encode('utf-8')
+        directory = os.path.dirname(self.log_path) or "."
+        os.makedirs(directory, exist_ok=True)
+        metrics.incr("storage.bytes_written", len(payload))
+        with metrics.span("storage.append"), open(self.log_path, 'ab') as f:
+            if f.tell() > self._log_size:
+                f.truncate(self._log_size) # Drop a torn tail left by a crash mid-append
+                f.seek(self._log_size)
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        # Keep what a reload would read back (plain JSON types, not numpy scalars or the
+        # caller's own objects), so in-process readers see the same records as other processes
+        for line in lines:
+            self._apply(self._records, json.loads(line))
+        self._indexes = {}
+        self._log_entries += len(entries)
+        self._log_size += len(payload)
+        self._disk_stamp = self._stat_files()
+        self.version += 1
+        if self._log_entries > max(self.compact_min_entries, len(self._records)):
+            self.compact()
+
+    # Every write takes an optional `expected` {key: record_stamp} and raises
+    # ConflictError, writing nothing, if any of those records has changed since.
+    def upsert(self, record, expected=None):
+        """Inserts or replaces a single record."""
+        self.upsert_many([record], expected)
+
+    def upsert_many(self, records, expected=None):
+        """Inserts or replaces several records in one log write."""
+        with self._writing(expected):
+            self._append([{'op': 'put', 'record': record} for record in records])
+
+    def delete(self, key, expected=None):
+        """Removes the record with the given key, if present."""
+        self.delete_many([key], expected)
+
+    def delete_many(self, keys, expected=None):
+        with self._writing(expected):
+            self._append([{'op': 'del', 'key': key} for key in keys if key in self._records])
+
+    def apply_batch(self, entries, expected=None):
+        """
+        Applies a list of {'op': 'put', 'record': ...} / {'op': 'del', 'key': ...} changes
+        with a single log write. Used by UnitOfWork and recover_transactions.
+        """
+        with self._writing(expected):
+            self._append(list(entries))
+
+    def replace_all(self, records):
+        """
+        Makes the store hold exactly `records`, logging only the records that were
+        added, changed or removed compared with what is already stored.
+        """
+        with self._writing():
+            entries = []
+            new_keys = set()
+            for record in records:
+                key = record.get(self.key_field)
+                new_keys.add(key)
+                current = self._records.get(key)
+                if current is None or _encode(current) != _encode(record):
+                    entries.append({'op': 'put', 'record': record})
+            for key in self._records:
+                if key not in new_keys:
+                    entries.append({'op': 'del', 'key': key})
+            self._append(entries)
+
+    def compact(self):
+        """Folds the log into a fresh snapshot (written atomically) and empties the log."""
+        with self._writing(), metrics.span("storage.compact"):
+            atomic_write_json(self.file_path, list(self._records.values()))
+            # Replaying the log over the new snapshot is idempotent, so a crash between
+            # these two steps loses nothing.
+            if os.path.exists(self.log_path):
+                os.remove(self.log_path)
+            self._log_entries = 0
+            self._log_size = 0
+            self._disk_stamp = self._stat_files()
+            self.version += 1
+
+
+class SQLiteRecordStore:
+    """
+    The same keyed record list as RecordStore, held in one table of a SQLite database.
+    The full record is stored as JSON in `data`; the key and every index field also get
+    their own column (case-insensitive, indexed), so lookups and upserts are O(log n).
+    """
+
+    def __init__(self, db_path, table, key_field, index_fields=()):
+        self.db_path = db_path
+        self.table = table
+        self.key_field = key_field
+        self.index_fields = tuple(f for f in index_fields if f != key_field)
+        self.version = 0 # bumped on every write made through this store
+        self._lock = threading.RLock()
+        # One write lock per database, since SQLite lets one connection write at a time;
+        # readers are never blocked (WAL).
+        self.write_lock = file_lock(db_path + LOCK_SUFFIX)
+        directory = os.path.dirname(db_path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # Streamlit serves each session from its own thread; access is serialised by _lock.
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT_SECONDS)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._create_table()
+
+    def _column(self, field):
+        return f"f_{field}"
+
+    def _create_table(self):
+        columns = ", ".join(f"{self._column(f)} TEXT COLLATE NOCASE" for f in self.index_fields)
+        with self.write_lock, self._lock, self._conn:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                f"record_key TEXT PRIMARY KEY, record_key_nocase TEXT COLLATE NOCASE"
+                f"{', ' + columns if columns else ''}, data TEXT NOT NULL)"
+            )
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_key_nocase ON {self.table} (record_key_nocase)")
+            # Tables created by an older version may lack newer index columns; add and backfill them
+            existing_columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({self.table})")}
+            for field in self.index_fields:
+                column = self._column(field)
+                if column not in existing_columns:
+                    self._conn.execute(f"ALTER TABLE {self.table} ADD COLUMN {column} TEXT COLLATE NOCASE")
+                    self._conn.execute(f"UPDATE {self.table} SET {column} = lower(trim(coalesce(json_extract(data, ?), '')))", (f"$.{field}",))
+            for field in self.index_fields:
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_{field} ON {self.table} ({self._column(field)})")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS storage_meta (name TEXT PRIMARY KEY, value TEXT)")
+
+    def _row(self, record):
+        key = record.get(self.key_field)
+        values = [key, _fold(key)] + [_fold(record.get(f)) for f in self.index_fields] + [_encode(record)]
+        return values
+
+    def _upsert_sql(self):
+        columns = ["record_key", "record_key_nocase"] + [self._column(f) for f in self.index_fields] + ["data"]
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns[1:])
+        placeholders = ", ".join("?" for _ in columns)
+        # ON CONFLICT ... DO UPDATE keeps the rowid, so records keep their original order
+        return (f"INSERT INTO {self.table} ({', '.join(columns)}) VALUES ({placeholders}) "
+                f"ON CONFLICT(record_key) DO UPDATE SET {updates}")
+
+    # --- Reading ---
+    def refresh(self):
+        """
+        Returns a stamp that changes whenever the table may have changed: our own write
+        counter plus SQLite's data_version, which moves when another connection commits.
+        """
+        with self._lock:
+            return (self.version, self._conn.execute("PRAGMA data_version").fetchone()[0])
+
+    def exists(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT 1 FROM {self.table} LIMIT 1").fetchone() is not None
+
+    def load(self):
+        return self.all()
+
+    def all(self):
+        with self._lock, metrics.span("storage.load"):
+            rows = self._conn.execute(f"SELECT data FROM {self.table} ORDER BY rowid").fetchall()
+            metrics.incr("storage.bytes_read", sum(len(row[0]) for row in rows))
+            return [json.loads(row[0]) for row in rows]
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute(f"SELECT data FROM {self.table} WHERE record_key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def find(self, field, value):
+        """Returns the records whose `field` equals `value`, ignoring case and surrounding spaces."""
+        if field == self.key_field:
+            column = "record_key_nocase"
+        elif field in self.index_fields:
+            column = self._column(field)
+        else:
+            return [r for r in self.all() if _fold(r.get(field)) == _fold(value)]
+        with self._lock:
+            rows = self._conn.execute(f"SELECT data FROM {self.table} WHERE {column} = ? ORDER BY rowid", (_fold(value),)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def find_one(self, field, value):
+        matches = self.find(field, value)
+        return matches[0] if matches else None
+
+    # --- Writing ---
+    @contextlib.contextmanager
+    def _writing(self, expected=None):
+        """One write transaction under the database's write lock, after checking expected stamps."""
+        with self.write_lock, self._lock:
+            self.check_expected(expected)
+            with self._conn:
+                yield
+                self.version += 1
+
+    def check_expected(self, expected):
+        """Raises ConflictError naming the keys whose stored record_stamp differs from expected."""
+        conflicts = [key for key, stamp in (expected or {}).items() if record_stamp(self.get(key)) != stamp]
+        if conflicts:
+            raise ConflictError(conflicts)
+
+    def upsert(self, record, expected=None):
+        self.upsert_many([record], expected)
+
+    def upsert_many(self, records, expected=None):
+        with self._writing(expected):
+            self._conn.executemany(self._upsert_sql(), [self._row(r) for r in records])
+
+    def delete(self, key, expected=None):
+        self.delete_many([key], expected)
+
+    def delete_many(self, keys, expected=None):
+        with self._writing(expected):
+            self._conn.executemany(f"DELETE FROM {self.table} WHERE record_key = ?", [(k,) for k in keys])
+
+    def apply_batch(self, entries, expected=None):
+        """The same as RecordStore.apply_batch, in a single SQLite transaction."""
+        with self._writing(expected):
+            for entry in entries:
+                if entry['op'] == 'put':
+                    self._conn.execute(self._upsert_sql(), self._row(entry['record']))
+                else:
+                    self._conn.execute(f"DELETE FROM {self.table} WHERE record_key = ?", (entry['key'],))
+
+    def replace_all(self, records):
+        """Makes the table hold exactly `records`, touching only rows that changed."""
+        with self._writing():
+            current = dict(self._conn.execute(f"SELECT record_key, data FROM {self.table}").fetchall())
+            changed = []
+            new_keys = set()
+            for record in records:
+                key = record.get(self.key_field)
+                new_keys.add(key)
+                if current.get(key) != _encode(record):
+                    changed.append(self._row(record))
+            self._conn.executemany(self._upsert_sql(), changed)
+            self._conn.executemany(f"DELETE FROM {self.table} WHERE record_key = ?", [(k,) for k in current if k not in new_keys])
+
+    def compact(self):
+        """Nothing to fold for SQLite; kept so both stores share the same interface."""
+
+    # --- Migration ---
+    def get_meta(self, name):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM storage_meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, name, value):
+        with self.write_lock, self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO storage_meta (name, value) VALUES (?, ?)", (name, value))
+
+
+def migrate_json_to_sqlite(json_store, sqlite_store):
+    """
+    Copies every record from a JSON RecordStore into a SQLiteRecordStore in a single
+    transaction. Runs once per table: a marker in storage_meta stops it re-importing
+    the JSON files later (e.g. after every row has legitimately been deleted).
+    Returns the number of records copied.
+    """
+    marker = f"migrated:{sqlite_store.table}"
+    with sqlite_store.write_lock: # So two processes starting together import once
+        if sqlite_store.get_meta(marker):
+            return 0
+        records = json_store.load() if json_store.exists() else []
+        sqlite_store.upsert_many(records)
+        sqlite_store.set_meta(marker, datetime.now().isoformat(timespec='seconds'))
+    return len(records)
+
+
+# --- Store Registry ---
+# Stores live at module level so every session served by this process shares them.
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(file_path, key_field, index_fields=(), backend="json", db_path=None, table=None):
+    """
+    Returns the process-wide store for file_path, creating it on first use.
+    With backend="sqlite" the records live in `table` of the database at db_path, and
+    the JSON file is imported into it the first time the table is opened.
+    """
+    with _stores_lock:
+        store = _stores.get((backend, file_path))
+        if store is None:
+            if backend == "sqlite":
+                store = SQLiteRecordStore(db_path, table, key_field, index_fields)
+                migrate_json_to_sqlite(RecordStore(file_path, key_field), store)
+            elif backend == "json":
+                store = RecordStore(file_path, key_field, index_fields)
+            else:
+                raise ValueError(f"Unknown storage backend: {backend}")
+            # How to reopen this store, e.g. when replaying a transaction journal
+            store.registry_spec = {"file_path": file_path, "key_field": key_field, "index_fields": list(index_fields),
+                                   "backend": backend, "db_path": db_path, "table": table}
+            _stores[(backend, file_path)] = store
+        return store
+
+
+# --- Transactions ---
+class UnitOfWork:
+    """
+    Stages upserts and deletes across several stores and commits them together:
+
+        with UnitOfWork(journal_dir) as uow:
+            uow.delete(accounts_store, "Adams")
+            uow.delete(profiles_store, "Adams")
+        # committed when the block ends without an exception, discarded otherwise
+
+    commit() first writes every change to a journal file (fsynced, renamed into
+    place), then applies each store's changes in one write (one log append, or one
+    SQLite transaction), then removes the journal. If the process dies in between,
+    recover_transactions() applies whichever stores' changes had not been applied yet
+    (the journal also records the stamps of the records being replaced). Only the staged
+    records are written, so the cost depends on how much changed, not on how much is stored.
+    Stores must come from get_store().
+
+    Like the stores' own writes, each change may name `expected` record stamps. The
+    commit holds every store's write lock while it checks them all, so a ConflictError
+    means nothing at all was written.
+    """
+
+    def __init__(self, journal_dir):
+        self.journal_dir = journal_dir
+        self._changes = [] # (store, entry), in the order staged
+        self._expected = {} # id(store) -> (store, {key: stamp})
+        self.committed = False
+
+    def _stage(self, store, entries, expected):
+        if self.committed:
+            raise RuntimeError("This unit of work has already been committed.")
+        if not hasattr(store, 'registry_spec'):
+            raise ValueError("Only stores returned by get_store() can take part in a unit of work.")
+        self._changes.extend((store, entry) for entry in entries)
+        if expected:
+            self._expected.setdefault(id(store), (store, {}))[1].update(expected)
+
+    def upsert(self, store, record, expected=None):
+        self.upsert_many(store, [record], expected)
+
+    def upsert_many(self, store, records, expected=None):
+        self._stage(store, [{'op': 'put', 'record': dict(record)} for record in records], expected)
+
+    def delete(self, store, key, expected=None):
+        self.delete_many(store, [key], expected)
+
+    def delete_many(self, store, keys, expected=None):
+        self._stage(store, [{'op': 'del', 'key': key} for key in keys], expected)
+
+    def __len__(self):
+        return len(self._changes)
+
+    def _batches(self):
+        """Changes grouped by store (first-staged store first), each in staging order."""
+        batches = {}
+        for store, entry in self._changes:
+            batches.setdefault(id(store), (store, []))[1].append(entry)
+        return list(batches.values())
+
+    def commit(self):
+        if self.committed:
+            raise RuntimeError("This unit of work has already been committed.")
+        self.committed = True
+        batches = self._batches()
+        if not batches:
+            return
+        # Stores sharing a database share a lock; taking them in path order avoids deadlocks
+        locks = sorted({id(store.write_lock): store.write_lock for store, _ in batches}.values(), key=lambda lock: lock.path)
+        with contextlib.ExitStack() as held:
+            for lock in locks:
+                held.enter_context(lock)
+            for store, expected in self._expected.values():
+                store.check_expected(expected)
+            journal_path = os.path.join(self.journal_dir, f"{JOURNAL_PREFIX}{uuid.uuid4().hex}{JOURNAL_SUFFIX}")
+            # With each batch go the stamps of the records it replaces, so recovery can tell
+            # a batch that never got applied from one that did (and may since have been overwritten)
+            atomic_write_json(journal_path, [{"store": store.registry_spec, "entries": entries, "before": _stamps_before(store, entries)}
+                                             for store, entries in batches])
+            for store, entries in batches:
+                store.apply_batch(entries)
+            os.remove(journal_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and not self.committed:
+            self.commit()
+        return False
+
+
+def _touched_keys(store, entries):
+    keys = []
+    for entry in entries:
+        key = entry['record'].get(store.key_field) if entry.get('op') == 'put' else entry.get('key')
+        if key not in keys:
+            keys.append(key)
+    return keys
+
+
+def _stamps_before(store, entries):
+    """[[key, record_stamp]] of the stored records a batch will change, as they are now."""
+    return [[key, record_stamp(store.get(key))] for key in _touched_keys(store, entries)]
+
+
+def _batch_pending(store, batch):
+    """
+    True if a journaled batch has not been applied: every record it touches is still the
+    one it replaces. If any of them differs, the batch was applied (perhaps followed by
+    newer saves) and replaying it would bring back stale data.
+    """
+    before = batch.get("before")
+    if before is None:
+        return True # Journal from before stamps were recorded: replaying is all we can do
+    try:
+        store.check_expected(dict(before)) # Also catches up on other processes' changes
+    except ConflictError:
+        return False
+    return True
+
+
+def recover_transactions(journal_dir, min_age_seconds=None):
+    """
+    Finishes commits that were interrupted (see UnitOfWork) and removes their journals.
+    Run it at startup, before serving writes. Each journal is handled while holding the
+    write locks of every store it names, the same locks its commit held for as long as
+    the journal existed, so a journal still there once they are held belongs to a commit
+    that died. Only batches that were never applied are replayed.
+
+    Where no OS file locks are available (Windows), journals younger than
+    RECOVERY_MIN_AGE_SECONDS are left alone since another process may still be
+    committing them. Returns the number of transactions recovered.
+    """
+    if min_age_seconds is None:
+        min_age_seconds = RECOVERY_MIN_AGE_SECONDS if fcntl is None else 0
+    if not os.path.isdir(journal_dir):
+        return 0
+    recovered = 0
+    now = time.time()
+    for name in sorted(os.listdir(journal_dir)):
+        if not (name.startswith(JOURNAL_PREFIX) and name.endswith(JOURNAL_SUFFIX)):
+            continue
+        journal_path = os.path.join(journal_dir, name)
+        try:
+            if now - os.path.getmtime(journal_path) < min_age_seconds:
+                continue
+            with open(journal_path, 'r') as f:
+                batches = json.load(f)
+        except FileNotFoundError:
+            continue # Finished (or recovered by another process) meanwhile
+        stores = []
+        for batch in batches:
+            spec = batch["store"]
+            stores.append(get_store(spec["file_path"], spec["key_field"], spec["index_fields"],
+                                    backend=spec["backend"], db_path=spec["db_path"], table=spec["table"]))
+        locks = sorted({id(store.write_lock): store.write_lock for store in stores}.values(), key=lambda lock: lock.path)
+        with contextlib.ExitStack() as held:
+            for lock in locks:
+                held.enter_context(lock)
+            if not os.path.exists(journal_path):
+                continue
+            for store, batch in zip(stores, batches):
+                if _batch_pending(store, batch):
+                    store.apply_batch(batch["entries"])
+            os.remove(journal_path)
+        recovered += 1
+    return recovered
+
+
+# --- Shared Read Cache ---
+class FrozenDict(dict):
+    """
+    A dict that refuses changes, for the records nested inside shared views (e.g. a
+    result's subject rows). Unlike MappingProxyType it pickles and JSON-encodes as a
+    plain dict, so such rows can go into render jobs and cache keys unchanged.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Shared records are read-only; copy them (dict(record)) to change them.")
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+def _frozen(value):
+    """value with every nested dict made a FrozenDict and every list a tuple."""
+    if isinstance(value, dict):
+        return FrozenDict((key, _frozen(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(_frozen(item) for item in value)
+    return value
+
+
+class SharedDataCache:
+    """
+    One in-process copy of each store's records, shared by every browser session.
+    view() returns a tuple of read-only record mappings (nested lists and dicts frozen
+    too) that is rebuilt only when the store's version changes (a write, or the files
+    changing on disk); otherwise the same tuple is handed out again. A rebuild holds
+    only its own store's lock, so views of other stores are served meanwhile. Hit/miss
+    counts show whether it is doing its job.
+    """
+
+    def __init__(self):
+        self._views = {}  # store -> (version stamp, view)
+        self._building = {}  # store -> lock held while its view is rebuilt
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, store, stamp):
+        with self._lock:
+            cached = self._views.get(store)
+            if cached is not None and cached[0] == stamp:
+                self.hits += 1
+                return cached[1]
+            return None
+
+    def view(self, store):
+        stamp = store.refresh()
+        view = self._cached(store, stamp)
+        if view is not None:
+            return view
+        with self._lock:
+            building = self._building.setdefault(store, threading.Lock())
+        with building:
+            # Another session may have rebuilt it while we waited
+            stamp = store.refresh()
+            view = self._cached(store, stamp)
+            if view is not None:
+                return view
+            view = tuple(types.MappingProxyType(_frozen(record)) for record in store.all())
+            with self._lock:
+                self.misses += 1
+                self._views[store] = (stamp, view)
+            return view
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "cached_views": len(self._views),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+
+shared_cache = SharedDataCache()
+metrics.register_collector("shared_cache", shared_cache.stats)
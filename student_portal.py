@@ -1,24 +1,41 @@
 import streamlit as st
 import pandas as pd
+import contextlib
+import functools
 import json
 import os
+import tempfile
+import time
 from datetime import datetime, timedelta, date
 from PIL import Image
-from fpdf import FPDF
 import numpy as np
 
-# --- Configuration and Data Paths ---
-DATA_DIR = "student_data"
-STUDENTS_FILE = os.path.join(DATA_DIR, "students.json")
-RESULTS_FILE = os.path.join(DATA_DIR, "results.json")
-STUDENT_PROFILES_FILE = os.path.join(DATA_DIR, "student_profiles.json") # New file for profiles
-
-# Ensure data directory exists
-os.makedirs(DATA_DIR, exist_ok=True)
+from account_import import credentials_csv, hash_account_passwords, plan_account_import, read_account_sheet
+from analytics import analytics_cache, combine_summaries, pass_mark
+from asset_registry import asset_registry, student_photo_file
+from auth import auth_sessions, default_password_hash, hash_password, verify_password
+from excel_import import RESULT_COLUMNS, WORKBOOK_TYPES, import_result_workbooks, parse_student_sheet, read_workbook_sheets
+from export import EXPORT_FORMATS, available_formats, export_results
+from grading import grade_scores, load_grading_config
+from metrics import capture_profile, metrics, to_prometheus
+from pagination import DEFAULT_PAGE_SIZE, PAGE_SIZES, paginate, record_index_cache
+from portal_data import (
+    CUMULATIVE_TERM, DATA_DIR, DEFAULT_STUDENT_PASSWORD, GRADING_CONFIG_FILE, JOURNAL_DIR, REPORT_CARD_FILES,
+    RESULTS_FILE, SESSIONS, STUDENT_PROFILES_FILE, STUDENTS_FILE, TERMS, basic_profile, build_report_card_jobs, cumulative_records,
+    get_data_store, get_results, load_cumulative_records, match_existing_students, prepare_data, report_card_layout,
+    report_card_profile, report_card_results, save_result_entries,
+)
+from ranking import ordinal, rank_index_cache, scope_stamp_cache
+from report_pdf import render_report_cards_merged, render_report_cards_zip, report_card_cache, report_card_filename
+from search_index import search_index_cache
+from storage import ConflictError, UnitOfWork, record_stamp, shared_cache
 
 # --- GLOBAL SETTINGS ---
 TEACHER_USERNAME = "Abdul"
-TEACHER_PASSWORD_HASH = "e10adc39499ba59abbe56e057f20f883e" # MD5 hash of "123456"
+# scrypt hash (see auth.hash_password) of the teacher's password, "123456" unless overridden
+TEACHER_PASSWORD_HASH = os.environ.get(
+    "REPORT_CARD_TEACHER_PASSWORD_HASH",
+    "scrypt$16384$8$1$6IARHyTqslk2lHsPcFEzMg==$hPQxuFu7i/fwByYJul3RfsGU7DNAv0Lp+WyZrSpcbBs=")
 
 # Pre-defined student list with IDs and passwords (for initial app run)
 INITIAL_STUDENTS = [
@@ -27,69 +44,173 @@ INITIAL_STUDENTS = [
     {"id": 3, "username": "Ngozi", "password": "123456"},
 ]
 
-# Pre-defined options for Session and Term dropdowns
-SESSIONS = [f"{year}/{year+1}" for year in range(2023, datetime.now().year + 2)] # Generate current and future sessions
-TERMS = ["First Term", "Second Term", "Third Term"]
+# Timings and counters (see metrics.py) are written to DATA_DIR/metrics.json and
+# metrics.prom at most this often, for monitoring
+METRICS_WRITE_INTERVAL_SECONDS = 15
 
 
 # --- Helper Functions for Data Persistence ---
-class CustomJSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, (datetime, date)):
-            return obj.strftime('%Y-%m-%d')
-        if isinstance(obj, pd.Timestamp):
-            return obj.strftime('%Y-%m-%d')
-        if isinstance(obj, np.integer):
-            return int(obj)
-        elif isinstance(obj, np.floating):
-            return float(obj)
-        elif isinstance(obj, np.bool_):
-            return bool(obj)
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        return json.JSONEncoder.default(self, obj)
+def partition_label(session, term):
+    """How a results partition is shown to users, e.g. '2024/2025 - First Term'."""
+    return f"{session} - {term}" if session or term else "Session/term not recorded"
 
 def load_data(file_path, initial_data=None):
-    """Loads data from a JSON file. Returns initial_data if file doesn't exist or is empty."""
-    if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
-        if initial_data is not None:
-            if file_path == STUDENTS_FILE:
-                st.info("Initializing student accounts.")
-            return list(initial_data)
-        return []
+    """
+    Returns a read-only view of a data file's records from the process-wide cache.
+    The view is shared by every session and only rebuilt after a save (or when the file
+    changes on disk), so calling this on every rerun is cheap. Writes go through
+    save_record/delete_record, never through the returned view.
+    """
+    with metrics.span("portal.load_data"):
+        return _load_data(file_path, initial_data)
+
+def _load_data(file_path, initial_data):
     try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-            # Special handling for students_data to ensure initial students are always present
-            if file_path == STUDENTS_FILE and initial_data is not None:
-                existing_usernames = {s['username'] for s in data}
-                for student in initial_data:
-                    if student['username'] not in existing_usernames:
-                        data.append(student)
-                        st.info(f"Adding initial student '{student['username']}' to existing accounts.")
-                data.sort(key=lambda x: x.get('id', 0))
-            return data
+        store = get_data_store(file_path)
+        if not store.exists():
+            if initial_data is not None:
+                if file_path == STUDENTS_FILE:
+                    st.info("Initializing student accounts.")
+                    store.upsert_many(initial_data)
+                else:
+                    return tuple(initial_data)
+            else:
+                return ()
+        # Special handling for students_data to ensure initial students are always present
+        if file_path == STUDENTS_FILE and initial_data is not None:
+            missing_students = [s for s in initial_data if store.get(s['username']) is None]
+            for student in missing_students:
+                st.info(f"Adding initial student '{student['username']}' to existing accounts.")
+            if missing_students:
+                store.upsert_many(missing_students)
+        return shared_cache.view(store)
     except json.JSONDecodeError as e:
         st.error(f"Error decoding JSON from {file_path}: {e}. The file might be corrupted. Attempting to reset.")
         if initial_data is not None:
-            return list(initial_data)
-        return []
+            return tuple(initial_data)
+        return ()
     except Exception as e:
         st.error(f"An unexpected error occurred while loading {file_path}: {e}")
         if initial_data is not None:
-            return list(initial_data)
-        return []
+            return tuple(initial_data)
+        return ()
 
 
 def save_data(data, file_path):
-    """Saves data to a JSON file using the custom encoder."""
+    """Saves a full list of records. Only records that changed are written to disk."""
     try:
-        with open(file_path, 'w') as f:
-            json.dump(data, f, indent=4, cls=CustomJSONEncoder)
+        get_data_store(file_path).replace_all(data)
+        if file_path in REPORT_CARD_FILES:
+            report_card_cache.invalidate()
     except Exception as e:
         st.error(f"Error saving data to {file_path}: {e}")
 
 
+def save_record(record, file_path, expected=None):
+    """
+    Inserts or updates a single record without rewriting the rest of the file. expected
+    ({key: record_stamp}) refuses the save if someone else changed those records first.
+    Returns True if saved.
+    """
+    try:
+        get_data_store(file_path).upsert(record, expected)
+        if file_path in REPORT_CARD_FILES:
+            report_card_cache.invalidate(record.get('student_name'))
+    except ConflictError as e:
+        st.error(f"Not saved: {', '.join(map(str, e.keys))} was changed by someone else meanwhile. Reload to see the latest version, then try again.")
+        return False
+    except Exception as e:
+        st.error(f"Error saving data to {file_path}: {e}")
+        return False
+    return True
+
+
+def loaded_stamp(slot, key, record):
+    """
+    The record_stamp of the record an editor (`slot`) is showing, as it was when this
+    session first opened it - so saving it can be refused if someone else saved it since.
+    Opening a different key in the same editor starts over.
+    """
+    stamps = st.session_state.setdefault('loaded_stamps', {})
+    if slot not in stamps or stamps[slot][0] != key:
+        stamps[slot] = (key, record_stamp(record))
+    return stamps[slot][1]
+
+
+def forget_stamp(slot):
+    """Drops an editor's loaded stamp after it saved (or hit a conflict), so it reloads."""
+    st.session_state.setdefault('loaded_stamps', {}).pop(slot, None)
+
+
+def delete_record(key, file_path):
+    """Removes a single record (by its key field) from a data file."""
+    try:
+        get_data_store(file_path).delete(key)
+        if file_path in REPORT_CARD_FILES:
+            report_card_cache.invalidate(key)
+    except Exception as e:
+        st.error(f"Error saving data to {file_path}: {e}")
+
+
+def save_results(records, session, term, expected=None):
+    """Inserts or updates students' results for one session and term; expected as for save_record."""
+    try:
+        get_results().save(records, session, term, expected=expected)
+        report_card_cache.invalidate_many(record['student_name'] for record in records)
+    except ConflictError as e:
+        st.error(f"Not saved: results for {', '.join(map(str, e.keys))} ({partition_label(session, term)}) were changed by someone else meanwhile. Check them, then save again.")
+        return False
+    except Exception as e:
+        st.error(f"Error saving results for {partition_label(session, term)}: {e}")
+        return False
+    return True
+
+
+def remove_student(student_name):
+    """
+    Removes a student's login account, profile and results for every session and term
+    as one transaction: either all of them go, or none do.
+    """
+    try:
+        with UnitOfWork(JOURNAL_DIR) as uow:
+            uow.delete(get_data_store(STUDENTS_FILE), student_name)
+            uow.delete(get_data_store(STUDENT_PROFILES_FILE), student_name)
+            get_results().delete_student(student_name, uow)
+    except Exception as e:
+        st.error(f"Error removing {student_name}: {e}")
+        return False
+    auth_sessions.revoke_user(student_name)
+    report_card_cache.invalidate(student_name)
+    return True
+
+
+def rename_student(old_name, new_name):
+    """Renames a student in their login account, profile and every results partition, as one transaction."""
+    students_store = get_data_store(STUDENTS_FILE)
+    profiles_store = get_data_store(STUDENT_PROFILES_FILE)
+    try:
+        with UnitOfWork(JOURNAL_DIR) as uow:
+            account = students_store.get(old_name)
+            if account is not None:
+                uow.delete(students_store, old_name, expected={old_name: record_stamp(account), new_name: None})
+                uow.upsert(students_store, dict(account, username=new_name))
+            profile = profiles_store.get(old_name)
+            if profile is not None:
+                uow.delete(profiles_store, old_name, expected={old_name: record_stamp(profile), new_name: None})
+                uow.upsert(profiles_store, dict(profile, student_name=new_name))
+            get_results().rename_student(old_name, new_name, uow)
+    except ConflictError:
+        st.error(f"Not renamed: {old_name} or '{new_name}' was changed by someone else meanwhile. Please try again.")
+        return False
+    except Exception as e:
+        st.error(f"Error renaming {old_name}: {e}")
+        return False
+    auth_sessions.revoke_user(old_name)
+    report_card_cache.invalidate(old_name)
+    report_card_cache.invalidate(new_name)
+    return True
+
+
 # --- Session State Initialization ---
 def initialize_session_state():
     if 'logged_in' not in st.session_state:
@@ -97,34 +218,65 @@ def initialize_session_state():
         st.session_state.user_role = None
         st.session_state.username = None
 
+    # A login stays valid only while its session token does (it expires, and is revoked
+    # on logout or when the account is removed)
+    if st.session_state.logged_in and auth_sessions.validate(st.session_state.get('auth_token')) is None:
+        st.session_state.logged_in = False
+        st.session_state.user_role = None
+        st.session_state.username = None
+
+    # Once per process, before reading: finish multi-file saves interrupted by a crash and
+    # move results saved before they were kept per session and term
+    try:
+        prepared = prepare_data()
+        if prepared["recovered"]:
+            st.info(f"Completed {prepared['recovered']} interrupted save(s).")
+        if prepared["moved"]:
+            st.info(f"Moved {prepared['moved']} saved result(s) into per-session/term storage.")
+    except Exception as e:
+        st.error(f"Could not prepare the data in {DATA_DIR} (interrupted saves or per-session/term results): {e}")
+
+    # These are shared, read-only views (see load_data); refreshing them is a cache hit
+    # unless something was saved since the last rerun.
     st.session_state.students_data = load_data(STUDENTS_FILE, INITIAL_STUDENTS)
-    if 'results_data' not in st.session_state:
-        st.session_state.results_data = load_data(RESULTS_FILE)
-    if 'student_profiles_data' not in st.session_state:
-        st.session_state.student_profiles_data = load_data(STUDENT_PROFILES_FILE)
+    st.session_state.student_profiles_data = load_data(STUDENT_PROFILES_FILE)
 
 
 # --- Authentication ---
+def start_session(username, role):
+    """Marks this browser session as logged in; later reruns only check the session token."""
+    st.session_state.logged_in = True
+    st.session_state.user_role = role
+    st.session_state.username = username
+    st.session_state.auth_token = auth_sessions.issue(username, role)
+
 def authenticate_user(username, password):
-    if username == TEACHER_USERNAME and password == "123456":
-        st.session_state.logged_in = True
-        st.session_state.user_role = 'teacher'
-        st.session_state.username = username
-        st.success("Teacher login successful!")
+    if username == TEACHER_USERNAME:
+        if verify_password(password, TEACHER_PASSWORD_HASH)[0]:
+            start_session(username, 'teacher')
+            st.success("Teacher login successful!")
+            st.rerun()
+        st.error("Invalid Username or Password.")
+        return
+
+    # Accounts are keyed by username, so this is a direct lookup rather than a scan. An
+    # unknown username is still checked (against a dummy hash) so it takes just as long.
+    found_student = get_data_store(STUDENTS_FILE).get(username)
+    matches, needs_upgrade = verify_password(password, found_student.get('password') if found_student else None)
+    if matches:
+        if needs_upgrade:
+            # Replace a plain-text (or outdated) stored password with a hash
+            save_record(dict(found_student, password=hash_password(password)), STUDENTS_FILE, expected={username: record_stamp(found_student)})
+        start_session(username, 'student')
+        st.session_state.student_id = found_student.get('id')
+        st.success(f"Welcome, {username}!")
         st.rerun()
     else:
-        found_student = next((s for s in st.session_state.students_data if s['username'] == username and s['password'] == password), None)
-        if found_student:
-            st.session_state.logged_in = True
-            st.session_state.user_role = 'student'
-            st.session_state.username = username
-            st.session_state.student_id = found_student.get('id')
-            st.success(f"Welcome, {username}!")
-            st.rerun()
-        else:
-            st.error("Invalid Username or Password.")
+        st.error("Invalid Username or Password.")
 
 def logout():
+    auth_sessions.revoke(st.session_state.get('auth_token'))
+    st.session_state.auth_token = None
     st.session_state.logged_in = False
     st.session_state.user_role = None
     st.session_state.username = None
@@ -312,38 +464,540 @@ def apply_custom_css():
 
 
 # --- Report Card Logic (Adapted from SR0-4.18.py) ---
+def load_grading_options():
+    """Returns grading options from GRADING_CONFIG_FILE if a school has provided one, else the defaults."""
+    if os.path.exists(GRADING_CONFIG_FILE):
+        try:
+            return load_grading_config(GRADING_CONFIG_FILE)
+        except Exception as e:
+            st.error(f"Could not read grading configuration from {GRADING_CONFIG_FILE}: {e}. Using the default grading scale.")
+    return {}
+
 def calculate_grades(df_scores):
     """
     Calculates final scores, grades, and remarks for a DataFrame of subjects.
     Assumes df_scores has 'CA1', 'CA2', 'Exam' columns.
     Returns the DataFrame with 'Final', 'Grade', 'Remark' columns added.
     """
-    if df_scores.empty:
-        return df_scores
-
-    # Ensure numeric types, coercing errors
-    df_scores['CA1'] = pd.to_numeric(df_scores['CA1'], errors='coerce').fillna(0)
-    df_scores['CA2'] = pd.to_numeric(df_scores['CA2'], errors='coerce').fillna(0)
-    df_scores['Exam'] = pd.to_numeric(df_scores['Exam'], errors='coerce').fillna(0)
-
-    df_scores['Final'] = df_scores['CA1'] + df_scores['CA2'] + df_scores['Exam']
-
-    def get_grade_remark(score):
-        if score >= 75:
-            return "A", "Excellent"
-        elif score >= 60:
-            return "B", "Very Good"
-        elif score >= 50:
-            return "C", "Credit"
+    return grade_scores(df_scores, **load_grading_options())
+
+def results_stamp(session, term):
+    """
+    Changes whenever one session/term's results are saved, or a profile field those
+    results take their class scope from (see ranking.ScopeStampCache). Edits to other
+    students' profiles leave it alone.
+    """
+    version = get_results().store(session, term).refresh()
+    profiles_store = get_data_store(STUDENT_PROFILES_FILE)
+    scope = scope_stamp_cache.get((session, term), (version, profiles_store.refresh()), lambda: get_results().load(session, term), profiles_store)
+    return (version, scope)
+
+def get_rank_index(session, term):
+    """
+    Returns the class-position index for one session and term (see ranking.py). It is
+    rebuilt only when that term's results or its students' class scope have changed
+    since the last build, so looking up a rank is a dict access.
+    """
+    return rank_index_cache.get((session, term), results_stamp(session, term), lambda: get_results().load(session, term), get_data_store(STUDENT_PROFILES_FILE))
+
+def get_cumulative_rank_index(session):
+    """
+    Class positions on whole-session results (see portal_data.cumulative_records),
+    rebuilt only when one of the session's terms or its students' class scope has changed.
+    """
+    # Whole-session records carry no class, so every student's comes from their profile
+    versions = tuple(get_results().store(session, term).refresh() for s, term in get_results().partitions() if s == session)
+    profiles_store = get_data_store(STUDENT_PROFILES_FILE)
+    records = functools.lru_cache(maxsize=None)(lambda: load_cumulative_records(session)) # built at most once below
+    scope = scope_stamp_cache.get((session, CUMULATIVE_TERM), (versions, profiles_store.refresh()), records, profiles_store)
+    return rank_index_cache.get((session, CUMULATIVE_TERM), (versions, scope), records, profiles_store)
+
+def session_term_selectors(key_prefix, default_session=None, default_term=None):
+    """Session and term dropdowns side by side. Returns (session, term)."""
+    col1, col2 = st.columns(2)
+    with col1:
+        session = st.selectbox("Academic Session", SESSIONS, index=SESSIONS.index(default_session) if default_session in SESSIONS else 0, key=f"{key_prefix}_session")
+    with col2:
+        term = st.selectbox("Academic Term", TERMS, index=TERMS.index(default_term) if default_term in TERMS else 0, key=f"{key_prefix}_term")
+    return session, term
+
+# --- Bulk Result Import ---
+def save_bulk_results(entries, session, term, expected=None):
+    """
+    Saves many students' results for one session and term with a single write per data
+    file, creating login accounts and basic profiles for students that don't have them yet
+    (see portal_data.save_result_entries). Returns the counts saved, or None on error.
+    """
+    try:
+        saved = save_result_entries(entries, session, term, expected=expected)
+        report_card_cache.invalidate_many(entry['student_name'] for entry in entries)
+    except ConflictError as e:
+        st.error(f"Not saved: {', '.join(map(str, e.keys))} changed while importing (someone else saved them). Please import again.")
+        return None
+    except Exception as e:
+        st.error(f"Error saving bulk results: {e}")
+        return None
+    return saved
+
+def bulk_results_import():
+    st.info("Upload one or more workbooks. Each sheet can be a single student's sheet (name in B2, subjects from row 9) "
+            "or a class sheet with one row per student: a 'Student Name' column plus CA1, CA2 and Exam columns for each subject "
+            "(e.g. 'Math CA1', 'Math CA2', 'Math Exam', or subject names on row 1 with CA1/CA2/Exam under them on row 2). A .csv file is read as one class sheet.")
+
+    bulk_files = st.file_uploader("Choose Excel or CSV files", type=WORKBOOK_TYPES, accept_multiple_files=True, key="bulk_result_files")
+    if not bulk_files:
+        return
+
+    batch = import_result_workbooks([(f.name, f) for f in bulk_files], load_grading_options())
+
+    # Save under the existing spelling of students already on record ("adams " -> "Adams")
+    batch, renamed = match_existing_students(batch, existing_student_name)
+    if renamed:
+        st.info("Matched to existing students: " + ", ".join(f"'{old}' → '{new}'" for old, new in renamed.items()))
+
+    if batch['errors']:
+        st.warning(f"{len(batch['errors'])} problem(s) found. Affected sheets or students are listed below; everything else can still be saved.")
+        st.dataframe(pd.DataFrame(batch['errors']), hide_index=True, use_container_width=True)
+
+    if not batch['entries']:
+        st.error("No student results could be read from the uploaded files.")
+        return
+
+    st.success(f"Processed results for {len(batch['entries'])} students from {len(bulk_files)} file(s).")
+    st.dataframe(batch['graded'][['student_name'] + RESULT_COLUMNS], hide_index=True, use_container_width=True)
+
+    session, term = session_term_selectors("bulk_results")
+    if st.button(f"Save Results for {len(batch['entries'])} Students", key="save_bulk_results"):
+        saved = save_bulk_results(batch['entries'], session, term)
+        if saved:
+            st.success(f"Saved results for {saved['results']} students for {partition_label(session, term)}.")
+            if saved['accounts']:
+                st.info(f"Added {saved['accounts']} new student accounts with default password '{DEFAULT_STUDENT_PASSWORD}'.")
+            if saved['profiles']:
+                st.warning(f"Created {saved['profiles']} basic profiles. Please fill in their details in the 'Student Profiles' tab.")
+            st.rerun()
+
+
+# --- Paginated Tables ---
+# Searchable fields and filters of the teacher's record tables (see pagination.py)
+TABLE_SPECS = {
+    STUDENTS_FILE: {"search": ["username"], "filters": []},
+    STUDENT_PROFILES_FILE: {"search": ["student_name", "reg_number", "class_name"], "filters": ["session", "term", "class_name"]},
+}
+FILTER_LABELS = {"session": "Academic Session", "term": "Academic Term", "class_name": "Class"}
+# Longest list offered in a student dropdown; narrow it down with the search box
+MAX_SELECT_OPTIONS = 100
+
+def get_record_index(file_path):
+    """Search/filter index over a data file's records, rebuilt only after the file changes."""
+    spec = TABLE_SPECS[file_path]
+    # The stamp is read before the records are loaded (on a rebuild), so they are at least as new
+    stamp = get_data_store(file_path).refresh()
+    return record_index_cache.get(file_path, stamp, lambda: load_data(file_path), spec["search"], spec["filters"])
+
+def paginated_table(key, file_path, drop_columns=()):
+    """Search box, filters and one page of a data file's records; only that page is sent to the browser."""
+    spec = TABLE_SPECS[file_path]
+    index = get_record_index(file_path)
+
+    columns = st.columns([3] + [2] * len(spec["filters"]) + [1])
+    with columns[0]:
+        query = st.text_input("Search", key=f"{key}_search", placeholder="Name or registration number")
+    filters = {}
+    for column, field in zip(columns[1:], spec["filters"]):
+        with column:
+            choice = st.selectbox(FILTER_LABELS[field], ["All"] + index.filter_options(field), key=f"{key}_{field}")
+        if choice != "All":
+            filters[field] = choice
+    with columns[-1]:
+        page_size = st.selectbox("Rows per page", PAGE_SIZES, index=PAGE_SIZES.index(DEFAULT_PAGE_SIZE), key=f"{key}_page_size")
+
+    positions = index.select(query, filters)
+    page = st.number_input("Page", min_value=1, value=1, step=1, key=f"{key}_page")
+    page_records, page, pages = paginate(index, positions, int(page), page_size)
+    if page_records:
+        st.dataframe(pd.DataFrame(page_records).drop(columns=list(drop_columns), errors='ignore'), hide_index=True, use_container_width=True)
+        first = (page - 1) * page_size + 1
+        st.caption(f"Showing {first}–{first + len(page_records) - 1} of {len(positions)} (page {page} of {pages})")
+    else:
+        st.info("No matching records.")
+
+def matching_keys(file_path, key_field, query, exclude=()):
+    """Key values (e.g. student names) of the first MAX_SELECT_OPTIONS records matching a search."""
+    index = get_record_index(file_path)
+    keys = []
+    for position in index.select(query):
+        if index.records[position][key_field] not in exclude:
+            keys.append(index.records[position][key_field])
+            if len(keys) == MAX_SELECT_OPTIONS:
+                break
+    return keys
+
+
+# --- Student Search ---
+def get_search_index():
+    """Fuzzy search over every student (see search_index.py), rebuilt only after accounts or profiles change."""
+    # Stamps first, then (on a rebuild) the records, so the index is never older than its stamp
+    stamp = (get_data_store(STUDENTS_FILE).refresh(), get_data_store(STUDENT_PROFILES_FILE).refresh())
+    return search_index_cache.get(stamp, lambda: load_data(STUDENT_PROFILES_FILE), lambda: load_data(STUDENTS_FILE))
+
+def existing_student_name(name):
+    """The stored spelling of an existing student whose name normalises the same as `name` ("adams " -> "Adams"), or None."""
+    return get_search_index().find_existing(name)
+
+def find_students(query):
+    """Student names for a dropdown: best fuzzy matches for the query, or the first MAX_SELECT_OPTIONS profiles."""
+    if query.strip():
+        return [name for name, _ in get_search_index().search(query, limit=MAX_SELECT_OPTIONS)]
+    return matching_keys(STUDENT_PROFILES_FILE, 'student_name', "")
+
+
+# --- Bulk Account Import ---
+def bulk_accounts_import():
+    st.info("Upload a CSV or Excel sheet with one row per student. A 'Username' (or 'Student Name') column is required; "
+            "'Password', 'Registration Number', 'Class', 'Age', 'Parent Name', 'Parent Phone', 'Parent Address', "
+            "'Session' and 'Term' columns are used if present.")
+
+    accounts_file = st.file_uploader("Choose a CSV or Excel file", type=["csv", "xlsx"], key="bulk_accounts_file")
+    if accounts_file is not None:
+        try:
+            frame = read_account_sheet(accounts_file.name, accounts_file)
+        except Exception as e:
+            st.error(f"Could not read {accounts_file.name}: {e}")
+            frame = None
+
+        if frame is not None:
+            generate_passwords = st.checkbox("Generate a random password for students without one", value=True, key="bulk_accounts_generate",
+                                             help=f"Otherwise they get the default password '{DEFAULT_STUDENT_PASSWORD}'.")
+            # Name keys of existing students for duplicate checks, and the next free id
+            existing_usernames = set(get_search_index().by_key)
+            next_id = max([s.get('id', 0) for s in st.session_state.students_data], default=0) + 1
+            plan = plan_account_import(frame, existing_usernames, next_id, get_data_store(STUDENT_PROFILES_FILE),
+                                       generate_passwords=generate_passwords, default_password=DEFAULT_STUDENT_PASSWORD)
+            # The profiles as first previewed for this upload, so creating the accounts is
+            # refused if someone else edits one of them in the meantime
+            upload_key = (accounts_file.name, accounts_file.size)
+            if st.session_state.get('bulk_account_stamps', (None, None))[0] != upload_key:
+                st.session_state.bulk_account_stamps = (upload_key, plan['profile_stamps'])
+            profile_stamps = dict(plan['profile_stamps'], **st.session_state.bulk_account_stamps[1])
+
+            if plan['errors']:
+                st.warning(f"{len(plan['errors'])} row(s) will be skipped or need attention:")
+                st.dataframe(pd.DataFrame(plan['errors']), hide_index=True, use_container_width=True)
+
+            if plan['accounts']:
+                st.write(f"**{len(plan['accounts'])}** new account(s) ready to create.")
+                st.dataframe(pd.DataFrame(plan['profiles']), hide_index=True, use_container_width=True)
+                if st.button(f"Create {len(plan['accounts'])} Accounts", key="create_bulk_accounts"):
+                    progress_bar = st.progress(0.0, text="Securing passwords...")
+                    accounts = hash_account_passwords(plan['accounts'], DEFAULT_STUDENT_PASSWORD,
+                                                      progress=lambda done, total: progress_bar.progress(done / total, text=f"Secured {done} of {total} passwords"))
+                    try:
+                        # One write per data file for the whole intake, accounts and profiles together
+                        with UnitOfWork(JOURNAL_DIR) as uow:
+                            uow.upsert_many(get_data_store(STUDENTS_FILE), accounts, expected={a['username']: None for a in accounts})
+                            uow.upsert_many(get_data_store(STUDENT_PROFILES_FILE), plan['profiles'],
+                                            expected={p['student_name']: profile_stamps[p['student_name']] for p in plan['profiles']})
+                        report_card_cache.invalidate_many(profile['student_name'] for profile in plan['profiles'])
+                        st.session_state.bulk_account_credentials = {"data": credentials_csv(plan['credentials']), "count": len(accounts)}
+                        st.session_state.bulk_account_stamps = (None, None)
+                        st.rerun()
+                    except ConflictError as e:
+                        st.session_state.bulk_account_stamps = (None, None) # Preview what is stored now
+                        st.error(f"Not created: the accounts or profiles of {', '.join(map(str, e.keys))} were changed by someone else meanwhile. "
+                                 "Check the preview again (new accounts that now exist are skipped), then create the accounts.")
+                    except Exception as e:
+                        st.error(f"Error creating accounts: {e}")
+            else:
+                st.info("No new accounts to create from this file.")
+
+    credentials = st.session_state.get('bulk_account_credentials')
+    if credentials:
+        st.success(f"Created {credentials['count']} account(s). Download the credentials sheet now; passwords are stored hashed and cannot be shown again.")
+        st.download_button("Download Credentials (CSV)", data=credentials['data'], file_name="student_credentials.csv", mime="text/csv", key="download_bulk_credentials")
+        if st.button("Done", key="dismiss_bulk_credentials"):
+            st.session_state.bulk_account_credentials = None
+            st.rerun()
+
+
+# --- Analytics ---
+def analytics_tab():
+    st.subheader("Results Analytics")
+
+    partitions = get_results().partitions()
+    if not partitions:
+        st.info("No results saved yet.")
+        return
+
+    sessions_in_use = sorted({session for session, _ in partitions if session})
+    col1, col2 = st.columns(2)
+    with col1:
+        session_filter = st.selectbox("Academic Session", ["All Sessions"] + sessions_in_use, key="analytics_session")
+    with col2:
+        term_filter = st.selectbox("Academic Term", ["All Terms"] + TERMS, key="analytics_term")
+    selected_partitions = [(session, term) for session, term in partitions
+                           if session_filter in ("All Sessions", session) and term_filter in ("All Terms", term)]
+
+    # Each term is summarised once per save; here the cached summaries are only added up
+    passing_score = pass_mark(load_grading_options().get('scale'))
+    profiles_store = get_data_store(STUDENT_PROFILES_FILE)
+    summaries = [analytics_cache.get((session, term), results_stamp(session, term), functools.partial(get_results().load, session, term), profiles_store, passing_score)
+                 for session, term in selected_partitions]
+
+    classes_in_use = sorted({c for s in summaries for c in s.student_totals['class_name'].unique() if c})
+    class_filter = st.selectbox("Class", ["All Classes"] + classes_in_use, key="analytics_class")
+    figures = combine_summaries(summaries, None if class_filter == "All Classes" else class_filter)
+
+    subjects, students = figures['subjects'], figures['students']
+    if students.empty:
+        st.info("No results for this selection.")
+        return
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Students", students['student_name'].nunique())
+    col2.metric("Subjects", len(subjects))
+    col3.metric("Average Score", f"{subjects['score_sum'].sum() / subjects['entries'].sum():.1f}")
+    col4.metric(f"Pass Rate (≥ {passing_score})", f"{subjects['passes'].sum() / subjects['entries'].sum() * 100:.1f}%")
+
+    st.markdown("#### Subject Averages")
+    st.bar_chart(subjects['average'])
+    st.dataframe(subjects.drop(columns=['score_sum']).rename(columns={
+        "entries": "Entries", "passes": "Passes", "lowest": "Lowest", "highest": "Highest",
+        "average": "Average", "pass_rate": "Pass Rate (%)",
+    }), use_container_width=True)
+
+    st.markdown("#### Grade Distribution")
+    st.dataframe(figures['grades'], use_container_width=True)
+
+    top_n = st.slider("Number of students to list", min_value=1, max_value=20, value=5, key="analytics_top_n")
+    student_columns = {"student_name": "Student", "class_name": "Class", "session": "Session", "term": "Term",
+                       "subjects": "Subjects", "total_score": "Total Score", "average": "Average"}
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("#### Top Performers")
+        st.dataframe(students.head(top_n).rename(columns=student_columns), hide_index=True, use_container_width=True)
+    with col2:
+        st.markdown("#### Bottom Performers")
+        st.dataframe(students.tail(top_n).iloc[::-1].rename(columns=student_columns), hide_index=True, use_container_width=True)
+
+
+# --- Prepared Downloads ---
+# Batch report cards and exports are written here and served from disk, so they never sit in session state
+DOWNLOADS_DIR = os.path.join(tempfile.gettempdir(), "student_portal_downloads")
+DOWNLOAD_MAX_AGE_SECONDS = 24 * 60 * 60  # Files of sessions that never downloaded them are removed after this
+
+
+def new_download_path(suffix):
+    """Returns a new empty file in DOWNLOADS_DIR, first removing ones left behind by abandoned sessions."""
+    os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+    cutoff = time.time() - DOWNLOAD_MAX_AGE_SECONDS
+    for entry in os.scandir(DOWNLOADS_DIR):
+        with contextlib.suppress(FileNotFoundError):
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+    fd, path = tempfile.mkstemp(dir=DOWNLOADS_DIR, suffix=suffix)
+    os.close(fd)
+    return path
+
+
+def set_download(key, path, **details):
+    """Offers the file at path for download under key, removing the file it replaces."""
+    clear_download(key)
+    st.session_state[key] = {"path": path, **details}
+
+
+def clear_download(key):
+    """Forgets the download under key and removes its file."""
+    output = st.session_state.pop(key, None)
+    if output:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(output['path'])
+
+
+def prepared_download_button(key):
+    """Shows a download button for the file under key, streamed from disk and cleared once downloaded."""
+    output = st.session_state[key]
+    try:
+        file = open(output['path'], 'rb')
+    except FileNotFoundError:
+        st.session_state.pop(key, None)
+        st.warning("The prepared file has expired. Please generate it again.")
+        return
+    with file:
+        st.download_button(
+            label=f"Download {output['file_name']}",
+            data=file,
+            file_name=output['file_name'],
+            mime=output['mime'],
+            on_click=clear_download,
+            args=(key,)
+        )
+
+
+# --- Batch Report Cards ---
+def batch_report_cards_tab():
+    st.subheader("Generate All Report Cards")
+    st.write("Render report cards for every student with results, or only those in a given session and term, ready for printing.")
+
+    profiles_by_name = {p['student_name']: p for p in st.session_state.student_profiles_data}
+    partitions = get_results().partitions()
+    sessions_in_use = sorted({session for session, _ in partitions if session})
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        session_filter = st.selectbox("Academic Session", ["All Sessions"] + sessions_in_use, key="batch_session")
+    with col2:
+        # "Cumulative" puts every term of a session on one card per student
+        term_filter = st.selectbox("Academic Term", ["All Terms"] + TERMS + [CUMULATIVE_TERM], key="batch_term")
+    with col3:
+        output_format = st.radio("Output", ["ZIP of PDFs", "Single merged PDF"], key="batch_format")
+
+    # Only the selected terms' results are read
+    cumulative = term_filter == CUMULATIVE_TERM
+    selected_partitions = [(session, term) for session, term in partitions
+                           if session_filter in ("All Sessions", session) and (cumulative or term_filter in ("All Terms", term))]
+    if cumulative:
+        students_by_session = {}
+        for session, term in selected_partitions:
+            students_by_session.setdefault(session, set()).update(r['student_name'] for r in get_results().load(session, term))
+        selected_count = sum(len(names) for names in students_by_session.values())
+    else:
+        selected_count = sum(len(get_results().load(session, term)) for session, term in selected_partitions)
+    st.write(f"**{selected_count}** report card(s) selected.")
+
+    if st.button("Generate Report Cards", disabled=not selected_count):
+        jobs = []
+        if cumulative:
+            for session in students_by_session:
+                jobs.extend(build_report_card_jobs(load_cumulative_records(session), profiles_by_name,
+                                                   get_cumulative_rank_index(session), session, CUMULATIVE_TERM))
         else:
-            return "F", "Failed"
+            for session, term in selected_partitions:
+                jobs.extend(build_report_card_jobs(get_results().load(session, term), profiles_by_name, get_rank_index(session, term), session, term))
+        progress_bar = st.progress(0.0, text="Starting...")
 
-    df_scores[['Grade', 'Remark']] = df_scores['Final'].apply(lambda x: pd.Series(get_grade_remark(x)))
-    return df_scores
+        def show_progress(done, total):
+            progress_bar.progress(done / total, text=f"Rendered {done} of {total} report cards")
+
+        zipped = output_format == "ZIP of PDFs"
+        path = new_download_path(".zip" if zipped else ".pdf")
+        try:
+            if zipped:
+                render_report_cards_zip(jobs, path, progress=show_progress)
+                file_name, mime = "report_cards.zip", "application/zip"
+            else:
+                render_report_cards_merged(jobs, path, progress=show_progress)
+                file_name, mime = "report_cards.pdf", "application/pdf"
+            set_download('batch_report_cards', path, file_name=file_name, mime=mime, count=len(jobs))
+        except Exception as e:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            st.error(f"Error generating report cards: {e}")
+            st.exception(e)
+
+    batch_output = st.session_state.get('batch_report_cards')
+    if batch_output:
+        st.success(f"{batch_output['count']} report card(s) ready.")
+        prepared_download_button('batch_report_cards')
+
+
+# --- Results Export ---
+def export_tab():
+    st.subheader("Export Results")
+    st.write("Download every subject result with the student's profile details, total score and positions, "
+             "for one term or all of them.")
+
+    partitions = get_results().partitions()
+    if not partitions:
+        st.info("No results saved yet.")
+        return
+
+    sessions_in_use = sorted({session for session, _ in partitions if session})
+    formats = available_formats()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        session_filter = st.selectbox("Academic Session", ["All Sessions"] + sessions_in_use, key="export_session")
+    with col2:
+        term_filter = st.selectbox("Academic Term", ["All Terms"] + TERMS, key="export_term")
+    with col3:
+        fmt = st.selectbox("Format", formats, format_func=lambda name: EXPORT_FORMATS[name]['label'], key="export_format")
+    if "parquet" not in formats:
+        st.caption("Parquet export is available once the 'pyarrow' package is installed.")
+
+    selected_partitions = [(session, term) for session, term in partitions
+                           if session_filter in ("All Sessions", session) and term_filter in ("All Terms", term)]
+
+    if st.button("Prepare Export", disabled=not selected_partitions):
+        # Terms are read one at a time as the export reaches them
+        partition_data = ((get_results().load(session, term), get_rank_index(session, term)) for session, term in selected_partitions)
+        extension = EXPORT_FORMATS[fmt]['extension']
+        path = new_download_path(f".{extension}")
+        try:
+            with st.spinner("Exporting results..."):
+                with open(path, 'wb') as output:
+                    rows = export_results(partition_data, output, fmt, get_data_store(STUDENT_PROFILES_FILE))
+            set_download('results_export', path, file_name=f"results_export.{extension}", mime=EXPORT_FORMATS[fmt]['mime'], rows=rows)
+        except Exception as e:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            st.error(f"Error exporting results: {e}")
+
+    export_output = st.session_state.get('results_export')
+    if export_output:
+        st.success(f"{export_output['rows']} result row(s) exported.")
+        prepared_download_button('results_export')
+
+
+# --- Diagnostics ---
+def diagnostics_tab():
+    st.subheader("Diagnostics")
+    snapshot = metrics.snapshot()
+    st.write(f"Timings and counters for this app process over the last {snapshot['uptime_seconds'] / 60:.0f} minute(s). "
+             "Report cards rendered in background worker processes are counted, but not timed.")
+
+    spans = pd.DataFrame([{
+        "Stage": name,
+        "Calls": span['count'],
+        "Total (ms)": span['total_seconds'] * 1000,
+        "Mean (ms)": span['total_seconds'] * 1000 / span['count'],
+        "Slowest (ms)": span['max_seconds'] * 1000,
+    } for name, span in snapshot['spans'].items()])
+    if not spans.empty:
+        st.markdown("#### Timings")
+        st.dataframe(spans.sort_values("Total (ms)", ascending=False).round(2), hide_index=True, use_container_width=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("#### Counters")
+        st.dataframe(pd.DataFrame(list(snapshot['counters'].items()), columns=["Counter", "Value"]), hide_index=True, use_container_width=True)
+    with col2:
+        st.markdown("#### Caches")
+        st.dataframe(pd.DataFrame([{"Cache": cache, "Statistic": key, "Value": value}
+                                   for cache, values in snapshot['gauges'].items() for key, value in values.items()]),
+                     hide_index=True, use_container_width=True)
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.download_button("Download metrics (JSON)", data=json.dumps(snapshot, indent=2), file_name="metrics.json", mime="application/json")
+    with col2:
+        st.download_button("Download metrics (Prometheus)", data=to_prometheus(snapshot), file_name="metrics.prom", mime="text/plain")
+    with col3:
+        if st.button("Reset Timings and Counters", key="reset_metrics"):
+            metrics.reset()
+            st.rerun()
+    st.caption(f"Also written to {os.path.join(DATA_DIR, 'metrics.json')} and metrics.prom every {METRICS_WRITE_INTERVAL_SECONDS} seconds while the app is in use.")
+
+    st.markdown("#### Profile a Page Load")
+    st.write("Runs the next page load under Python's profiler and shows where the time went. It slows that one load down.")
+    if st.button("Profile Next Page Load", key="profile_next_rerun_button"):
+        st.session_state.profile_next_rerun = True
+        st.rerun()
+    last_profile = st.session_state.get('last_profile')
+    if last_profile:
+        st.caption(f"Captured {last_profile['captured']}")
+        st.code(last_profile['text'], language=None)
+        st.download_button("Download Profile", data=last_profile['text'], file_name="profile.txt", mime="text/plain")
 
-def ordinal(n):
-    """Converts a number to its ordinal string (e.g., 1st, 2nd, 3rd)."""
-    return "%d%s" % (n, "tsnrhtdd"[(n//10%10!=1)*(n%10<4)*n%10::4])
 
 # --- Teacher Portal ---
 def teacher_portal():
@@ -352,13 +1006,20 @@ def teacher_portal():
 
     st.sidebar.markdown("---")
     st.sidebar.button("Logout", on_click=logout)
+    cache_stats = shared_cache.stats()
+    st.sidebar.caption(f"Data cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate)")
+    pdf_cache_stats = report_card_cache.stats()
+    st.sidebar.caption(f"Report card cache: {pdf_cache_stats['entries']} cards, {pdf_cache_stats['bytes'] / 1e6:.1f} MB ({pdf_cache_stats['hits']} hits / {pdf_cache_stats['misses']} misses)")
 
     st.write("Welcome, Teacher! Here you can upload and manage student results and their profiles.")
 
     # Create tabs for better organization
-    tab_results, tab_profiles, tab_accounts = st.tabs(["📊 Manage Results", "🧑‍🎓 Student Profiles", "🔑 Student Accounts"])
+    tab_results, tab_profiles, tab_accounts, tab_report_cards, tab_analytics, tab_export, tab_diagnostics = st.tabs(["📊 Manage Results", "🧑‍🎓 Student Profiles", "🔑 Student Accounts", "🖨️ Report Cards", "📈 Analytics", "📤 Export", "🩺 Diagnostics"])
 
     with tab_results:
+        with st.expander("📥 Bulk Import: whole class or several workbooks at once"):
+            bulk_results_import()
+
         st.subheader("Upload Student Results (Excel File)")
         st.info("Expected Excel format: Student Name in cell B2. Subject data starts from Row 9, Column A. Columns needed: 'Subject', 'CA 1' (or 'CA1'), 'CA 2' (or 'CA2'), and 'Exam'.")
 
@@ -366,114 +1027,60 @@ def teacher_portal():
 
         if uploaded_file is not None:
             try:
-                # Read student name from B2
-                student_info_df = pd.read_excel(uploaded_file, header=None, nrows=2, usecols="B", engine='openpyxl')
-                student_name = student_info_df.iloc[1, 0]
-
-                if not student_name:
-                    st.error("Could not find student name in cell B2 of the Excel file.")
+                # Open the workbook once (cached by content, so reruns don't re-parse it)
+                # and take the name from B2 and the subject table from row 9 of the first sheet.
+                first_sheet = next(iter(read_workbook_sheets(uploaded_file).values()))
+                try:
+                    student_name, df = parse_student_sheet(first_sheet)
+                except ValueError as e:
+                    st.error(f"Error: {e} Please ensure the Excel file matches the expected format.")
                     return
 
-                # Clean up student name: remove leading/trailing spaces and newlines
-                student_name = str(student_name).strip()
+                existing_name = existing_student_name(student_name)
+                if existing_name and existing_name != student_name:
+                    st.info(f"'{student_name}' matches the existing student '{existing_name}'; results will be saved under that name.")
+                    student_name = existing_name
 
                 st.write(f"Detected Student Name: **{student_name}**")
 
-                # Read subject data starting from row 9 (skiprows=8)
-                # Use 'header=0' to ensure the first row after skiprows is treated as the header
-                df = pd.read_excel(uploaded_file, skiprows=8, header=0, engine='openpyxl')
-
-                # --- Robust Column Name Normalization and Validation ---
-                df.columns = [col.strip() for col in df.columns]
-                normalized_cols = {col.lower().replace(' ', ''): col for col in df.columns}
-
-                required_mappings = {
-                    'subject': 'Subject',
-                    'ca1': 'CA1',
-                    'ca2': 'CA2',
-                    'exam': 'Exam'
-                }
-                
-                found_columns = {}
-                missing_expected_columns = []
-
-                for normalized_expected, final_name in required_mappings.items():
-                    if normalized_expected in normalized_cols:
-                        found_columns[normalized_cols[normalized_expected]] = final_name
-                    else:
-                        missing_expected_columns.append(final_name)
-                
-                if missing_expected_columns:
-                    st.error(f"Error: The uploaded Excel file is missing one or more required columns. Please ensure you have columns like 'Subject', 'CA 1' (or 'CA1'), 'CA 2' (or 'CA2'), and 'Exam'. Missing: {missing_expected_columns}")
-                    return
-
-                # Rename columns to their standardized form
-                df.rename(columns=found_columns, inplace=True)
-                
-                # Select only the required columns for processing, in the correct order
-                df = df[list(required_mappings.values())]
-
-                # Fill empty values (NaNs) with 0 for calculations
-                df.fillna(0, inplace=True)
-
                 # Calculate grades and remarks
                 processed_df = calculate_grades(df.copy())
 
                 st.success(f"Successfully processed data for {student_name}.")
                 st.dataframe(processed_df, hide_index=True)
 
+                # Default to the session/term on the student's profile, if there is one
+                upload_profile = get_data_store(STUDENT_PROFILES_FILE).get(student_name) or {}
+                result_session, result_term = session_term_selectors("upload_results", upload_profile.get('session'), upload_profile.get('term'))
+
+                # The stored results this upload would replace, as first shown
+                existing_entry = get_results().get(student_name, result_session, result_term)
+                upload_stamp = loaded_stamp("upload_results", (student_name, result_session, result_term), existing_entry)
+
                 if st.button(f"Save Results for {student_name}"):
                     student_results = processed_df.to_dict(orient='records')
-                    
-                    existing_student_index = -1
-                    for i, entry in enumerate(st.session_state.results_data):
-                        if entry.get('student_name') == student_name:
-                            existing_student_index = i
-                            break
-
-                    if existing_student_index != -1:
-                        st.session_state.results_data[existing_student_index]['results'] = student_results
-                        st.session_state.results_data[existing_student_index]['total_score'] = processed_df['Final'].sum()
-                        st.success(f"Updated results for {student_name}!")
+
+                    if existing_entry is not None:
+                        # Build a new record rather than editing the stored one in place
+                        result_entry = dict(existing_entry, results=student_results, total_score=processed_df['Final'].sum())
                     else:
-                        new_result_entry = {
+                        result_entry = {
                             "student_name": student_name,
                             "total_score": processed_df['Final'].sum(),
                             "results": student_results
                         }
-                        st.session_state.results_data.append(new_result_entry)
-                        st.success(f"Saved new results for {student_name}!")
-
-                    # --- Automatic Student Account and Profile Creation/Update ---
-                    # 1. Ensure student account exists
-                    if not any(s['username'].lower() == student_name.lower() for s in st.session_state.students_data):
-                        max_id = 0
-                        if st.session_state.students_data:
-                            max_id = max([s.get('id', 0) for s in st.session_state.students_data])
-                        
-                        new_student_id = max_id + 1
-                        
-                        st.session_state.students_data.append({
-                            "id": new_student_id,
-                            "username": student_name,
-                            "password": "123456" # Default password
-                        })
-                        save_data(st.session_state.students_data, STUDENTS_FILE)
-                        st.info(f"Added {student_name} to student accounts with default password '123456'.")
-
-                    # 2. Ensure student profile exists (or create basic one)
-                    if not any(p['student_name'].lower() == student_name.lower() for p in st.session_state.student_profiles_data):
-                        st.session_state.student_profiles_data.append({
-                            "student_name": student_name,
-                            "age": "", "reg_number": "", "parent_name": "",
-                            "parent_phone": "", "parent_address": "",
-                            "session": "", "term": ""
-                        })
-                        st.warning(f"A basic profile for {student_name} was created. Please go to the 'Student Profiles' tab to fill in more details.")
-                        save_data(st.session_state.student_profiles_data, STUDENT_PROFILES_FILE)
 
-                    save_data(st.session_state.results_data, RESULTS_FILE)
-                    st.rerun() # Rerun to update the displayed data and tabs
+                    # Results, plus a login account and basic profile if the student has none yet,
+                    # are saved together or not at all
+                    saved = save_bulk_results([result_entry], result_session, result_term, expected={student_name: upload_stamp})
+                    forget_stamp("upload_results")
+                    if saved:
+                        st.success(f"Updated results for {student_name}!" if existing_entry is not None else f"Saved new results for {student_name}!")
+                        if saved['accounts']:
+                            st.info(f"Added {student_name} to student accounts with default password '{DEFAULT_STUDENT_PASSWORD}'.")
+                        if saved['profiles']:
+                            st.warning(f"A basic profile for {student_name} was created. Please go to the 'Student Profiles' tab to fill in more details.")
+                        st.rerun() # Rerun to update the displayed data and tabs
 
             except Exception as e:
                 st.error(f"Error processing Excel file: {e}")
@@ -483,12 +1090,20 @@ def teacher_portal():
     with tab_profiles:
         st.subheader("Manage Student Profiles")
 
-        student_names_in_profiles = [""] + [p['student_name'] for p in st.session_state.student_profiles_data]
-        selected_student_for_profile = st.selectbox("Select Student to Edit/View Profile", student_names_in_profiles, key="select_profile_student")
+        profile_query = st.text_input("Find Student", key="profile_student_search", placeholder="Name, registration number or parent's phone")
+        student_names_in_profiles = find_students(profile_query)
+        # Keep the current choice selectable while the search text changes
+        current_choice = st.session_state.get("select_profile_student")
+        if current_choice and current_choice not in student_names_in_profiles:
+            student_names_in_profiles.insert(0, current_choice)
+        if len(student_names_in_profiles) >= MAX_SELECT_OPTIONS:
+            st.caption(f"Showing the first {MAX_SELECT_OPTIONS} matches; type more of the name to narrow the list.")
+        selected_student_for_profile = st.selectbox("Select Student to Edit/View Profile", [""] + student_names_in_profiles, key="select_profile_student")
 
         current_profile = None
         if selected_student_for_profile:
-            current_profile = next((p for p in st.session_state.student_profiles_data if p['student_name'] == selected_student_for_profile), None)
+            current_profile = get_data_store(STUDENT_PROFILES_FILE).get(selected_student_for_profile)
+        profile_stamp = loaded_stamp("profile", selected_student_for_profile, current_profile)
 
         with st.form("student_profile_form", clear_on_submit=False):
             st.markdown("### Student Profile Details")
@@ -497,6 +1112,7 @@ def teacher_portal():
             default_name = ""
             default_age = 0
             default_reg_number = ""
+            default_class_name = ""
             default_parent_name = ""
             default_parent_phone = ""
             default_parent_address = ""
@@ -512,6 +1128,7 @@ def teacher_portal():
                 default_age = int(max(0, min(100, default_age))) # Ensure within min/max
 
                 default_reg_number = current_profile['reg_number']
+                default_class_name = current_profile.get('class_name', "")
                 default_parent_name = current_profile['parent_name']
                 default_parent_phone = current_profile['parent_phone']
                 default_parent_address = current_profile['parent_address']
@@ -530,6 +1147,7 @@ def teacher_portal():
             student_name_input = st.text_input("Student Name (Must match name in results file)", value=default_name, disabled=bool(selected_student_for_profile), key="profile_student_name")
             age_input = st.number_input("Age", min_value=0, max_value=100, value=default_age, key="profile_age")
             reg_number_input = st.text_input("Registration Number", value=default_reg_number, key="profile_reg_number")
+            class_name_input = st.text_input("Class (e.g. JSS 1A)", value=default_class_name, key="profile_class_name", help="Students are ranked against others in the same class, session and term.")
             parent_name_input = st.text_input("Parent/Guardian Name", value=default_parent_name, key="profile_parent_name")
             parent_phone_input = st.text_input("Parent/Guardian Phone Number", value=default_parent_phone, key="profile_parent_phone")
             parent_address_input = st.text_area("Parent/Guardian Address", value=default_parent_address, key="profile_parent_address")
@@ -556,6 +1174,7 @@ def teacher_portal():
                         "student_name": student_name_input.strip(),
                         "age": age_input,
                         "reg_number": reg_number_input.strip(),
+                        "class_name": class_name_input.strip(),
                         "parent_name": parent_name_input.strip(),
                         "parent_phone": parent_phone_input.strip(),
                         "parent_address": parent_address_input.strip(),
@@ -563,47 +1182,53 @@ def teacher_portal():
                         "term": term_select
                     }
 
-                    profile_exists_index = -1
-                    for i, p in enumerate(st.session_state.student_profiles_data):
-                        if p['student_name'].lower() == student_name_input.strip().lower():
-                            profile_exists_index = i
-                            break
-                    
+                    existing_profile = get_data_store(STUDENT_PROFILES_FILE).find_one('student_name', student_name_input)
+                    profile_saved = True
+
                     if selected_student_for_profile and current_profile: # Editing existing
-                        if profile_exists_index != -1:
-                            st.session_state.student_profiles_data[profile_exists_index] = new_profile_data
-                            st.success(f"Profile for {student_name_input} updated successfully!")
+                        if existing_profile is not None:
+                            # Refused if another teacher saved this profile after it was opened here
+                            profile_saved = save_record(new_profile_data, STUDENT_PROFILES_FILE, expected={selected_student_for_profile: profile_stamp})
+                            forget_stamp("profile")
+                            if profile_saved:
+                                st.success(f"Profile for {student_name_input} updated successfully!")
                         else: # Should not happen if `selected_student_for_profile` is set
                              st.error("Error: Could not find the selected profile to update. Please refresh.")
                     else: # Adding new profile (via this form, not auto-creation)
-                        if profile_exists_index == -1: # Ensure it doesn't exist
-                            st.session_state.student_profiles_data.append(new_profile_data)
-                            st.success(f"New profile for {student_name_input} added successfully!")
+                        similar_name = existing_student_name(student_name_input)
+                        if existing_profile is None and similar_name not in (None, student_name_input.strip()):
+                            st.warning(f"'{student_name_input}' looks like the existing student '{similar_name}'. Please select them from the dropdown instead.")
+                        elif existing_profile is None: # Ensure it doesn't exist
+                            # Refused (and nothing else created) if someone else added this student meanwhile
+                            profile_saved = save_record(new_profile_data, STUDENT_PROFILES_FILE, expected={new_profile_data['student_name']: None})
+                            if profile_saved:
+                                st.success(f"New profile for {student_name_input} added successfully!")
                             # Also ensure a basic account exists if not already
-                            if not any(s['username'].lower() == student_name_input.lower() for s in st.session_state.students_data):
+                            if profile_saved and get_data_store(STUDENTS_FILE).find_one('username', student_name_input) is None:
                                 max_id = 0
                                 if st.session_state.students_data:
                                     max_id = max([s.get('id', 0) for s in st.session_state.students_data])
                                 new_student_id = max_id + 1
-                                st.session_state.students_data.append({
+                                new_account = {
                                     "id": new_student_id,
                                     "username": student_name_input, # Corrected: use student_name_input here
-                                    "password": "123456"
-                                })
-                                save_data(st.session_state.students_data, STUDENTS_FILE)
-                                st.info(f"Added {student_name_input} to student accounts with default password '123456'.")
+                                    "password": default_password_hash(DEFAULT_STUDENT_PASSWORD)
+                                }
+                                # Stay on the page to show the error if the account can't be added
+                                profile_saved = save_record(new_account, STUDENTS_FILE, expected={student_name_input: None})
+                                if profile_saved:
+                                    st.info(f"Added {student_name_input} to student accounts with default password '{DEFAULT_STUDENT_PASSWORD}'.")
                         else:
                             st.warning(f"A profile for {student_name_input} already exists. Please select it from the dropdown to edit.")
-                    
-                    save_data(st.session_state.student_profiles_data, STUDENT_PROFILES_FILE)
-                    st.rerun()
+
+                    if profile_saved:
+                        st.rerun()
             
             if delete_profile_button_clicked: 
                 # Using st.session_state to track confirmation state
                 if st.session_state.get('confirm_delete_profile_step', False) and st.session_state.get('confirm_delete_student_name') == selected_student_for_profile:
                     # Second click confirms deletion
-                    st.session_state.student_profiles_data = [p for p in st.session_state.student_profiles_data if p['student_name'] != selected_student_for_profile]
-                    save_data(st.session_state.student_profiles_data, STUDENT_PROFILES_FILE)
+                    delete_record(selected_student_for_profile, STUDENT_PROFILES_FILE)
                     st.success(f"Profile for {selected_student_for_profile} deleted successfully.")
                     del st.session_state['confirm_delete_profile_step'] # Reset confirmation
                     del st.session_state['confirm_delete_student_name'] # Reset confirmation
@@ -619,82 +1244,111 @@ def teacher_portal():
         st.markdown("---")
         st.subheader("All Student Profiles")
         if st.session_state.student_profiles_data:
-            profiles_df = pd.DataFrame(st.session_state.student_profiles_data)
-            st.dataframe(profiles_df, hide_index=True, use_container_width=True)
+            paginated_table("profiles_table", STUDENT_PROFILES_FILE)
         else:
             st.info("No student profiles added yet.")
 
     with tab_accounts:
+        with st.expander("📥 Bulk Add Accounts: a whole intake from CSV or Excel"):
+            bulk_accounts_import()
+
         st.subheader("Registered Student Accounts")
         if st.session_state.students_data:
-            students_df = pd.DataFrame(st.session_state.students_data)
-            st.dataframe(students_df, hide_index=True)
+            # Stored passwords are hashes; there is nothing useful to show
+            paginated_table("accounts_table", STUDENTS_FILE, drop_columns=['password'])
 
             st.info("You can add/remove student login accounts here directly.")
             
             with st.form("add_student_form", clear_on_submit=True):
                 st.subheader("Add New Student Login Account")
                 new_student_username = st.text_input("New Student Username", key="new_login_username").strip()
-                new_student_password = st.text_input("New Student Password", value="123456", key="new_login_password")
+                new_student_password = st.text_input("New Student Password", value=DEFAULT_STUDENT_PASSWORD, key="new_login_password")
                 add_student_button = st.form_submit_button("Add Student Login Account")
 
                 if add_student_button:
                     if new_student_username and new_student_password:
-                        if any(s['username'].lower() == new_student_username.lower() for s in st.session_state.students_data):
+                        similar_name = existing_student_name(new_student_username)
+                        if get_data_store(STUDENTS_FILE).find_one('username', new_student_username) is not None:
                             st.error("Student with this username already exists.")
+                        elif similar_name not in (None, new_student_username):
+                            st.error(f"'{new_student_username}' looks like the existing student '{similar_name}'. Use that exact name to give them a login.")
                         else:
                             max_id = 0
                             if st.session_state.students_data:
                                 max_id = max([s.get('id', 0) for s in st.session_state.students_data])
                             new_student_id = max_id + 1
 
-                            st.session_state.students_data.append({
+                            new_account = {
                                 "id": new_student_id,
                                 "username": new_student_username,
-                                "password": new_student_password
-                            })
-                            save_data(st.session_state.students_data, STUDENTS_FILE)
-                            st.success(f"Student login account '{new_student_username}' added successfully!")
-                            # Also create a basic profile for them
-                            if not any(p['student_name'].lower() == new_student_username.lower() for p in st.session_state.student_profiles_data):
-                                st.session_state.student_profiles_data.append({
-                                    "student_name": new_student_username,
-                                    "age": "", "reg_number": "", "parent_name": "",
-                                    "parent_phone": "", "parent_address": "",
-                                    "session": "", "term": ""
-                                })
-                                save_data(st.session_state.student_profiles_data, STUDENT_PROFILES_FILE)
-                                st.info(f"A basic profile was also created for {new_student_username}. Please fill in details in the 'Student Profiles' tab.")
-
-                            st.rerun()
+                                "password": hash_password(new_student_password)
+                            }
+                            # Refused (and no profile created) if someone else added this student meanwhile
+                            account_saved = save_record(new_account, STUDENTS_FILE, expected={new_student_username: None})
+                            if account_saved:
+                                st.success(f"Student login account '{new_student_username}' added successfully!")
+                                # Also create a basic profile for them
+                                if get_data_store(STUDENT_PROFILES_FILE).find_one('student_name', new_student_username) is None:
+                                    new_profile = basic_profile(new_student_username)
+                                    account_saved = save_record(new_profile, STUDENT_PROFILES_FILE, expected={new_student_username: None})
+                                    if account_saved:
+                                        st.info(f"A basic profile was also created for {new_student_username}. Please fill in details in the 'Student Profiles' tab.")
+                            if account_saved:
+                                st.rerun()
                     else:
                         st.error("Please provide both username and password for the new student login account.")
             
+            st.subheader("Remove Student Login Account")
+            # Outside the form so the list narrows as you type
+            remove_query = st.text_input("Find Account", key="remove_login_search", placeholder="Username")
             with st.form("remove_student_form", clear_on_submit=True):
-                st.subheader("Remove Student Login Account")
-                current_student_usernames = [s['username'] for s in st.session_state.students_data if s['username'] != TEACHER_USERNAME] # Cannot remove teacher
+                current_student_usernames = matching_keys(STUDENTS_FILE, 'username', remove_query, exclude=(TEACHER_USERNAME,)) # Cannot remove teacher
                 student_to_remove = st.selectbox("Select Student Login Account to Remove", options=[""] + current_student_usernames, key="remove_login_student")
                 remove_student_button = st.form_submit_button("Remove Selected Login Account")
 
                 if remove_student_button and student_to_remove:
-                    # Remove from students_data (login accounts)
-                    st.session_state.students_data = [s for s in st.session_state.students_data if s['username'] != student_to_remove]
-                    save_data(st.session_state.students_data, STUDENTS_FILE)
-
-                    # Also remove their results and profiles to keep data clean
-                    st.session_state.results_data = [r for r in st.session_state.results_data if r['student_name'] != student_to_remove]
-                    save_data(st.session_state.results_data, RESULTS_FILE)
-
-                    st.session_state.student_profiles_data = [p for p in st.session_state.student_profiles_data if p['student_name'] != student_to_remove]
-                    save_data(st.session_state.student_profiles_data, STUDENT_PROFILES_FILE)
-
-                    st.success(f"Student '{student_to_remove}' login account, results, and profile removed successfully!")
-                    st.rerun()
+                    # Login account, results and profile go together to keep data clean
+                    if remove_student(student_to_remove):
+                        st.success(f"Student '{student_to_remove}' login account, results, and profile removed successfully!")
+                        st.rerun()
                 elif remove_student_button:
                     st.error("Please select a student login account to remove.")
+
+            st.subheader("Rename Student")
+            rename_query = st.text_input("Find Account", key="rename_login_search", placeholder="Username")
+            with st.form("rename_student_form", clear_on_submit=True):
+                rename_options = matching_keys(STUDENTS_FILE, 'username', rename_query, exclude=(TEACHER_USERNAME,))
+                student_to_rename = st.selectbox("Select Student to Rename", options=[""] + rename_options, key="rename_login_student")
+                new_name = st.text_input("New Name", key="rename_new_name").strip()
+                rename_student_button = st.form_submit_button("Rename Student")
+
+                if rename_student_button:
+                    clash = existing_student_name(new_name) if new_name else None
+                    if not student_to_rename or not new_name:
+                        st.error("Please select a student and enter the new name.")
+                    elif new_name == TEACHER_USERNAME or clash not in (None, student_to_rename):
+                        st.error(f"A student named '{clash or new_name}' already exists.")
+                    elif new_name == student_to_rename:
+                        st.info("The new name is the same as the current one.")
+                    elif rename_student(student_to_rename, new_name):
+                        st.success(f"Renamed '{student_to_rename}' to '{new_name}' in their login account, profile and results. "
+                                   f"Rename their photo to '{student_photo_file(new_name)}' if they have one.")
+                        st.rerun()
         else:
             st.info("No student accounts registered yet. They will be added when you upload results for them, or you can add them manually above.")
 
+    with tab_report_cards:
+        batch_report_cards_tab()
+
+    with tab_analytics:
+        analytics_tab()
+
+    with tab_export:
+        export_tab()
+
+    with tab_diagnostics:
+        diagnostics_tab()
+
 
 # --- Student Portal ---
 def student_portal():
@@ -705,8 +1359,9 @@ def student_portal():
     st.sidebar.markdown("---")
     st.sidebar.button("Logout", on_click=logout)
 
-    student_record = next((r for r in st.session_state.results_data if r['student_name'] == student_name), None)
-    student_profile = next((p for p in st.session_state.student_profiles_data if p['student_name'] == student_name), None)
+    # One keyed lookup per session/term, oldest first
+    student_history = get_results().history(student_name)
+    student_profile = get_data_store(STUDENT_PROFILES_FILE).get(student_name)
 
     col_profile, col_results = st.columns([1, 2])
 
@@ -721,6 +1376,7 @@ def student_portal():
             st.write(f"**Age:** {display_age}")
             
             st.write(f"**Registration No.:** {student_profile.get('reg_number', 'N/A')}")
+            st.write(f"**Class:** {student_profile.get('class_name') or 'N/A'}")
             st.write(f"**Academic Session:** {student_profile.get('session', 'N/A')}")
             st.write(f"**Academic Term:** {student_profile.get('term', 'N/A')}")
             st.write(f"**Parent/Guardian:** {student_profile.get('parent_name', 'N/A')}")
@@ -729,15 +1385,17 @@ def student_portal():
             
             image_placeholder = st.empty()
             
-            # Use relative path for deployment
-            script_dir = os.path.dirname(__file__)
-            photo_path = os.path.join(script_dir, "assets", f"{student_name} Image.png")
+            # The registry validates and downsizes the photo once, and re-checks the file only every few seconds
+            photo = asset_registry.student_photo(student_name)
+            photo_error = asset_registry.errors.get(student_photo_file(student_name))
             
-            if os.path.exists(photo_path):
+            if photo:
                 try:
-                    image_placeholder.image(photo_path, caption=f"{student_name}'s Photo", width=150)
+                    image_placeholder.image(photo.prepared_path, caption=f"{student_name}'s Photo", width=150)
                 except Exception as e:
                     image_placeholder.warning(f"Could not load photo: {e}")
+            elif photo_error:
+                image_placeholder.warning(f"Could not load photo: {photo_error}")
             else:
                 image_placeholder.info(f"No photo found for {student_name} in the 'assets' folder.")
         else:
@@ -745,22 +1403,25 @@ def student_portal():
 
     with col_results:
         st.markdown("### Your Results")
-        if student_record:
+        if student_history:
+            # Latest session/term first
+            history_labels = [partition_label(session, term) for session, term, _ in reversed(student_history)]
+            selected_label = st.selectbox("Session / Term", history_labels, key="student_result_partition")
+            result_session, result_term, student_record = list(reversed(student_history))[history_labels.index(selected_label)]
+
             results_df = pd.DataFrame(student_record['results'])
             total_score_student = results_df['Final'].sum()
 
-            all_student_totals = {r['student_name']: r['total_score'] for r in st.session_state.results_data if 'total_score' in r and isinstance(r['total_score'], (int, float))}
-            
-            sorted_students = sorted(all_student_totals.items(), key=lambda x: x[1], reverse=True)
-            
-            rank = "N/A"
-            for i, (name, score) in enumerate(sorted_students):
-                if name == student_name:
-                    rank = ordinal(i + 1)
-                    break
+            rank_index = get_rank_index(result_session, result_term)
+            rank = rank_index.position_label(student_name)
+            class_size = rank_index.class_size(student_name)
             
             st.write(f"**Total Score:** {total_score_student}")
-            st.write(f"**Rank:** {rank} Position")
+            st.write(f"**Rank:** {rank} Position" + (f" out of {class_size}" if class_size else ""))
+
+            subject_positions = rank_index.subject_positions(student_name)
+            if subject_positions:
+                results_df['Position'] = results_df['Subject'].map(lambda subject: ordinal(subject_positions[subject]) if subject in subject_positions else "N/A")
 
             st.dataframe(results_df, hide_index=True, use_container_width=True)
 
@@ -768,11 +1429,14 @@ def student_portal():
             # Ensure student_name is valid before using in f-string
             if student_name and isinstance(student_name, str):
                 try:
-                    pdf_output = generate_report_card_pdf(student_name, results_df, total_score_student, rank, student_profile)
+                    # Served from the rendered-card cache unless something on the card has changed
+                    card_profile = report_card_profile(student_profile, result_session, result_term)
+                    pdf_output = report_card_cache.get_or_render(student_name, report_card_results(student_record['results'], rank_index, student_name),
+                                                                 total_score_student, rank, card_profile, report_card_layout(student_profile))
                     st.download_button(
                         label="Download as PDF",
-                        data=pdf_output.output(dest='S'), 
-                        file_name=f"{student_name}_Report_Card.pdf", # Line 773 (or close to it)
+                        data=pdf_output, 
+                        file_name=report_card_filename(student_name, result_session, result_term),
                         mime="application/pdf"
                     )
                 except Exception as e:
@@ -782,175 +1446,38 @@ def student_portal():
             else:
                 st.warning("Cannot generate PDF: Student name is not available or is invalid.")
 
+            # With more than one term in the session, offer every term on one card
+            session_terms = [(term, [record]) for session, term, record in student_history if session == result_session]
+            if len(session_terms) > 1:
+                try:
+                    cumulative_record = cumulative_records(result_session, session_terms)[0]
+                    cumulative_rank = get_cumulative_rank_index(result_session).position_label(student_name)
+                    cumulative_pdf = report_card_cache.get_or_render(student_name, cumulative_record['results'], cumulative_record['total_score'],
+                                                                     cumulative_rank, report_card_profile(student_profile, result_session, CUMULATIVE_TERM),
+                                                                     report_card_layout(student_profile))
+                    st.download_button(
+                        label=f"Download {result_session} Cumulative Report (all terms)",
+                        data=cumulative_pdf,
+                        file_name=report_card_filename(student_name, result_session, CUMULATIVE_TERM),
+                        mime="application/pdf",
+                        key="download_cumulative_report"
+                    )
+                except Exception as e:
+                    st.error(f"Error generating cumulative report card: {e}")
+
+            if len(student_history) > 1:
+                st.subheader("Your Results History")
+                st.dataframe(pd.DataFrame([{
+                    "Session": session,
+                    "Term": term,
+                    "Total Score": record.get('total_score'),
+                    "Position": get_rank_index(session, term).position_label(student_name),
+                } for session, term, record in student_history]), hide_index=True, use_container_width=True)
 
         else:
             st.info("No report card data available for you yet. Please check back later.")
 
 
-# --- PDF Generation (Adapted from SR0-4.18.py) ---
-class PDF(FPDF):
-    def header(self):
-        # Use a path relative to the script's directory for deployment
-        script_dir = os.path.dirname(__file__)
-        logo_path = os.path.join(script_dir, "assets", "ICY.png")
-        if os.path.exists(logo_path):
-            try:
-                self.image(logo_path, x=10, y=8, w=25)
-            except Exception as e:
-                print(f"Warning: Could not load logo image for PDF at {logo_path}: {e}") # For debugging in console
-        
-        self.set_font("Arial", "B", 14)
-        self.cell(0, 10, "IGBOBI COLLEGE YABA", ln=True, align="C")
-        self.set_font("Arial", "", 12)
-        self.cell(0, 10, "Igobobi College Road, Fadeyi, Lagos", ln=True, align="C")
-        self.ln(5)
-
-    def footer(self):
-        self.set_y(-15)
-        self.set_font("Arial", "I", 8)
-        self.cell(0, 10, f"Page {self.page_no()}/{{nb}}", align="C")
-
-def generate_report_card_pdf(student_name, results_df, total_score, rank, student_profile=None):
-    pdf = PDF()
-    pdf.alias_nb_pages()
-    pdf.add_page()
-
-    # Get the directory of the current script for relative paths
-    script_dir = os.path.dirname(__file__) 
-
-    # Student Photo Path
-    photo_path = os.path.join(script_dir, "assets", f"{student_name} Image.png")
-    if os.path.exists(photo_path):
-        try:
-            pdf.image(photo_path, x=170, y=8, w=25)
-        except Exception as e:
-            print(f"Warning: Could not embed student photo in PDF at {photo_path}: {e}") # For debugging in console
-            pass # Suppress warning in PDF generation if image fails
-
-    pdf.set_font("Arial", "B", 12)
-    pdf.cell(40, 10, f"Student Name: {student_name}", ln=True)
-    
-    # Add profile details to PDF
-    pdf.set_font("Arial", "", 11)
-    if student_profile:
-        # Safely display age in PDF
-        display_age = student_profile.get('age', 'N/A')
-        if display_age == "" or display_age is None:
-            display_age = "N/A"
-        pdf.cell(0, 7, f"Age: {display_age}", ln=True)
-        
-        pdf.cell(0, 7, f"Registration No.: {student_profile.get('reg_number', 'N/A')}", ln=True)
-        pdf.cell(0, 7, f"Academic Session: {student_profile.get('session', 'N/A')}", ln=True)
-        pdf.cell(0, 7, f"Academic Term: {student_profile.get('term', 'N/A')}", ln=True)
-        pdf.cell(0, 7, f"Parent/Guardian: {student_profile.get('parent_name', 'N/A')}", ln=True)
-        pdf.cell(0, 7, f"Parent Phone: {student_profile.get('parent_phone', 'N/A')}", ln=True)
-        pdf.cell(0, 7, f"Parent Address: {student_profile.get('parent_address', 'N/A')}", ln=True)
-    else:
-        pdf.cell(0, 7, "Profile Details: Not available", ln=True)
-        
-    pdf.ln(3) # Small line break
-
-    pdf.set_font("Arial", "B", 11)
-    pdf.cell(40, 10, f"Total Score: {total_score}", ln=True)
-    pdf.cell(40, 10, f"Rank: {rank} Position", ln=True)
-    pdf.ln(5)
-
-    headers = results_df.columns.tolist()
-    
-    # Calculate column widths more dynamically, with a minimum size
-    col_widths = []
-    for header in headers:
-        text_width = pdf.get_string_width(str(header))
-        col_widths.append(max(20, text_width + 10)) # Minimum 20 units, plus padding
-
-    # Adjust if total width exceeds page width
-    total_table_width = sum(col_widths)
-    page_usable_width = pdf.w - pdf.l_margin - pdf.r_margin # Page width minus left/right margins
-    if total_table_width > page_usable_width:
-        scale_factor = page_usable_width / total_table_width
-        col_widths = [w * scale_factor for w in col_widths]
-
-
-    pdf.set_font("Arial", "B", 10)
-    for i, header in enumerate(headers):
-        pdf.cell(col_widths[i], 10, str(header), border=1, align="C")
-    pdf.ln()
-
-    pdf.set_font("Arial", "", 10)
-    for _, row in results_df.iterrows():
-        for i, val in enumerate(row.tolist()):
-            # Handle long text in cells if necessary, or just let fpdf truncate/wrap
-            pdf.cell(col_widths[i], 10, str(val), border=1, align="C")
-        pdf.ln()
-    
-    # --- Digital Signatures ---
-    pdf.ln(15) # Add some space after the table
-
-    signature_y_pos = pdf.get_y() # Get current Y position
-
-    # Define signature image paths using relative path
-    class_teacher_sig_path = os.path.join(script_dir, "assets", "class_teacher_signature.png")
-    hod_sig_path = os.path.join(script_dir, "assets", "hod_signature.png")
-    principal_sig_path = os.path.join(script_dir, "assets", "principal_signature.png")
-
-    # Signature image dimensions (adjust as needed)
-    sig_img_width = 30
-    sig_img_height = 15
-
-    # Signature text spacing
-    sig_text_ln = 5 # Line height for text below signature
-
-    # Calculate x positions for three signatures to be evenly spaced
-    # Assuming standard A4 (210mm wide), and margins of 10mm on each side (total 190mm usable width)
-    # This places them roughly centered and spread out
-    x1 = 20 # Left signature
-    x2 = pdf.w / 2 - (sig_img_width / 2) # Center signature
-    x3 = pdf.w - sig_img_width - 20 # Right signature
-
-    # Class Teacher Signature
-    pdf.set_x(x1)
-    if os.path.exists(class_teacher_sig_path):
-        try:
-            pdf.image(class_teacher_sig_path, x=x1, y=signature_y_pos, w=sig_img_width, h=sig_img_height)
-        except Exception as e:
-            print(f"Warning: Could not embed Class Teacher signature from {class_teacher_sig_path}: {e}")
-    pdf.set_y(signature_y_pos + sig_img_height + 2) # Move y down for text
-    pdf.set_x(x1)
-    pdf.set_font("Arial", "B", 9)
-    pdf.cell(sig_img_width, sig_text_ln, "Class Teacher", 0, 0, 'C') # Text below signature
-
-
-    # HOD Signature
-    pdf.set_y(signature_y_pos) # Reset y for next signature
-    pdf.set_x(x2)
-    if os.path.exists(hod_sig_path):
-        try:
-            pdf.image(hod_sig_path, x=x2, y=signature_y_pos, w=sig_img_width, h=sig_img_height)
-        except Exception as e:
-            print(f"Warning: Could not embed HOD signature from {hod_sig_path}: {e}")
-    pdf.set_y(signature_y_pos + sig_img_height + 2)
-    pdf.set_x(x2)
-    pdf.set_font("Arial", "B", 9)
-    pdf.cell(sig_img_width, sig_text_ln, "HOD", 0, 0, 'C')
-
-
-    # Principal Signature
-    pdf.set_y(signature_y_pos) # Reset y for next signature
-    pdf.set_x(x3)
-    if os.path.exists(principal_sig_path):
-        try:
-            pdf.image(principal_sig_path, x=x3, y=signature_y_pos, w=sig_img_width, h=sig_img_height)
-        except Exception as e:
-            print(f"Warning: Could not embed Principal signature from {principal_sig_path}: {e}")
-    pdf.set_y(signature_y_pos + sig_img_height + 2)
-    pdf.set_x(x3)
-    pdf.set_font("Arial", "B", 9)
-    pdf.cell(sig_img_width, sig_text_ln, "Principal", 0, 1, 'C') # ln=1 to move to next line after last signature
-
-    
-    return pdf
-
-
 # --- Main Application Logic ---
 def main():
     st.set_page_config(
@@ -959,6 +1486,21 @@ def main():
         initial_sidebar_state="expanded"
     )
 
+    # A teacher can have one page load profiled (see diagnostics_tab)
+    profile_this_rerun = st.session_state.pop('profile_next_rerun', False)
+    try:
+        with metrics.span("portal.rerun"), (capture_profile() if profile_this_rerun else contextlib.nullcontext()) as capture:
+            render_page()
+    finally:
+        # st.rerun() ends a page load with an exception, so this runs in `finally`
+        if profile_this_rerun:
+            st.session_state.last_profile = {"text": capture.text, "captured": datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+        try:
+            metrics.write(DATA_DIR, min_interval_seconds=METRICS_WRITE_INTERVAL_SECONDS)
+        except OSError as e:
+            print(f"Warning: Could not write metrics files to {DATA_DIR}: {e}") # For debugging in console
+
+def render_page():
     apply_custom_css()
     initialize_session_state()
 
@@ -0,0 +1,13 @@
+import pandas as pd
+
+from account_import import plan_account_import
+from storage import record_stamp
+
+
+def test_plan_records_stamps_of_the_profiles_it_updates():
+    existing = {"Ada": {"student_name": "Ada", "reg_number": "R1", "class_name": "JSS1"}}
+    frame = pd.DataFrame([{"username": "Ada", "class_name": "JSS2"}, {"username": "Bayo", "class_name": ""}])
+    plan = plan_account_import(frame, set(), 1, existing)
+
+    assert plan["profile_stamps"] == {"Ada": record_stamp(existing["Ada"]), "Bayo": None}
+    assert plan["profiles"][0] == {"student_name": "Ada", "reg_number": "R1", "class_name": "JSS2"}
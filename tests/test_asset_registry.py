@@ -0,0 +1,92 @@
+import os
+import threading
+
+from PIL import Image
+
+import asset_registry
+from asset_registry import AssetRegistry
+from report_pdf import PDF, pdf_bytes
+
+
+def make_registry(tmp_path, *names):
+    assets = tmp_path / "assets"
+    assets.mkdir()
+    for name in names:
+        Image.new("RGBA", (40, 20), (255, 0, 0, 128)).save(assets / name)
+    return AssetRegistry(str(assets), str(tmp_path / "prepared"))
+
+
+def test_images_are_loaded_once_and_missing_ones_are_none(tmp_path):
+    registry = make_registry(tmp_path, "crest.png")
+    asset = registry.get("crest.png")
+    assert registry.get("crest.png") is asset
+    assert (asset.width, asset.height) == (40, 20)
+    assert registry.get("missing.png") is None
+    assert registry.stats()["loads"] == 1
+
+
+def test_slow_image_does_not_hold_up_others(tmp_path, monkeypatch):
+    registry = make_registry(tmp_path, "slow.png", "crest.png")
+    started, release = threading.Event(), threading.Event()
+    prepare = asset_registry._prepare_image
+
+    def slow_prepare(source_path, prepared_base, kind):
+        if source_path.endswith("slow.png"):
+            started.set()
+            release.wait(5)
+        return prepare(source_path, prepared_base, kind)
+    monkeypatch.setattr(asset_registry, "_prepare_image", slow_prepare)
+
+    loader = threading.Thread(target=registry.get, args=("slow.png",))
+    loader.start()
+    assert started.wait(5)
+    try:
+        assert registry.get("crest.png") is not None # Would block until release if loads held the registry lock
+        assert "slow.png" not in registry._assets
+    finally:
+        release.set()
+        loader.join()
+    assert registry.get("slow.png") is not None
+
+
+def test_unknown_fpdf_versions_place_the_prepared_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(asset_registry, "PRIVATE_PARSERS", False)
+    registry = make_registry(tmp_path, "crest.png")
+    asset = registry.get("crest.png")
+    assert asset.pdf_info is None
+
+    pdf = PDF()
+    pdf.add_page()
+    pdf.asset_image(asset, x=10, y=10, w=25)
+    assert pdf_bytes(pdf).startswith(b"%PDF")
+
+
+def test_failed_load_is_retried_without_the_file_changing(tmp_path, monkeypatch):
+    registry = make_registry(tmp_path, "crest.png")
+    prepare = asset_registry._prepare_image
+    calls = []
+
+    def flaky_prepare(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise OSError("image file is truncated")
+        return prepare(*args)
+    monkeypatch.setattr(asset_registry, "_prepare_image", flaky_prepare)
+
+    assert registry.get("crest.png") is None
+    assert registry.stats()["errors"] == {"crest.png": "image file is truncated"}
+    monkeypatch.setattr(asset_registry, "RELOAD_CHECK_SECONDS", 0)
+    assert registry.get("crest.png") is not None
+    assert registry.stats()["errors"] == {}
+
+
+def test_replaced_image_removes_its_old_prepared_copy(tmp_path, monkeypatch):
+    monkeypatch.setattr(asset_registry, "RELOAD_CHECK_SECONDS", 0)
+    registry = make_registry(tmp_path, "crest.png")
+    old = registry.get("crest.png")
+    Image.new("RGB", (60, 30), (0, 0, 255)).save(tmp_path / "assets" / "crest.png")
+
+    new = registry.get("crest.png")
+    assert new.prepared_path != old.prepared_path
+    # Only the current copy is left: no old version, no temporary files
+    assert sorted(os.listdir(tmp_path / "prepared")) == [os.path.basename(new.prepared_path)]
@@ -0,0 +1,27 @@
+import auth
+from auth import hash_password, verify_password
+
+
+def count_hashes(monkeypatch):
+    calls = []
+    real_scrypt = auth._scrypt
+
+    def scrypt(*args):
+        calls.append(args)
+        return real_scrypt(*args)
+    monkeypatch.setattr(auth, "_scrypt", scrypt)
+    return calls
+
+
+def test_missing_credential_costs_one_hash_and_never_matches(monkeypatch):
+    calls = count_hashes(monkeypatch)
+    assert verify_password("123456", None) == (False, False)
+    assert verify_password("", "") == (False, False)
+    assert len(calls) == 2
+
+
+def test_hashed_and_plain_passwords():
+    stored = hash_password("s3cret")
+    assert verify_password("s3cret", stored) == (True, False)
+    assert verify_password("wrong", stored) == (False, False)
+    assert verify_password("123456", "123456") == (True, True)
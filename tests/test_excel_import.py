@@ -0,0 +1,59 @@
+import openpyxl
+
+from excel_import import import_result_workbooks
+
+HEADER = ["Student Name", "Math CA1", "Math CA2", "Math Exam", "English CA1", "English CA2", "English Exam"]
+
+
+def write_workbook(path, sheets):
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for title, rows in sheets.items():
+        sheet = workbook.create_sheet(title)
+        for row in [HEADER] + rows:
+            sheet.append(row)
+    workbook.save(path)
+    return str(path)
+
+
+def scores(entry):
+    return {row['Subject']: (row['CA1'], row['CA2'], row['Exam']) for row in entry['results']}
+
+
+def test_student_twice_in_a_sheet_keeps_last_row_and_is_reported(tmp_path):
+    path = write_workbook(tmp_path / "jss1.xlsx", {"JSS1": [
+        ["Ada", 10, 10, 50, 5, 5, 40],
+        ["Bayo", 8, 9, 45, 7, 7, 30],
+        ["ada ", 12, 12, 60, 6, 6, 41],
+    ]})
+    batch = import_result_workbooks([("jss1.xlsx", path)])
+
+    entries = {entry['student_name']: entry for entry in batch['entries']}
+    assert set(entries) == {"Ada", "Bayo"}
+    assert scores(entries["Ada"]) == {"Math": (12, 12, 60), "English": (6, 6, 41)}
+    assert [(e['source'], e['student_name'], e['error']) for e in batch['errors']] == [
+        ("jss1.xlsx / JSS1", "Ada", "Found on rows 2, 4 of this sheet; using row 4.")]
+
+
+def test_student_in_two_sheets_uses_the_later_sheet(tmp_path):
+    path = write_workbook(tmp_path / "classes.xlsx", {
+        "A": [["Ada", 10, 10, 50, 5, 5, 40], ["Bayo", 8, 9, 45, 7, 7, 30]],
+        "B": [["ADA", 1, 1, 1, 1, 1, 1], ["Chidi", 8, 9, 45, 7, 7, 30]],
+    })
+    batch = import_result_workbooks([("classes.xlsx", path)])
+
+    entries = {entry['student_name']: entry for entry in batch['entries']}
+    assert set(entries) == {"Ada", "Bayo", "Chidi"}
+    assert scores(entries["Ada"]) == {"Math": (1, 1, 1), "English": (1, 1, 1)}
+    assert len(entries["Ada"]['results']) == 2
+    assert [e['error'] for e in batch['errors']] == ["Found in 2 sheets; using classes.xlsx / B."]
+
+
+def test_csv_is_read_as_a_class_sheet(tmp_path):
+    path = tmp_path / "jss2.csv"
+    path.write_text(",".join(HEADER) + "\nAda,10,10,50,5,5,40\n")
+    batch = import_result_workbooks([("jss2.csv", str(path))])
+
+    assert batch['errors'] == []
+    assert [entry['student_name'] for entry in batch['entries']] == ["Ada"]
+    assert scores(batch['entries'][0]) == {"Math": (10, 10, 50), "English": (5, 5, 40)}
@@ -0,0 +1,17 @@
+from pagination import RecordIndexCache
+
+
+def test_cache_loads_records_only_to_rebuild():
+    loads = []
+
+    def load():
+        loads.append(1)
+        return [{"student_name": "Ada Obi"}, {"student_name": "Bayo Musa"}]
+
+    cache = RecordIndexCache()
+    index = cache.get("profiles", 1, load, ["student_name"])
+    assert cache.get("profiles", 1, load, ["student_name"]) is index
+    assert len(loads) == 1
+    assert [index.records[p]["student_name"] for p in index.select("bay")] == ["Bayo Musa"]
+    cache.get("profiles", 2, load, ["student_name"])
+    assert len(loads) == 2
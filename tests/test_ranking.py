@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+from ranking import RankIndexCache, ScopeStampCache, build_rank_index, profile_scope_stamp
+
+
+def record(name, total, class_name="JSS1", scores=None):
+    return {
+        "student_name": name,
+        "total_score": total,
+        "class_name": class_name,
+        "session": "2024/2025",
+        "term": "First Term",
+        "results": [{"Subject": subject, "Final": final} for subject, final in (scores or {}).items()],
+    }
+
+
+def test_numpy_integer_totals_are_ranked():
+    # total_score as it comes from a DataFrame column's sum()
+    total = pd.Series([20, 25]).sum()
+    assert isinstance(total, np.integer)
+    index = build_rank_index([record("Ada", total), record("Bala", np.float64(80.5)), record("Chi", 60)])
+
+    assert index.position("Bala") == 1
+    assert index.position("Chi") == 2
+    assert index.position_label("Ada") == "3rd"
+    assert index.class_size("Ada") == 3
+
+
+def test_equal_totals_share_a_position_and_skip_the_next():
+    index = build_rank_index([record("A", 90), record("B", 80), record("C", 80), record("D", 70)])
+    assert [index.position(n) for n in "ABCD"] == [1, 2, 2, 4]
+
+
+def test_students_are_ranked_within_their_class():
+    index = build_rank_index([record("A", 50, "JSS1"), record("B", 90, "JSS2"), record("C", 60, "JSS1")])
+    assert index.position("C") == 1
+    assert index.position("A") == 2
+    assert index.position("B") == 1
+
+
+def test_non_numeric_and_boolean_totals_are_not_ranked():
+    index = build_rank_index([record("A", "n/a"), record("B", True), record("C", None), record("D", 10)])
+    assert index.position("A") is None
+    assert index.position("B") is None
+    assert index.position("C") is None
+    assert index.position("D") == 1
+
+
+def test_subject_positions_and_class_averages():
+    index = build_rank_index([
+        record("A", 150, scores={"Maths": np.int64(80), "English": 70}),
+        record("B", 150, scores={"Maths": 60, "English": 90}),
+    ])
+    assert index.subject_positions("A") == {"Maths": 1, "English": 2}
+    assert index.subject_averages("B") == {"Maths": 70.0, "English": 80.0}
+
+
+def test_cache_loads_results_only_to_rebuild():
+    loads = []
+
+    def load():
+        loads.append(1)
+        return [{"student_name": "Ada", "total_score": 70}]
+
+    cache = RankIndexCache()
+    first = cache.get(("2024/2025", "First Term"), 1, load)
+    assert cache.get(("2024/2025", "First Term"), 1, load) is first
+    assert len(loads) == 1
+    assert cache.get(("2024/2025", "First Term"), 2, load).position("Ada") == 1
+    assert len(loads) == 2
+
+
+def test_scope_stamp_follows_only_the_profiles_results_fall_back_on():
+    results = [record("Ada", 70, class_name=""), record("Bala", 60)]
+    profiles = {"Ada": {"class_name": "JSS1"}, "Bala": {"class_name": "JSS1"}, "Chi": {"class_name": "JSS1"}}
+    stamp = profile_scope_stamp(results, profiles)
+
+    # Bala's result names its class and Chi has no result, so neither profile matters
+    unrelated = dict(profiles, Bala={"class_name": "JSS3"}, Chi={"class_name": "JSS2"})
+    assert profile_scope_stamp(results, unrelated) == stamp
+    moved = dict(profiles, Ada={"class_name": "JSS2"})
+    assert profile_scope_stamp(results, moved) != stamp
+
+
+def test_scope_stamp_cache_recomputes_only_when_versions_change():
+    loads = []
+
+    def load():
+        loads.append(1)
+        return [record("Ada", 70, class_name="")]
+
+    cache = ScopeStampCache()
+    first = cache.get(("2024/2025", "First Term"), (1, 1), load, {"Ada": {"class_name": "JSS1"}})
+    assert cache.get(("2024/2025", "First Term"), (1, 1), load, {"Ada": {"class_name": "JSS2"}}) == first
+    assert len(loads) == 1
+    assert cache.get(("2024/2025", "First Term"), (1, 2), load, {"Ada": {"class_name": "JSS2"}}) != first
+    assert len(loads) == 2
@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import report_card_cli
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_cumulative_render_rejects_a_term(capsys, monkeypatch, tmp_path):
+    monkeypatch.setenv("REPORT_CARD_DATA_DIR", str(tmp_path)) # Restored afterwards, whatever main sets
+    with pytest.raises(SystemExit) as exit_info:
+        report_card_cli.main(["--data-dir", str(tmp_path), "render", "--session", "2024/2025", "--term", "First Term", "--cumulative", "--output", "cards.zip"])
+    assert exit_info.value.code == 2
+    assert "--cumulative" in capsys.readouterr().err
+
+
+def test_closed_pipe_exits_quietly(tmp_path):
+    # A ranks command whose output outgrows the pipe, read by something that stops after one line
+    script = ("import sys, report_card_cli\n"
+              "def ranks_command(args):\n"
+              "    for n in range(200000):\n"
+              "        print(f'2024/2025,First Term,JSS1,Student {n},70,{n},200000')\n"
+              "    return 0\n"
+              "report_card_cli.ranks_command = ranks_command\n"
+              "sys.exit(report_card_cli.main(sys.argv[1:]))\n")
+    process = subprocess.Popen([sys.executable, "-c", script, "--data-dir", str(tmp_path), "ranks"], cwd=REPO,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process.stdout.readline()
+    process.stdout.close()
+    errors = process.stderr.read()
+    process.wait(30)
+    assert errors == b""
+
+
+def test_import_rejects_a_session_or_term_the_portal_does_not_offer(capsys, monkeypatch, tmp_path):
+    monkeypatch.setenv("REPORT_CARD_DATA_DIR", str(tmp_path))
+    monkeypatch.setenv("REPORT_CARD_STORAGE", "json")
+    for session, term in (("2024-25", "First Term"), ("2024/2025", "first term")):
+        with pytest.raises(SystemExit) as exit_info:
+            report_card_cli.main(["--data-dir", str(tmp_path), "import", str(tmp_path), "--session", session, "--term", term])
+        assert exit_info.value.code == 2
+        assert "invalid choice" in capsys.readouterr().err
+
+
+def test_import_with_render_still_fails_on_rows_it_could_not_import(tmp_path):
+    good = tmp_path / "jss1.csv"
+    good.write_text("Student Name,Math CA1,Math CA2,Math Exam\nAda,10,10,50\n")
+    (tmp_path / "broken.xlsx").write_bytes(b"not a workbook")
+    output = tmp_path / "cards.zip"
+    process = subprocess.run([sys.executable, "report_card_cli.py", "--data-dir", str(tmp_path / "data"), "import",
+                              str(good), str(tmp_path / "broken.xlsx"), "--session", "2024/2025", "--term", "First Term",
+                              "--render", str(output)], cwd=REPO, capture_output=True, timeout=120)
+    assert process.returncode == 1, process.stderr
+    assert output.exists()
+    assert b"broken.xlsx" in process.stderr
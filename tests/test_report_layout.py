@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+from report_layout import LayoutRegistry, compile_layout, default_plan
+
+
+@pytest.mark.parametrize("template", [
+    {"signatures": None},
+    {"header": 5},
+    {"profile_fields": {"label": "Age"}},
+    {"header": [{"text": "School", "size": None}]},
+    {"logo": 3},
+    {"photo": "yes"},
+    {"footer": None},
+])
+def test_wrongly_typed_templates_are_invalid(template):
+    with pytest.raises(ValueError):
+        compile_layout(template)
+
+
+def test_class_layout_with_null_signatures_falls_back_to_the_school(tmp_path):
+    (tmp_path / "default.json").write_text(json.dumps({"footer": "School card {page}"}))
+    (tmp_path / "jss1_a.json").write_text(json.dumps({"signatures": None}))
+    registry = LayoutRegistry(str(tmp_path))
+
+    plan = registry.layout("JSS1 A")
+    assert plan.footer == "School card {page}"
+    assert plan.signatures == compile_layout({"footer": "School card {page}"}).signatures
+    assert "jss1_a" in registry.errors
+    assert registry.layout(None).footer == "School card {page}"
+    assert default_plan.footer == "Page {page}/{pages}"
@@ -0,0 +1,68 @@
+import io
+import re
+import zlib
+
+import report_pdf
+from report_layout import compile_layout
+from report_pdf import ReportCardCache, render_report_cards_merged
+
+
+def page_texts(data):
+    """The text drawn on each page of an fpdf document, in page order."""
+    pages = []
+    for stream in re.findall(rb"stream\n(.*?)\nendstream", data, re.S):
+        try:
+            content = zlib.decompress(stream)
+        except zlib.error:
+            continue # Not a compressed page, e.g. an image
+        if b" Tj" in content:
+            pages.append(b" ".join(re.findall(rb"\((.*?)\) Tj", content)).decode('latin-1'))
+    return pages
+
+
+def plain_layout(footer):
+    return compile_layout({"logo": None, "photo": False, "signatures": [], "footer": footer})
+
+
+def job(name, layout):
+    return {"student_name": name, "results": [{"Subject": "Maths", "CA1": 10, "CA2": 10, "Exam": 50, "Final": 70}],
+            "total_score": 70, "rank": "1st", "profile": None, "layout": layout}
+
+
+def test_merged_cards_keep_their_own_footers():
+    output = io.BytesIO()
+    render_report_cards_merged([job("Ada", plain_layout("JSS1 footer {page}")), job("Bayo", plain_layout("SS2 footer {page}")),
+                                job("Chidi", plain_layout("JSS1 footer {page}"))], output)
+
+    pages = page_texts(output.getvalue())
+    assert len(pages) == 3
+    for page, (name, footer) in zip(pages, [("Ada", "JSS1 footer 1"), ("Bayo", "SS2 footer 2"), ("Chidi", "JSS1 footer 3")]):
+        assert f"Student Name: {name}" in page
+        assert footer in page
+        assert page.count("footer") == 1
+
+
+def test_invalidate_drops_only_the_named_students_cards(monkeypatch):
+    monkeypatch.setattr(report_pdf, "generate_report_card_pdf", lambda name, *args: name)
+    monkeypatch.setattr(report_pdf, "pdf_bytes", lambda name: f"%PDF {name}".encode())
+    cache = ReportCardCache(max_bytes=100)
+    for name in ["Ada", "Bayo", "Chidi"]:
+        for rank in ["1st", "2nd"]:
+            cache.get_or_render(name, [], 70, rank)
+    assert cache.stats()["entries"] == 6
+
+    cache.invalidate_many(["Ada", "Chidi", "Nobody"])
+    assert cache.stats()["entries"] == 2
+    cache.get_or_render("Bayo", [], 70, "1st")
+    assert cache.stats()["hits"] == 1
+
+    cache.invalidate("Bayo")
+    assert cache.stats() == {"hits": 1, "misses": 6, "entries": 0, "bytes": 0}
+
+
+def test_evicted_cards_leave_the_student_index():
+    cache = ReportCardCache(max_bytes=10)
+    cache._store("k1", "Ada", b"12345")
+    cache._store("k2", "Bayo", b"12345")
+    cache._store("k3", "Bayo", b"12345")
+    assert cache._keys_by_student == {"Bayo": {"k2", "k3"}}
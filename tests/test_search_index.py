@@ -0,0 +1,24 @@
+from search_index import StudentSearchIndex, name_key
+
+
+def test_name_key_ignores_case_accents_and_punctuation_only():
+    assert name_key("Adams ") == name_key("adams") == name_key("ADAMS.") == "adams"
+    assert name_key(" Adébáyọ  O.") == "adebayo o"
+    assert name_key("Adam S.") != name_key("Adams")
+
+
+def test_names_without_latin_letters_keep_distinct_keys():
+    assert name_key("محمد") != name_key("علي")
+    assert name_key("李 伟") == "李 伟"
+    assert name_key("???") != name_key("!!!")
+    assert name_key("???") and name_key("!!!")
+    assert name_key(None) == ""
+
+
+def test_find_existing_and_search():
+    index = StudentSearchIndex(accounts=[{"username": "Adams"}, {"username": "محمد"}])
+    assert index.find_existing("adams ") == "Adams"
+    assert index.find_existing("Adam S.") is None
+    assert index.find_existing("علي") is None
+    assert index.find_existing("محمد") == "محمد"
+    assert index.search("Adam S.")[0][0] == "Adams"
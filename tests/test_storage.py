@@ -0,0 +1,105 @@
+import json
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from storage import ConflictError, RecordStore, SharedDataCache, SQLiteRecordStore, record_stamp
+
+
+def numpy_record():
+    scores = pd.DataFrame({"Subject": ["Maths", "English"], "Final": [70, 85]})
+    return {
+        "student_name": "Ada",
+        "total_score": scores["Final"].sum(),                       # np.int64
+        "average": np.float64(77.5),
+        "passed": np.bool_(True),
+        "results": scores.to_dict('records'),
+    }
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def make_store(request, tmp_path):
+    def make():
+        if request.param == "sqlite":
+            return SQLiteRecordStore(str(tmp_path / "portal.db"), "results", "student_name", ["student_name"])
+        return RecordStore(str(tmp_path / "results.json"), "student_name", ["student_name"])
+    return make
+
+
+def test_saved_record_reads_back_as_plain_json_types(make_store):
+    store = make_store()
+    record = numpy_record()
+    store.upsert(record)
+
+    in_process = store.get("Ada")
+    reloaded = make_store().get("Ada")
+    assert in_process == reloaded
+    assert type(in_process["total_score"]) is int
+    assert type(in_process["average"]) is float
+    assert type(in_process["passed"]) is bool
+    assert type(in_process["results"][0]["Final"]) is int
+    assert json.loads(json.dumps(in_process)) == in_process
+
+
+def test_stored_record_is_not_shared_with_the_caller(make_store):
+    store = make_store()
+    record = {"student_name": "Ada", "results": [{"Subject": "Maths", "Final": 70}]}
+    store.upsert(record)
+    record["results"][0]["Final"] = 0
+    record["results"].append({"Subject": "Art", "Final": 1})
+    assert store.get("Ada")["results"] == [{"Subject": "Maths", "Final": 70}]
+
+
+def test_stamp_is_the_same_before_and_after_a_reload(make_store):
+    store = make_store()
+    store.upsert(numpy_record())
+    assert record_stamp(store.get("Ada")) == record_stamp(make_store().get("Ada"))
+
+
+def test_conflicting_save_writes_nothing(make_store):
+    store = make_store()
+    store.upsert({"student_name": "Ada", "v": 1})
+    stale = record_stamp(store.get("Ada"))
+    make_store().upsert({"student_name": "Ada", "v": 2})
+    with pytest.raises(ConflictError):
+        store.upsert({"student_name": "Ada", "v": 3}, expected={"Ada": stale})
+    assert make_store().get("Ada")["v"] == 2
+
+
+def test_compaction_keeps_every_record(tmp_path):
+    path = str(tmp_path / "students.json")
+    store = RecordStore(path, "username", compact_min_entries=5)
+    for n in range(20):
+        store.upsert({"username": f"user{n}", "n": n})
+    store.delete("user3")
+    assert os.path.getsize(path) > 0
+    reloaded = RecordStore(path, "username")
+    assert len(reloaded) == 19
+    assert reloaded.get("user19") == {"username": "user19", "n": 19}
+    assert reloaded.get("user3") is None
+
+
+def test_shared_view_is_read_only_all_the_way_down(make_store):
+    store = make_store()
+    store.upsert(numpy_record())
+    cache = SharedDataCache()
+
+    view = cache.view(store)
+    assert cache.view(store) is view
+    record = view[0]
+    with pytest.raises(TypeError):
+        record["total_score"] = 0
+    with pytest.raises(TypeError):
+        record["results"][0]["Final"] = 0
+    with pytest.raises(AttributeError):
+        record["results"].append({})
+    # Subject rows can still go into render jobs and cache keys
+    assert pickle.loads(pickle.dumps(record["results"]))[0] == {"Subject": "Maths", "Final": 70}
+    assert json.loads(json.dumps(record["results"])) == [{"Subject": "Maths", "Final": 70}, {"Subject": "English", "Final": 85}]
+
+    store.upsert(dict(numpy_record(), student_name="Bayo"))
+    assert len(cache.view(store)) == 2
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+import storage
+from storage import UnitOfWork, get_store, recover_transactions
+
+
+@pytest.fixture
+def stores(tmp_path):
+    accounts = get_store(str(tmp_path / "students.json"), "username")
+    profiles = get_store(str(tmp_path / "student_profiles.json"), "student_name")
+    return accounts, profiles, str(tmp_path / "journal")
+
+
+def crash_before_journal_removed(monkeypatch, after_batches):
+    """Makes the next commit die once `after_batches` of its batches are applied, leaving its journal behind."""
+    applied = []
+    real_apply = {cls: cls.apply_batch for cls in (storage.RecordStore, storage.SQLiteRecordStore)}
+
+    def apply_batch(self, entries, expected=None):
+        if len(applied) == after_batches:
+            raise SystemExit("crash")
+        real_apply[type(self)](self, entries, expected)
+        applied.append(entries)
+
+    for cls in real_apply:
+        monkeypatch.setattr(cls, "apply_batch", apply_batch)
+
+    def remove(path):
+        raise SystemExit("crash")
+    monkeypatch.setattr(storage.os, "remove", remove)
+
+
+def commit_profiles(accounts, profiles, journal_dir, version):
+    with UnitOfWork(journal_dir) as uow:
+        uow.upsert(accounts, {"username": "Ada", "role": "student"})
+        uow.upsert(profiles, {"student_name": "Ada", "version": version})
+
+
+def test_applied_journal_does_not_overwrite_newer_save(stores, monkeypatch):
+    accounts, profiles, journal_dir = stores
+    with monkeypatch.context() as patched:
+        crash_before_journal_removed(patched, after_batches=2)
+        with pytest.raises(SystemExit):
+            commit_profiles(accounts, profiles, journal_dir, 1)
+    assert len(os.listdir(journal_dir)) == 1
+    profiles.upsert({"student_name": "Ada", "version": 2})
+
+    assert recover_transactions(journal_dir) == 1
+    assert profiles.get("Ada")["version"] == 2
+    assert os.listdir(journal_dir) == []
+
+
+def test_unapplied_batches_are_replayed(stores, monkeypatch):
+    accounts, profiles, journal_dir = stores
+    with monkeypatch.context() as patched:
+        crash_before_journal_removed(patched, after_batches=1)
+        with pytest.raises(SystemExit):
+            commit_profiles(accounts, profiles, journal_dir, 1)
+    assert accounts.get("Ada") == {"username": "Ada", "role": "student"}
+    assert profiles.get("Ada") is None
+
+    assert recover_transactions(journal_dir) == 1
+    assert profiles.get("Ada") == {"student_name": "Ada", "version": 1}
+    assert accounts.get("Ada") == {"username": "Ada", "role": "student"}
+    assert os.listdir(journal_dir) == []